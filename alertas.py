@@ -0,0 +1,179 @@
+"""Envio de alertas para o Telegram sem bloquear os pedidos web.
+
+As mensagens entram numa fila limitada e são enviadas por uma thread própria,
+que mantém um único `telegram.Bot` (e a sua sessão HTTP) e um único event loop.
+Mensagens que chegam dentro da janela de agrupamento seguem juntas numa só
+mensagem, e as falhas de rede são repetidas com espera exponencial.
+
+Para testes, TELEGRAM_API_URL pode apontar para um servidor local que imite a
+API do Telegram (ex.: http://127.0.0.1:8081/bot).
+"""
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LIMITE_TEXTO_TELEGRAM = 4096
+_PARAR = object()
+
+
+class DespachanteTelegram:
+    """Fila de alertas com envio em segundo plano, agrupamento e novas tentativas."""
+
+    def __init__(self, token, chat_id, base_url=None, tamanho_fila=100,
+                 janela_agrupamento=2.0, max_tentativas=5, espera_inicial=1.0):
+        self.token = token
+        self.chat_id = chat_id
+        self.base_url = base_url
+        self.janela_agrupamento = janela_agrupamento
+        self.max_tentativas = max_tentativas
+        self.espera_inicial = espera_inicial
+        self._fila = queue.Queue(maxsize=tamanho_fila)
+        self._thread = None
+        self._trava = threading.Lock()
+        self._bot_iniciado = False
+
+    def enviar(self, mensagem):
+        """Coloca a mensagem na fila e retorna de imediato. Devolve False se a fila estiver cheia."""
+        self._iniciar()
+        try:
+            self._fila.put_nowait(mensagem)
+            return True
+        except queue.Full:
+            logger.warning("Fila de alertas do Telegram cheia; mensagem descartada.")
+            return False
+
+    def parar(self, timeout=10):
+        """Envia o que ainda estiver na fila e termina a thread."""
+        if self._thread is None:
+            return
+        self._fila.put(_PARAR)
+        self._thread.join(timeout)
+
+    def _iniciar(self):
+        with self._trava:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._trabalhar, name='alertas-telegram', daemon=True)
+                self._thread.start()
+
+    # --- Thread de envio ---
+
+    def _proximo_lote(self):
+        """Espera pela próxima mensagem e junta as que chegarem dentro da janela de agrupamento."""
+        primeira = self._fila.get()
+        if primeira is _PARAR:
+            return None, True
+        mensagens = [primeira]
+        prazo = time.monotonic() + self.janela_agrupamento
+        while True:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                mensagem = self._fila.get(timeout=restante)
+            except queue.Empty:
+                break
+            if mensagem is _PARAR:
+                return mensagens, True
+            mensagens.append(mensagem)
+        return mensagens, False
+
+    def _trabalhar(self):
+        import telegram
+
+        argumentos = {'token': self.token}
+        if self.base_url:
+            argumentos['base_url'] = self.base_url
+        bot = telegram.Bot(**argumentos)
+
+        loop = asyncio.new_event_loop()
+        try:
+            parar = False
+            while not parar:
+                mensagens, parar = self._proximo_lote()
+                for texto in _agrupar(mensagens or []):
+                    loop.run_until_complete(self._enviar_com_tentativas(bot, texto))
+        except Exception as e:
+            logger.error(f"Despachante de alertas do Telegram terminou com erro: {e}")
+        finally:
+            try:
+                if self._bot_iniciado:
+                    loop.run_until_complete(bot.shutdown())
+            finally:
+                loop.close()
+
+    async def _enviar_com_tentativas(self, bot, texto):
+        from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+        espera = self.espera_inicial
+        parse_mode = 'Markdown'
+        for tentativa in range(1, self.max_tentativas + 1):
+            try:
+                if not self._bot_iniciado:
+                    # Abre a sessão HTTP uma única vez; é reutilizada por todos os envios
+                    await bot.initialize()
+                    self._bot_iniciado = True
+                await bot.send_message(chat_id=self.chat_id, text=texto, parse_mode=parse_mode)
+                return True
+            except RetryAfter as e:
+                # O próprio Telegram indica quanto esperar
+                atraso = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                await asyncio.sleep(atraso)
+            except BadRequest as e:
+                if parse_mode is None:
+                    logger.error(f"Alerta recusado pelo Telegram: {e}")
+                    return False
+                # Normalmente é Markdown inválido (ex.: "_" num nome); reenvia como texto simples
+                parse_mode = None
+            except NetworkError as e:
+                logger.warning(f"Falha de rede ao enviar alerta (tentativa {tentativa}): {e}")
+                await asyncio.sleep(espera)
+                espera *= 2
+            except TelegramError as e:
+                logger.error(f"Erro ao enviar alerta para o Telegram: {e}")
+                return False
+        logger.error("Alerta do Telegram descartado após esgotar as tentativas.")
+        return False
+
+
+def _agrupar(mensagens):
+    """Junta as mensagens em textos que respeitem o limite de tamanho do Telegram."""
+    textos, atual = [], ''
+    for mensagem in mensagens:
+        mensagem = mensagem[:LIMITE_TEXTO_TELEGRAM]
+        candidato = f"{atual}\n\n{mensagem}" if atual else mensagem
+        if len(candidato) > LIMITE_TEXTO_TELEGRAM:
+            textos.append(atual)
+            candidato = mensagem
+        atual = candidato
+    if atual:
+        textos.append(atual)
+    return textos
+
+
+_despachante = None
+_trava_global = threading.Lock()
+
+
+def obter_despachante():
+    """Devolve o despachante partilhado pelo processo, ou None se o Telegram não estiver configurado."""
+    global _despachante
+    with _trava_global:
+        if _despachante is None:
+            token = os.getenv('TELEGRAM_TOKEN')
+            chat_id = os.getenv('TELEGRAM_ADMIN_CHAT_ID')
+            if not token or not chat_id:
+                return None
+            _despachante = DespachanteTelegram(
+                token, chat_id,
+                base_url=os.getenv('TELEGRAM_API_URL'),
+                tamanho_fila=int(os.getenv('TELEGRAM_FILA_MAXIMA', 100)),
+                janela_agrupamento=float(os.getenv('TELEGRAM_JANELA_AGRUPAMENTO', 2.0))
+            )
+            atexit.register(_despachante.parar)
+        return _despachante
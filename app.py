@@ -1,527 +1,1272 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
-from forms import (SecretariaForm, ObraForm, GastoForm, MedicaoForm, 
-                     DetalhesMedicaoForm) # Adicione DetalhesMedicaoForm
-from models import (db, Secretaria, Obra, Andamento, Gasto, Medicao, 
-                    OrcamentoMedicaoObra) # Adicione OrcamentoMedicaoObraimport openpyxl
-from io import BytesIO
-from sqlalchemy import extract
-from datetime import datetime
-import calendar
-import os
-from dotenv import load_dotenv
-import telegram
-#
-from sqlalchemy import or_, desc, asc, func
-from sqlalchemy.orm import joinedload
-from sqlalchemy.exc import IntegrityError
-from datetime import timedelta
-
-# Carrega as variáveis do ficheiro .env para o ambiente
-load_dotenv()
-
-app = Flask(__name__)
-# --- ADICIONE ESTE BLOCO DE CÓDIGO ---
-def format_currency(value):
-    """Formata um número para o padrão de moeda brasileiro (BRL)."""
-    if value is None:
-        return "R$ 0,00"
-    # Esta é uma forma inteligente de trocar pontos por vírgulas e vice-versa.
-    return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-
-# Regista a função como um filtro no ambiente Jinja2
-app.jinja_env.filters['currency'] = format_currency
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db.init_app(app)
-# ADICIONE ESTE NOVO BLOCO
-@app.cli.command("init-db")
-def init_db_command():
-    """Cria as tabelas do banco de dados."""
-    with app.app_context():
-        db.create_all()
-    print("Banco de dados inicializado.")
-    
-@app.route('/')
-def index():
-    # MODIFICADO: Usa options(joinedload(...)) para garantir que as medições sejam carregadas
-    secretarias = Secretaria.query.options(joinedload(Secretaria.medicoes)).all()
-
-    return render_template('dashboard_telegram.html', secretarias=secretarias, active_page='painel')
-
-@app.route('/secretarias')
-def listar_secretarias():
-    secretarias = Secretaria.query.all()
-    # Adicione active_page='secretarias'
-    return render_template('secretarias.html', secretarias=secretarias, active_page='secretarias')
-
-@app.route('/secretaria/adicionar', methods=['GET', 'POST'])
-def adicionar_secretaria():
-    form = SecretariaForm()
-    if form.validate_on_submit():
-        nova_secretaria = Secretaria(nome=form.nome.data)
-        db.session.add(nova_secretaria)
-        
-        try:
-            # Tenta salvar na base de dados
-            db.session.commit()
-            flash('Secretaria criada com sucesso! Agora adicione a primeira medição financeira.', 'success')
-            return redirect(url_for('detalhes_secretaria', secretaria_id=nova_secretaria.id))
-        
-        except IntegrityError:
-            # Se ocorrer um erro de integridade (nome duplicado)
-            db.session.rollback()  # Desfaz a tentativa de adição
-            flash(f'Erro: Já existe uma secretaria com o nome "{form.nome.data}". Por favor, escolha outro nome.', 'danger')
-            # Redireciona de volta para o formulário de adição
-            return redirect(url_for('adicionar_secretaria'))
-
-    return render_template('adicionar_secretaria.html', form=form, active_page='secretarias')
-
-@app.route('/secretaria/<int:secretaria_id>/editar', methods=['GET', 'POST'])
-def editar_secretaria(secretaria_id):
-    secretaria = Secretaria.query.get_or_404(secretaria_id)
-    form = SecretariaForm(obj=secretaria)
-    if form.validate_on_submit():
-        secretaria.nome = form.nome.data
-        db.session.commit()
-        flash('Secretaria atualizada com sucesso!', 'success')
-        return redirect(url_for('listar_secretarias'))
-    return render_template('editar_secretaria.html', form=form, active_page='secretarias')
-
-@app.route('/secretaria/<int:secretaria_id>/remover', methods=['POST'])
-def remover_secretaria(secretaria_id):
-    secretaria = Secretaria.query.get_or_404(secretaria_id)
-    db.session.delete(secretaria)
-    db.session.commit()
-    flash('Secretaria e todas as suas obras foram removidas com sucesso.', 'success')
-    return redirect(url_for('listar_secretarias'))
-
-# Em app.py
-
-@app.route('/api/gastos_diarios/secretaria/<int:secretaria_id>')
-def api_gastos_diarios(secretaria_id):
-    """Retorna dados diários para o gráfico de linha avançado, incluindo marcadores de medição."""
-    with app.app_context():
-        # Carrega a secretaria e todos os seus dados relacionados de forma otimizada (eager loading)
-        secretaria = db.session.query(Secretaria).options(
-            joinedload(Secretaria.medicoes).joinedload(Medicao.orcamentos_obras),
-            joinedload(Secretaria.obras).joinedload(Obra.gastos)
-        ).filter_by(id=secretaria_id).first_or_404()
-
-        medicoes = secretaria.medicoes
-
-        # Se não houver medições, retorna dados vazios para o gráfico não quebrar
-        if not medicoes:
-            return jsonify({'labels': [], 'gastos': [], 'saldos': [], 'teto_orcamento': 0, 'medicoes': []})
-
-        # 1. Encontrar o intervalo de datas completo de todas as medições
-        min_data = min(m.data_inicio for m in medicoes)
-        max_data = max(m.data_fim for m in medicoes)
-
-        # 2. Preparar as estruturas de dados para cada dia no intervalo
-        delta = max_data - min_data
-        datas_range = [min_data + timedelta(days=i) for i in range(delta.days + 1)]
-        
-        labels = [d.strftime('%d/%m') for d in datas_range]
-        gastos_diarios = {d: 0.0 for d in datas_range}
-        orcamentos_diarios = {d: 0.0 for d in datas_range}
-
-        # 3. Processar orçamentos e gastos
-        for medicao in medicoes:
-            if medicao.data_inicio in orcamentos_diarios:
-                orcamentos_diarios[medicao.data_inicio] += medicao.orcamento_total
-
-        todos_gastos = [gasto for obra in secretaria.obras for gasto in obra.gastos if min_data <= gasto.data <= max_data]
-        for gasto in todos_gastos:
-            if gasto.data in gastos_diarios:
-                gastos_diarios[gasto.data] += gasto.valor
-
-        # 4. Calcular as listas de dados para o gráfico
-        lista_gastos = [gastos_diarios[d] for d in datas_range]
-        
-        lista_saldos_acumulados = []
-        saldo_acumulado = 0
-        for d in datas_range:
-            saldo_acumulado += orcamentos_diarios[d]
-            saldo_acumulado -= gastos_diarios[d]
-            lista_saldos_acumulados.append(saldo_acumulado)
-
-        # 5. Preparar os dados para os marcadores
-        dados_medicoes = [
-            {
-                'nome': medicao.nome,
-                'data': medicao.data_inicio.strftime('%d/%m'),
-                'valor': medicao.orcamento_total
-            } for medicao in medicoes if medicao.orcamento_total > 0
-        ]
-
-        # 6. Montar a resposta final
-        response_data = {
-            'labels': labels,
-            'gastos': lista_gastos,
-            'saldos': lista_saldos_acumulados,
-            'teto_orcamento': secretaria.orcamento_consolidado,
-            'medicoes': dados_medicoes
-        }
-
-    return jsonify(response_data)
-
-@app.route('/api/orcamento/obra/<int:obra_id>')
-def api_orcamento_obra(obra_id):
-    """
-    Retorna os dados para o gráfico da obra:
-    - O total gasto na obra.
-    - O saldo restante de TODA a secretaria.
-    """
-    with app.app_context():
-        obra = Obra.query.get_or_404(obra_id)
-        dados = {
-            'gasto_da_obra': obra.total_gasto,
-            'saldo_da_secretaria': obra.secretaria.orcamento_restante
-        }
-    return jsonify(dados)
-
-@app.route('/secretaria/<int:secretaria_id>')
-def detalhes_secretaria(secretaria_id):
-    """Página de detalhes de uma secretaria, mostrando suas obras e medições."""
-    secretaria = Secretaria.query.get_or_404(secretaria_id)
-    form_medicao = MedicaoForm() # Cria uma instância do novo formulário
-    return render_template('detalhes_secretaria.html', 
-                           secretaria=secretaria, 
-                           form_medicao=form_medicao, # Passa o formulário para o template
-                           active_page='secretarias')
-
-@app.route('/secretaria/<int:secretaria_id>/adicionar_medicao', methods=['POST'])
-def adicionar_medicao(secretaria_id):
-    secretaria = Secretaria.query.get_or_404(secretaria_id)
-    form = MedicaoForm()
-    if form.validate_on_submit():
-        nova_medicao = Medicao(
-            nome=form.nome.data,
-            data_inicio=form.data_inicio.data,
-            data_fim=form.data_fim.data,
-            secretaria_id=secretaria.id
-        )
-        db.session.add(nova_medicao)
-        db.session.commit()
-        flash('Período de Medição criado! Agora, defina os orçamentos das obras.', 'success')
-        # Redireciona para a nova página de detalhes da medição
-        return redirect(url_for('detalhes_medicao', medicao_id=nova_medicao.id))
-    else:
-        flash('Erro ao criar a medição.', 'danger')
-    return redirect(url_for('detalhes_secretaria', secretaria_id=secretaria_id))
-
-@app.route('/medicao/<int:medicao_id>', methods=['GET', 'POST'])
-def detalhes_medicao(medicao_id):
-    medicao = Medicao.query.get_or_404(medicao_id)
-    # Busca todas as obras da secretaria-mãe desta medição
-    obras_da_secretaria = medicao.secretaria.obras
-
-    form = DetalhesMedicaoForm()
-
-    if form.validate_on_submit():
-        # Lógica para salvar os dados
-        for obra_form in form.obras:
-            obra_id = int(obra_form.obra_id.data)
-
-            # Procura se já existe um orçamento para esta obra nesta medição
-            orcamento = OrcamentoMedicaoObra.query.filter_by(
-                medicao_id=medicao.id,
-                obra_id=obra_id
-            ).first()
-
-            if not orcamento:
-                # Se não existir, cria um novo
-                orcamento = OrcamentoMedicaoObra(medicao_id=medicao.id, obra_id=obra_id)
-                db.session.add(orcamento)
-
-            # Atualiza os dados
-            orcamento.os_inicial_secretaria = obra_form.os_inicial_secretaria.data or 0.0
-            orcamento.os_qualitech = obra_form.os_qualitech.data or 0.0
-            orcamento.fonte_orcamento_selecionada = obra_form.fonte_orcamento_selecionada.data
-
-        db.session.commit()
-        flash('Orçamentos da medição salvos com sucesso!', 'success')
-        return redirect(url_for('detalhes_medicao', medicao_id=medicao_id))
-
-     # --- LÓGICA GET MODIFICADA ---
-    orcamentos_existentes = {orc.obra_id: orc for orc in medicao.orcamentos_obras}
-    
-    for obra in obras_da_secretaria:
-        orcamento_existente = orcamentos_existentes.get(obra.id)
-        dados_obra = {'obra_id': obra.id, 'nome': obra.nome} # Passa o nome da obra
-        
-        if orcamento_existente:
-            dados_obra.update({
-                'os_inicial_secretaria': orcamento_existente.os_inicial_secretaria,
-                'os_qualitech': orcamento_existente.os_qualitech,
-                'fonte_orcamento_selecionada': orcamento_existente.fonte_orcamento_selecionada
-            })
-        
-        form.obras.append_entry(dados_obra)
-
-    # Já não precisamos de passar 'obras_da_secretaria' separadamente
-    return render_template('detalhes_medicao.html', 
-                           medicao=medicao, 
-                           form=form,
-                           active_page='secretarias')
-
-# Em app.py
-
-@app.route('/obras')
-def listar_obras():
-    # Captura os parâmetros de pesquisa da URL
-    query_search = request.args.get('q', '')
-    secretaria_id_filter = request.args.get('secretaria_id', '')
-    order_by_filter = request.args.get('ordenar_por', '')
-
-    # Começa a construir a consulta à base de dados
-    query = Obra.query
-
-    # 1. Filtro de Pesquisa por Texto (Nome ou Contrato)
-    if query_search:
-        search_term = f"%{query_search}%"
-        query = query.filter(
-            or_(
-                Obra.nome.ilike(search_term),
-                Obra.n_contrato.ilike(search_term)
-            )
-        )
-
-    # 2. Filtro por Secretaria
-    if secretaria_id_filter:
-        query = query.filter(Obra.secretaria_id == int(secretaria_id_filter))
-
-    # 3. Lógica de Ordenação
-    if order_by_filter == 'maior_gasto':
-        # Esta consulta continua correta
-        query = query.outerjoin(Gasto).group_by(Obra.id).order_by(desc(func.sum(Gasto.valor)))
-    elif order_by_filter == 'menor_gasto':
-        # MODIFICADO AQUI: removemos o .nulls_last()
-        query = query.outerjoin(Gasto).group_by(Obra.id).order_by(asc(func.sum(Gasto.valor)))
-    else:
-        # Ordenação padrão por nome
-        query = query.order_by(Obra.nome)
-        
-    obras_filtradas = query.all()
-
-    # Busca todas as secretarias para popular o menu de filtro
-    todas_secretarias = Secretaria.query.order_by(Secretaria.nome).all()
-
-    return render_template('obras.html', 
-                           obras=obras_filtradas, 
-                           todas_secretarias=todas_secretarias,
-                           active_page='obras')
-
-@app.route('/obra/adicionar', methods=['GET', 'POST'])
-def adicionar_obra():
-    form = ObraForm()
-    form.secretaria_id.choices = [(s.id, s.nome) for s in Secretaria.query.all()]
-    if form.validate_on_submit():
-        nova_obra = Obra()
-        # A função populate_obj agora só preenche os campos existentes no formulário
-        form.populate_obj(nova_obra)
-
-        # Adiciona o andamento inicial
-        novo_andamento = Andamento(obra=nova_obra, data_inicio=datetime.utcnow().date())
-        db.session.add(nova_obra)
-        db.session.add(novo_andamento)
-
-        db.session.commit()
-        flash('Obra cadastrada com sucesso!', 'success')
-        return redirect(url_for('listar_obras'))
-    return render_template('adicionar_obra.html', form=form, active_page='obras')
-
-@app.route('/obra/<int:obra_id>/editar', methods=['GET', 'POST'])
-def editar_obra(obra_id):
-    obra = Obra.query.get_or_404(obra_id)
-    form = ObraForm(obj=obra)
-    form.secretaria_id.choices = [(s.id, s.nome) for s in Secretaria.query.all()]
-    if form.validate_on_submit():
-        form.populate_obj(obra)
-        db.session.commit()
-        flash('Obra atualizada com sucesso!', 'success')
-        return redirect(url_for('listar_obras'))
-    form.secretaria_id.data = obra.secretaria_id # Garante que a secretaria correta está selecionada
-    return render_template('editar_obra.html', form=form, active_page='obras')
-
-@app.route('/obra/<int:obra_id>/remover', methods=['POST'])
-def remover_obra(obra_id):
-    obra = Obra.query.get_or_404(obra_id)
-    db.session.delete(obra)
-    db.session.commit()
-    flash('Obra removida com sucesso!', 'success')
-    return redirect(url_for('listar_obras'))
-
-# Em app.py
-
-@app.route('/obra/<int:obra_id>')
-def detalhes_obra(obra_id):
-    obra = Obra.query.get_or_404(obra_id)
-    form_gasto = GastoForm()
-    
-    # Esta linha carrega a lista de gastos da base de dados
-    gastos_ordenados = obra.gastos 
-    
-    return render_template(
-        'detalhes_obra.html', 
-        obra=obra, 
-        form_gasto=form_gasto, 
-        gastos=gastos_ordenados,
-        active_page='obras'
-    )
-
-@app.route('/obra/<int:obra_id>/adicionar_gasto', methods=['POST'])
-def adicionar_gasto(obra_id):
-    obra = Obra.query.get_or_404(obra_id)
-    form = GastoForm()
-    
-    if form.validate_on_submit():
-        valor_gasto_novo = form.valor.data
-
-        # Validação opcional: avisa se o gasto vai deixar a secretaria negativa
-        if valor_gasto_novo > obra.secretaria.orcamento_restante:
-            flash(f'Atenção! Este gasto deixará o saldo geral da secretaria ({obra.secretaria.nome}) negativo.', 'warning')
-
-        # Cria o novo objeto de gasto
-        novo_gasto = Gasto(
-            descricao=form.descricao.data,
-            valor=valor_gasto_novo,
-            data=form.data.data,
-            obra_id=obra.id
-        )
-        
-        # Adiciona o novo gasto à "sessão" (uma área de preparação)
-        db.session.add(novo_gasto)
-        
-        # Grava (commit) permanentemente todas as alterações da sessão na base de dados
-        db.session.commit()
-        
-        flash('Gasto registrado com sucesso!', 'success')
-    else:
-        flash('Erro ao registrar o gasto. Verifique os dados.', 'danger')
-            
-    return redirect(url_for('detalhes_obra', obra_id=obra_id))
-
-@app.route('/gasto/<int:gasto_id>/remover', methods=['POST'])
-def remover_gasto(gasto_id):
-    # Encontra o gasto específico no banco de dados ou retorna erro 404 se não existir.
-    gasto_a_remover = Gasto.query.get_or_404(gasto_id)
-    
-    # Guarda o ID da obra para saber para onde redirecionar no final.
-    obra_id = gasto_a_remover.obra_id
-    
-    # Remove o gasto da sessão do banco de dados.
-    db.session.delete(gasto_a_remover)
-    
-    # Confirma a remoção no banco de dados.
-    db.session.commit()
-    
-    flash('Gasto removido com sucesso!', 'success')
-    
-    # Redireciona o utilizador de volta para a página de detalhes da obra.
-    return redirect(url_for('detalhes_obra', obra_id=obra_id))
-
-# Em app.py
-
-@app.route('/medicao/<int:medicao_id>/editar', methods=['GET', 'POST'])
-def editar_medicao(medicao_id):
-    medicao = Medicao.query.get_or_404(medicao_id)
-    form = MedicaoForm(obj=medicao)
-
-    if form.validate_on_submit():
-        # Atualiza apenas os campos que existem no formulário
-        medicao.nome = form.nome.data
-        medicao.data_inicio = form.data_inicio.data
-        medicao.data_fim = form.data_fim.data
-        
-        # A linha que causava o erro foi removida daqui:
-        # medicao.valor_orcado = form.valor_orcado.data
-        
-        db.session.commit()
-        flash('Medição atualizada com sucesso!', 'success')
-        return redirect(url_for('detalhes_secretaria', secretaria_id=medicao.secretaria_id))
-
-    return render_template('editar_medicao.html', form=form, active_page='secretarias')
-
-@app.route('/medicao/<int:medicao_id>/remover', methods=['POST'])
-def remover_medicao(medicao_id):
-    medicao = Medicao.query.get_or_404(medicao_id)
-    secretaria_id = medicao.secretaria_id # Guarda o ID para redirecionar
-    
-    db.session.delete(medicao)
-    db.session.commit()
-    
-    flash('Medição removida com sucesso.', 'success')
-    return redirect(url_for('detalhes_secretaria', secretaria_id=secretaria_id))
-
-@app.route('/api/orcamento/secretaria/<int:secretaria_id>')
-def api_orcamento_secretaria(secretaria_id):
-    """Retorna os dados do orçamento para o gráfico de uma secretaria."""
-    with app.app_context():
-        # Usamos 'options(joinedload(...))' para garantir que os dados relacionados sejam pré-carregados
-        secretaria = db.session.query(Secretaria).options(
-            joinedload(Secretaria.medicoes).joinedload(Medicao.orcamentos_obras),
-            joinedload(Secretaria.obras).joinedload(Obra.gastos)
-        ).filter_by(id=secretaria_id).first_or_404()
-        
-        # Com os dados pré-carregados, podemos aceder às propriedades com segurança
-        dados = {
-            'nome': secretaria.nome,
-            'orcamento_consolidado': secretaria.orcamento_consolidado, 
-            'orcamento_gasto': secretaria.orcamento_gasto,
-            'orcamento_restante': secretaria.orcamento_restante
-        }
-    return jsonify(dados)
-
-
-def enviar_alerta_telegram(mensagem):
-    """Envia uma mensagem de alerta para o admin via Telegram."""
-    try:
-        token = os.getenv('TELEGRAM_TOKEN')
-        chat_id = os.getenv('TELEGRAM_ADMIN_CHAT_ID')
-        if not token or not chat_id:
-            print("AVISO: Token do Telegram ou Chat ID do admin não configurado no .env")
-            return
-
-        bot = telegram.Bot(token=token)
-        # Usamos a função aninhada para não bloquear a aplicação web
-        async def send_async():
-            await bot.send_message(chat_id=chat_id, text=mensagem, parse_mode='Markdown')
-
-        # Executa a função assíncrona
-        import asyncio
-        asyncio.run(send_async())
-    except Exception as e:
-        print(f"Erro ao enviar alerta para o Telegram: {e}")
-
-@app.route('/relatorio/excel')
-def gerar_excel():
-    workbook = openpyxl.Workbook()
-    
-    # Aba Resumo
-    sheet_resumo = workbook.active
-    sheet_resumo.title = "Resumo"
-    sheet_resumo.append(['Secretaria', 'Orçamento Declarado', 'Orçamento Gasto', 'Orçamento Restante'])
-    for sec in Secretaria.query.all():
-        sheet_resumo.append([sec.nome, sec.orcamento_declarado, sec.orcamento_gasto, sec.orcamento_restante])
-
-    # Aba Extrato
-    sheet_extrato = workbook.create_sheet(title="Extrato de Obras")
-    sheet_extrato.append(['ID Obra', 'Nome da Obra', 'Secretaria', 'Custo Total', 'Status', 'Data de Início', 'Data de Entrega'])
-    for obra in Obra.query.all():
-        sheet_extrato.append([
-            obra.id, obra.nome, obra.secretaria.nome, obra.custo_total,
-            obra.andamento.status, obra.andamento.data_inicio, obra.andamento.data_entrega
-        ])
-
-    # Salva o arquivo em memória
-    output = BytesIO()
-    workbook.save(output)
-    output.seek(0)
-
-    return send_file(output, as_attachment=True, download_name='relatorio_obras.xlsx', mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-
-if __name__ == '__main__':
-    app.run(debug=True)
+from flask import (Blueprint, Flask, current_app, render_template, request, redirect, url_for, flash, jsonify,
+                   send_file, abort, make_response)
+from markupsafe import Markup
+from forms import (SecretariaForm, ObraForm, GastoForm, MedicaoForm, 
+                     DetalhesMedicaoForm, ImportarGastosForm) # Adicione DetalhesMedicaoForm
+from models import (db, Secretaria, Obra, Andamento, Gasto, Medicao, 
+                    OrcamentoMedicaoObra, ResumoObra, ResumoSecretaria) # Adicione OrcamentoMedicaoObraimport openpyxl
+import banco
+import rollups
+import migracoes
+import relatorios
+import series
+import tarefas
+import alertas
+import metricas
+import sinteticos
+import busca
+import paginacao
+import cache
+import eventos
+import importacao
+import periodos
+import fechamentos
+from sqlalchemy import extract
+from datetime import datetime, timezone
+from functools import wraps
+import calendar
+import hashlib
+import click
+import os
+import tempfile
+#
+from sqlalchemy import or_, desc, asc, func, insert, update, delete
+from sqlalchemy.orm import joinedload
+from sqlalchemy.exc import IntegrityError
+from datetime import timedelta
+
+# Rotas e comandos da aplicação; são registados na app por create_app()
+rotas = Blueprint('rotas', __name__, cli_group=None)
+
+# --- ADICIONE ESTE BLOCO DE CÓDIGO ---
+def format_currency(value):
+    """Formata um número para o padrão de moeda brasileiro (BRL)."""
+    if value is None:
+        return "R$ 0,00"
+    # Esta é uma forma inteligente de trocar pontos por vírgulas e vice-versa.
+    return f"R$ {value:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+# As secretarias arquivadas (e as suas obras e medições) respondem 404, como se não existissem
+def _secretaria_ou_404(secretaria_id):
+    return Secretaria.query.filter(Secretaria.id == secretaria_id, Secretaria.ativa).first_or_404()
+
+def _obra_ou_404(obra_id):
+    return Obra.query.join(Secretaria, Obra.secretaria_id == Secretaria.id).filter(
+        Obra.id == obra_id, Secretaria.ativa
+    ).first_or_404()
+
+def _medicao_ou_404(medicao_id):
+    return Medicao.query.join(Secretaria, Medicao.secretaria_id == Secretaria.id).filter(
+        Medicao.id == medicao_id, Secretaria.ativa
+    ).first_or_404()
+
+def _gasto_ou_404(gasto_id):
+    return Gasto.query.join(Obra, Gasto.obra_id == Obra.id).join(Secretaria, Obra.secretaria_id == Secretaria.id).filter(
+        Gasto.id == gasto_id, Secretaria.ativa
+    ).first_or_404()
+
+def _escolhas_secretarias():
+    return [(s.id, s.nome) for s in db.session.query(Secretaria.id, Secretaria.nome).filter(Secretaria.ativa).order_by(Secretaria.nome)]
+
+def _avisar_edicao_tardia(medicoes_fechadas):
+    """Avisa que uma escrita tocou medições fechadas (nomes devolvidos por fechamentos.registrar_*)."""
+    for nome in medicoes_fechadas:
+        flash(f'Atenção! A medição "{nome}" está fechada e esta alteração não entra nos '
+              f'totais gravados. Recalcule ou reabra o fechamento na página da secretaria.', 'warning')
+
+def create_app(config=None):
+    """Cria e configura a aplicação. `config` sobrepõe-se aos valores lidos do ambiente."""
+    from dotenv import load_dotenv
+
+    # Carrega as variáveis do ficheiro .env para o ambiente
+    load_dotenv()
+
+    app = Flask(__name__)
+    # Regista a função como um filtro no ambiente Jinja2
+    app.jinja_env.filters['currency'] = format_currency
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Relatórios em segundo plano (ver tarefas.py)
+    app.config['RELATORIOS_DIR'] = os.getenv('RELATORIOS_DIR')
+    app.config['RELATORIOS_MAX_PROCESSOS'] = int(os.getenv('RELATORIOS_MAX_PROCESSOS', 2))
+    app.config['RELATORIOS_RETENCAO_HORAS'] = int(os.getenv('RELATORIOS_RETENCAO_HORAS', 24))
+    # Instrumentação de consultas e tempos (ver metricas.py); o /_metrics só responde com METRICAS_TOKEN
+    app.config['METRICAS_ATIVAS'] = os.getenv('METRICAS_ATIVAS', '1') != '0'
+    app.config['METRICAS_ORCAMENTO_CONSULTAS'] = int(os.getenv('METRICAS_ORCAMENTO_CONSULTAS', 30))
+    app.config['METRICAS_LIMITE_REPETICOES'] = int(os.getenv('METRICAS_LIMITE_REPETICOES', 5))
+    app.config['METRICAS_TOKEN'] = os.getenv('METRICAS_TOKEN')
+    app.config['OBRAS_POR_PAGINA'] = int(os.getenv('OBRAS_POR_PAGINA', 50))
+    # Segundos que o navegador pode reutilizar uma resposta das APIs sem revalidar (0 = revalida sempre)
+    app.config['API_CACHE_MAX_AGE'] = int(os.getenv('API_CACHE_MAX_AGE', 0))
+    # Cache de cartões do painel e respostas das APIs (ver cache.py); com vários workers, usar 'sqlite'
+    app.config['CACHE_TIPO'] = os.getenv('CACHE_TIPO', 'memoria')
+    app.config['CACHE_TTL'] = int(os.getenv('CACHE_TTL', 60))
+    app.config['CACHE_ITENS'] = int(os.getenv('CACHE_ITENS', 1024))
+    app.config['CACHE_ARQUIVO'] = os.getenv('CACHE_ARQUIVO')
+    # Atualizações do painel por Server-Sent Events (ver eventos.py); desligadas por omissão,
+    # porque cada painel aberto ocupa um worker: ligar só com workers com threads, gevent ou async
+    app.config['EVENTOS_ATIVOS'] = os.getenv('EVENTOS_ATIVOS', '0') == '1'
+    app.config['EVENTOS_ARQUIVO'] = os.getenv('EVENTOS_ARQUIVO')
+    app.config['EVENTOS_INTERVALO'] = float(os.getenv('EVENTOS_INTERVALO', 1))
+    app.config['EVENTOS_DURACAO'] = int(os.getenv('EVENTOS_DURACAO', 5))
+    app.config['EVENTOS_ESPERA'] = int(os.getenv('EVENTOS_ESPERA', 10))
+    app.config['EVENTOS_RETENCAO'] = int(os.getenv('EVENTOS_RETENCAO', 600))
+    # Remover uma secretaria só a arquiva (ver remover_secretaria e `flask purge-archived`)
+    app.config['ARQUIVAR_SECRETARIAS'] = os.getenv('ARQUIVAR_SECRETARIAS', '0') == '1'
+    if config:
+        app.config.update(config)
+    # O mesmo URL (e o mesmo caminho em instance/) e as mesmas opções do engine que o bot usa
+    url = banco.url_banco(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_DATABASE_URI'] = url.render_as_string(hide_password=False)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', banco.opcoes_engine(url))
+
+    db.init_app(app)
+    with app.app_context():
+        banco.configurar_engine(db.engine)
+    metricas.init_app(app)
+    cache.init_app(app)
+    eventos.init_app(app)
+    app.register_blueprint(rotas)
+    return app
+
+@rollups.ao_alterar_secretaria
+def invalidar_cache(secretaria_ids):
+    """Remove do cache as versões, respostas e cartões das secretarias alteradas."""
+    armazenamento = cache.obter()
+    if armazenamento is not None:
+        armazenamento.invalidar(secretaria_ids)
+
+def publicar_alteracao(secretaria_id, data=None, variacao=0.0, serie=False):
+    """Publica para os painéis abertos os totais atuais da secretaria. Chamar depois do commit.
+
+    `data` e `variacao` são o dia e o valor do gasto incluído (positivo) ou removido
+    (negativo), para o gráfico diário ser corrigido só nesse ponto; `serie=True`
+    avisa que as medições mudaram e que a série tem de ser pedida de novo.
+    """
+    canal = eventos.obter()
+    if canal is None:
+        return
+    try:
+        secretaria = db.session.get(Secretaria, secretaria_id)
+        if secretaria is None:
+            return
+        delta = {
+            'secretaria_id': secretaria.id,
+            'orcamento_consolidado': secretaria.orcamento_consolidado,
+            'orcamento_gasto': secretaria.orcamento_gasto,
+            'orcamento_restante': secretaria.orcamento_restante,
+        }
+        if serie:
+            delta['serie'] = True
+        elif data is not None:
+            # A série do painel vai do início da primeira medição ao fim da última, um ponto por dia
+            inicio, fim = db.session.query(func.min(Medicao.data_inicio), func.max(Medicao.data_fim)).filter(
+                Medicao.secretaria_id == secretaria_id
+            ).one()
+            if inicio is not None and inicio <= data <= fim:
+                total_dia = series.gastos_por_dia([secretaria_id], data, data)[secretaria_id].get(data, 0.0)
+                delta['dia'] = {'posicao': (data - inicio).days, 'gasto': total_dia, 'variacao': variacao}
+        canal.publicar('secretaria', delta)
+    except Exception as e:
+        # A escrita já foi gravada; um painel por atualizar não justifica um erro ao utilizador
+        current_app.logger.error(f"Erro ao publicar alteração da secretaria {secretaria_id}: {e}")
+
+# ADICIONE ESTE NOVO BLOCO
+@rotas.cli.command("init-db")
+def init_db_command():
+    """Cria as tabelas do banco de dados."""
+    db.create_all()
+    migracoes.aplicar()
+    print("Banco de dados inicializado.")
+
+@rotas.cli.command("migrate-db")
+def migrate_db_command():
+    """Aplica as migrações de esquema pendentes."""
+    executadas = migracoes.aplicar()
+    if not executadas:
+        print("Nenhuma migração pendente.")
+    for numero, descricao in executadas:
+        print(f"Migração {numero:03d} aplicada: {descricao}")
+
+@rotas.cli.command("check-indexes")
+def check_indexes_command():
+    """Mostra índices em falta e consultas da aplicação que leem tabelas inteiras."""
+    for numero, descricao in migracoes.pendentes():
+        print(f"Migração pendente {numero:03d}: {descricao}")
+    for tabela, indice in migracoes.indices_em_falta():
+        print(f"Índice em falta em {tabela}: {indice}")
+    problemas = migracoes.planos_sem_indice()
+    if problemas is None:
+        print(f"Análise de planos não feita: só existe para SQLite (banco atual: {db.engine.dialect.name}). "
+              "As consultas, incluindo a pesquisa por tsvector em PostgreSQL, não foram verificadas.")
+        return
+    for consulta, passos in problemas.items():
+        print(f"{consulta}: " + "; ".join(passos))
+    if not problemas:
+        print("Todas as consultas verificadas usam índices.")
+
+@rotas.cli.command("seed-synthetic")
+@click.option('--secretarias', default=50, show_default=True)
+@click.option('--obras', default=5000, show_default=True)
+@click.option('--gastos', default=2000000, show_default=True)
+@click.option('--medicoes', default=600, show_default=True)
+@click.option('--semente', default=42, show_default=True, help='A mesma semente gera os mesmos dados.')
+def seed_synthetic_command(secretarias, obras, gastos, medicoes, semente):
+    """Povoa uma base vazia com dados sintéticos à escala de produção."""
+    def progresso(tabela, linhas):
+        print(f"  {tabela}: {linhas} linhas", end='\r' if tabela == 'gasto' else '\n')
+
+    inicio = datetime.now()
+    try:
+        contagem = sinteticos.gerar(secretarias, obras, gastos, medicoes, semente, progresso)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"\nDados sintéticos gerados em {(datetime.now() - inicio).total_seconds():.0f} s: "
+          + ", ".join(f"{linhas} em {tabela}" for tabela, linhas in contagem.items()))
+
+@rotas.cli.command("import-gastos")
+@click.argument('arquivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--secretaria', type=int, help='Procura as obras só nesta secretaria.')
+@click.option('--simular', is_flag=True, help='Valida e mostra o resultado sem gravar nada.')
+@click.option('--erros', type=click.Path(dir_okay=False), help='Grava os erros por linha neste CSV.')
+def import_gastos_command(arquivo, secretaria, simular, erros):
+    """Importa gastos de uma folha CSV ou XLSX (colunas: contrato ou obra, descrição, valor, data)."""
+    inicio = datetime.now()
+    try:
+        formato = importacao.formato_do_arquivo(arquivo)
+        with open(arquivo, 'rb') as f:
+            resultado = importacao.importar(
+                f, formato, secretaria, progresso=lambda linhas: print(f"  {linhas} linhas lidas", end='\r'),
+                maximo_erros=None if erros else importacao.MAXIMO_ERROS
+            )
+    except ValueError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    _concluir_importacao(resultado, simular)
+
+    print(f"\n{'Simulação' if simular else 'Importação'} concluída em {(datetime.now() - inicio).total_seconds():.1f} s: "
+          f"{resultado.linhas} linhas, {resultado.importados} gastos ({format_currency(resultado.valor_importado)}), "
+          f"{resultado.total_erros} com erro.")
+    for dados in resultado.secretarias.values():
+        print(f"  {dados['nome']}: {dados['gastos']} gastos, {format_currency(dados['valor'])}, "
+              f"saldo {format_currency(dados['saldo_antes'])} -> {format_currency(dados['saldo_depois'])}")
+    if not simular:
+        for nome in resultado.medicoes_fechadas:
+            print(f"  Atenção: a medição fechada {nome} recebeu gastos no seu período; "
+                  f"use 'flask check-closed-medicoes --recalcular' ou reabra-a.")
+    for linha, mensagem in resultado.erros[:20]:
+        print(f"  linha {linha}: {mensagem}")
+    if resultado.total_erros > 20:
+        print(f"  ... e mais {resultado.total_erros - 20} erros" + ("" if erros else " (use --erros para os gravar)"))
+    if erros:
+        with open(erros, 'w', encoding='utf-8', newline='') as f:
+            importacao.escrever_erros(resultado, f)
+
+@rotas.cli.command("purge-archived")
+@click.option('--dias', type=int, default=0, help='Só as arquivadas há pelo menos este número de dias.')
+def purge_archived_command(dias):
+    """Apaga de vez as secretarias arquivadas, com as suas obras, gastos e medições."""
+    limite = datetime.utcnow() - timedelta(days=dias)
+    arquivadas = db.session.query(Secretaria.id, Secretaria.nome).filter(
+        Secretaria.arquivada_em.is_not(None), Secretaria.arquivada_em <= limite
+    ).all()
+    if not arquivadas:
+        print("Nenhuma secretaria arquivada para apagar.")
+        return
+    # Um DELETE por secretaria; o resto sai pelo ON DELETE CASCADE
+    db.session.execute(delete(Secretaria).where(Secretaria.id.in_([s.id for s in arquivadas])))
+    db.session.commit()
+    print(f"Apagadas {len(arquivadas)} secretarias arquivadas: " + ", ".join(s.nome for s in arquivadas))
+
+@rotas.cli.command("restore-secretaria")
+@click.argument('secretaria_id', type=int)
+def restore_secretaria_command(secretaria_id):
+    """Devolve à aplicação uma secretaria arquivada."""
+    secretaria = db.session.get(Secretaria, secretaria_id)
+    if secretaria is None or secretaria.ativa:
+        raise click.ClickException(f"Não há uma secretaria arquivada com o id {secretaria_id}.")
+    secretaria.arquivada_em = None
+    rollups.marcar_alterada(secretaria_id)
+    db.session.commit()
+    print(f"Secretaria \"{secretaria.nome}\" restaurada.")
+
+@rotas.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recalcula do zero as tabelas de resumo financeiro."""
+    secretarias, obras, medicoes = rollups.reconstruir_todos()
+    db.session.commit()
+    print(f"Resumos reconstruídos: {secretarias} secretarias, {obras} obras, {medicoes} medições.")
+
+@rotas.cli.command("check-closed-medicoes")
+@click.option('--recalcular', is_flag=True, help='Grava os totais atuais nos fechamentos alterados.')
+def check_closed_medicoes_command(recalcular):
+    """Compara os fechamentos de medição com os gastos e orçamentos atuais."""
+    alterados = fechamentos.verificar()
+    for medicao, fechamento in alterados:
+        print(f"  {medicao.secretaria.nome} / {medicao.nome}: fechada em {fechamento.fechado_em:%d/%m/%Y}, "
+              f"alterada depois em {fechamento.alterado_em:%d/%m/%Y %H:%M}")
+        if recalcular:
+            fechamentos.recalcular(medicao)
+    db.session.commit()
+    if not alterados:
+        print("Nenhum fechamento alterado.")
+    else:
+        print(f"{len(alterados)} fechamentos alterados" + (" e recalculados." if recalcular else
+                                                          " (use --recalcular para gravar os totais atuais)."))
+
+@rotas.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Volta a indexar todas as obras para a pesquisa de texto."""
+    busca.reconstruir_indice(db.session.connection())
+    db.session.commit()
+    print("Índice de pesquisa reconstruído.")
+    
+@rotas.route('/')
+def index():
+    # Cada cartão é renderizado uma vez por versão da secretaria e depois vem do cache;
+    # só as secretarias alteradas desde a última renderização são lidas da base
+    versoes = db.session.query(Secretaria.id, Secretaria.versao).filter(Secretaria.ativa).order_by(Secretaria.id).all()
+    armazenamento = cache.obter()
+    cartoes = {}
+    if armazenamento is not None:
+        for secretaria_id, versao in versoes:
+            cartoes[secretaria_id] = armazenamento.obter(f'cartao:{secretaria_id}.{versao}')
+
+    em_falta = [secretaria_id for secretaria_id, _ in versoes if cartoes.get(secretaria_id) is None]
+    if em_falta:
+        # MODIFICADO: Usa options(joinedload(...)) para garantir que as medições sejam carregadas
+        secretarias = Secretaria.query.options(joinedload(Secretaria.medicoes)).filter(Secretaria.id.in_(em_falta)).all()
+        for secretaria in secretarias:
+            cartao = render_template('cartao_secretaria.html', secretaria=secretaria)
+            if armazenamento is not None:
+                armazenamento.guardar(f'cartao:{secretaria.id}.{secretaria.versao}', cartao, secretaria.id)
+            cartoes[secretaria.id] = cartao
+
+    # Uma secretaria removida entre as duas leituras fica sem cartão
+    cartoes = [Markup(cartoes[secretaria_id]) for secretaria_id, _ in versoes if cartoes.get(secretaria_id)]
+    return render_template('dashboard_telegram.html', cartoes=cartoes, active_page='painel')
+
+@rotas.route('/secretarias')
+def listar_secretarias():
+    secretarias = Secretaria.query.filter(Secretaria.ativa).all()
+    # Adicione active_page='secretarias'
+    return render_template('secretarias.html', secretarias=secretarias, active_page='secretarias')
+
+@rotas.route('/secretaria/adicionar', methods=['GET', 'POST'])
+def adicionar_secretaria():
+    form = SecretariaForm()
+    if form.validate_on_submit():
+        nova_secretaria = Secretaria(nome=form.nome.data)
+        db.session.add(nova_secretaria)
+        
+        try:
+            # Tenta salvar na base de dados
+            db.session.flush()
+            # Uma secretaria nova muda o painel (a lista de secretarias)
+            rollups.marcar_alterada(nova_secretaria.id)
+            db.session.commit()
+            flash('Secretaria criada com sucesso! Agora adicione a primeira medição financeira.', 'success')
+            return redirect(url_for('.detalhes_secretaria', secretaria_id=nova_secretaria.id))
+        
+        except IntegrityError:
+            # Se ocorrer um erro de integridade (nome duplicado)
+            db.session.rollback()  # Desfaz a tentativa de adição
+            arquivada = db.session.query(Secretaria.id).filter(
+                Secretaria.nome == form.nome.data, ~Secretaria.ativa
+            ).scalar()
+            if arquivada is not None:
+                flash(f'Erro: A secretaria "{form.nome.data}" está arquivada. '
+                      f'Pode ser restaurada com `flask restore-secretaria {arquivada}`.', 'danger')
+                return redirect(url_for('.adicionar_secretaria'))
+            flash(f'Erro: Já existe uma secretaria com o nome "{form.nome.data}". Por favor, escolha outro nome.', 'danger')
+            # Redireciona de volta para o formulário de adição
+            return redirect(url_for('.adicionar_secretaria'))
+
+    return render_template('adicionar_secretaria.html', form=form, active_page='secretarias')
+
+@rotas.route('/secretaria/<int:secretaria_id>/editar', methods=['GET', 'POST'])
+def editar_secretaria(secretaria_id):
+    secretaria = _secretaria_ou_404(secretaria_id)
+    form = SecretariaForm(obj=secretaria)
+    if form.validate_on_submit():
+        secretaria.nome = form.nome.data
+        rollups.marcar_alterada(secretaria.id)
+        db.session.commit()
+        flash('Secretaria atualizada com sucesso!', 'success')
+        return redirect(url_for('.listar_secretarias'))
+    return render_template('editar_secretaria.html', form=form, active_page='secretarias')
+
+@rotas.route('/secretaria/<int:secretaria_id>/remover', methods=['POST'])
+def remover_secretaria(secretaria_id):
+    secretaria = _secretaria_ou_404(secretaria_id)
+    rollups.marcar_alterada(secretaria_id)
+    if current_app.config['ARQUIVAR_SECRETARIAS']:
+        # Não toca nas obras nem nos gastos: a secretaria só deixa de aparecer
+        secretaria.arquivada_em = datetime.utcnow()
+        db.session.commit()
+        flash('Secretaria arquivada com sucesso. As suas obras e gastos foram mantidos.', 'success')
+    else:
+        # As obras, gastos e medições saem pelo ON DELETE CASCADE da base, sem serem carregados
+        db.session.delete(secretaria)
+        db.session.commit()
+        flash('Secretaria e todas as suas obras foram removidas com sucesso.', 'success')
+    return redirect(url_for('.listar_secretarias'))
+
+# --- Respostas condicionais (ETag / Last-Modified) das APIs dos gráficos ---
+
+# Sobe quando o formato das respostas muda, para que ETags antigas deixem de valer
+VERSAO_RESPOSTAS_API = 2
+
+def _resposta_condicional(versao_de):
+    """Responde 304 sem executar a vista quando o cliente já tem a versão atual dos dados.
+
+    `versao_de(**argumentos_da_rota)` devolve (etiqueta, atualizado_em, secretaria_id),
+    lidos das colunas versao/atualizado_em das secretarias envolvidas, ou None para
+    servir a vista sem cache condicional (ex.: secretaria inexistente, que dá 404 na
+    vista). A query string entra na ETag, pois muda o conteúdo (ex.: `from`/`to`).
+
+    As respostas 200 ficam no cache da aplicação com a ETag na chave; um pedido sem
+    ETag, ou com uma antiga, recebe o corpo guardado sem correr a vista.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envolvida(**kwargs):
+            versao = versao_de(**kwargs)
+            if versao is None:
+                return vista(**kwargs)
+            etiqueta, atualizado_em, secretaria_id = versao
+            etiqueta = f'v{VERSAO_RESPOSTAS_API}-{etiqueta}'
+            if request.query_string:
+                etiqueta += '-' + hashlib.sha1(request.query_string).hexdigest()[:12]
+            # Last-Modified só tem resolução de segundos
+            if atualizado_em is not None:
+                atualizado_em = atualizado_em.replace(microsecond=0, tzinfo=timezone.utc)
+
+            # Com If-None-Match, o If-Modified-Since é ignorado (RFC 9110)
+            if request.if_none_match:
+                nao_modificado = request.if_none_match.contains(etiqueta)
+            else:
+                nao_modificado = bool(
+                    atualizado_em and request.if_modified_since and atualizado_em <= request.if_modified_since
+                )
+            if nao_modificado:
+                resposta = current_app.response_class(status=304)
+            else:
+                resposta = _resposta_em_cache(f'api:{request.endpoint}:{etiqueta}', secretaria_id, vista, kwargs)
+            if resposta.status_code not in (200, 304):
+                return resposta
+
+            resposta.set_etag(etiqueta)
+            if atualizado_em is not None:
+                resposta.last_modified = atualizado_em
+            resposta.cache_control.private = True
+            max_age = current_app.config['API_CACHE_MAX_AGE']
+            if max_age:
+                resposta.cache_control.max_age = max_age
+            else:
+                resposta.cache_control.no_cache = True
+            return resposta
+        return envolvida
+    return decorador
+
+def _resposta_em_cache(chave, secretaria_id, vista, kwargs):
+    armazenamento = cache.obter()
+    guardada = armazenamento.obter(chave) if armazenamento is not None else None
+    if guardada is not None:
+        corpo, mimetype = guardada
+        return current_app.response_class(corpo, mimetype=mimetype)
+    resposta = make_response(vista(**kwargs))
+    if armazenamento is not None and resposta.status_code == 200:
+        armazenamento.guardar(chave, (resposta.get_data(), resposta.mimetype), secretaria_id)
+    return resposta
+
+def _versao_em_cache(chave, ler):
+    """A versão lida por `ler()` fica no cache até a sua secretaria mudar (ver invalidar_cache)."""
+    armazenamento = cache.obter()
+    if armazenamento is None:
+        return ler()
+    versao = armazenamento.obter(chave)
+    if versao is None:
+        versao = ler()
+        if versao is not None:
+            armazenamento.guardar(chave, versao, versao[2])
+    return versao
+
+def _versao_secretaria(secretaria_id):
+    def ler():
+        linha = db.session.query(Secretaria.versao, Secretaria.atualizado_em).filter(
+            Secretaria.id == secretaria_id, Secretaria.ativa
+        ).first()
+        if linha is None:
+            return None
+        return f'sec{secretaria_id}.{linha.versao}', linha.atualizado_em, secretaria_id
+    return _versao_em_cache(f'versao:sec{secretaria_id}', ler)
+
+def _versao_obra(obra_id):
+    def ler():
+        # A obra muda de secretaria ao ser editada: o id da secretaria também entra na etiqueta
+        linha = db.session.query(Obra.secretaria_id, Secretaria.versao, Secretaria.atualizado_em).join(
+            Secretaria, Obra.secretaria_id == Secretaria.id
+        ).filter(Obra.id == obra_id, Secretaria.ativa).first()
+        if linha is None:
+            return None
+        return f'obra{obra_id}.sec{linha.secretaria_id}.{linha.versao}', linha.atualizado_em, linha.secretaria_id
+    return _versao_em_cache(f'versao:obra{obra_id}', ler)
+
+def _versao_painel():
+    """Versões de todas as secretarias do painel (ou das pedidas em `ids`), numa só leitura."""
+    ids_param = request.args.get('ids', '')
+
+    def ler():
+        consulta = db.session.query(Secretaria.id, Secretaria.versao, Secretaria.atualizado_em).filter(
+            Secretaria.ativa
+        ).order_by(Secretaria.id)
+        if ids_param:
+            try:
+                consulta = consulta.filter(Secretaria.id.in_([int(i) for i in ids_param.split(',') if i.strip()]))
+            except ValueError:
+                return None
+        linhas = consulta.all()
+        # Secretarias novas ou removidas também mudam a etiqueta
+        resumo = ','.join(f'{linha.id}.{linha.versao}' for linha in linhas)
+        atualizacoes = [linha.atualizado_em for linha in linhas if linha.atualizado_em is not None]
+        etiqueta = 'painel.' + hashlib.sha1(resumo.encode('ascii')).hexdigest()[:16]
+        # Depende de todas as secretarias: sem secretaria própria, sai em qualquer invalidação
+        return etiqueta, max(atualizacoes, default=None), None
+    return _versao_em_cache(f'versao:painel:{ids_param}', ler)
+
+# Em app.py
+
+def _parametros_serie():
+    """Lê `from`, `to` (AAAA-MM-DD) e `granularity` (day|week|month) da query string."""
+    granularidade = request.args.get('granularity', 'day')
+    if granularidade not in series.GRANULARIDADES:
+        raise ValueError('granularity deve ser day, week ou month.')
+    datas = {}
+    for param in ('from', 'to'):
+        valor = request.args.get(param)
+        datas[param] = datetime.strptime(valor, '%Y-%m-%d').date() if valor else None
+    return {'inicio': datas['from'], 'fim': datas['to'], 'granularidade': granularidade}
+
+@rotas.route('/api/gastos_diarios/secretaria/<int:secretaria_id>')
+@_resposta_condicional(_versao_secretaria)
+def api_gastos_diarios(secretaria_id):
+    """Retorna dados diários para o gráfico de linha avançado, incluindo marcadores de medição.
+
+    Aceita `from`/`to` para recortar o período e `granularity=day|week|month` para agrupar.
+    """
+    try:
+        parametros = _parametros_serie()
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    secretaria = _secretaria_ou_404(secretaria_id)
+    # Os gastos chegam já somados por dia (GROUP BY), sem carregar cada Gasto
+    response_data = series.series_secretarias([secretaria.id], **parametros)[secretaria.id]
+    return jsonify(response_data)
+
+@rotas.route('/api/painel')
+@_resposta_condicional(_versao_painel)
+def api_painel():
+    """Retorna, numa única resposta, os dados de todos os gráficos do painel.
+
+    Aceita `?ids=1,2,3` para limitar às secretarias pedidas; sem o parâmetro devolve todas.
+    Os parâmetros `from`, `to` e `granularity` valem para as séries, como em /api/gastos_diarios.
+    """
+    try:
+        parametros = _parametros_serie()
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+
+    query = Secretaria.query.filter(Secretaria.ativa).order_by(Secretaria.nome)
+    ids_param = request.args.get('ids', '')
+    if ids_param:
+        try:
+            ids = [int(i) for i in ids_param.split(',') if i.strip()]
+        except ValueError:
+            return jsonify({'erro': 'Parâmetro ids inválido.'}), 400
+        query = query.filter(Secretaria.id.in_(ids))
+    secretarias = query.all()
+
+    series_por_id = series.series_secretarias([s.id for s in secretarias], **parametros) if secretarias else {}
+    dados = [
+        {
+            'id': secretaria.id,
+            'nome': secretaria.nome,
+            'orcamento_consolidado': secretaria.orcamento_consolidado,
+            'orcamento_gasto': secretaria.orcamento_gasto,
+            'orcamento_restante': secretaria.orcamento_restante,
+            'serie': series_por_id[secretaria.id]
+        } for secretaria in secretarias
+    ]
+    return jsonify({'secretarias': dados})
+
+@rotas.route('/api/eventos')
+def api_eventos():
+    """Stream SSE com os deltas das secretarias (ver eventos.py); retoma a partir de Last-Event-ID."""
+    canal = eventos.obter()
+    if canal is None:
+        abort(404)
+    ultimo = request.headers.get('Last-Event-ID', type=int)
+    if ultimo is None:
+        ultimo = canal.ultimo_id()
+    corpo = eventos.transmitir(
+        canal, ultimo, current_app.config['EVENTOS_INTERVALO'], current_app.config['EVENTOS_DURACAO'],
+        current_app.config['EVENTOS_ESPERA']
+    )
+    resposta = current_app.response_class(corpo, mimetype='text/event-stream')
+    resposta.headers['Cache-Control'] = 'no-cache'
+    # Sem isto o nginx junta os eventos num buffer e entrega-os atrasados
+    resposta.headers['X-Accel-Buffering'] = 'no'
+    return resposta
+
+@rotas.route('/api/obras/autocompletar')
+def api_autocompletar_obras():
+    """Sugestões para a caixa de pesquisa: `?q=` com o texto escrito e `limite` (até 20)."""
+    limite = min(request.args.get('limite', 10, type=int) or 10, 20)
+    return jsonify(busca.autocompletar(request.args.get('q', ''), limite))
+
+@rotas.route('/api/orcamento/obra/<int:obra_id>')
+@_resposta_condicional(_versao_obra)
+def api_orcamento_obra(obra_id):
+    """
+    Retorna os dados para o gráfico da obra:
+    - O total gasto na obra.
+    - O saldo restante de TODA a secretaria.
+    """
+    obra = _obra_ou_404(obra_id)
+    dados = {
+        'gasto_da_obra': obra.total_gasto,
+        'saldo_da_secretaria': obra.secretaria.orcamento_restante
+    }
+    return jsonify(dados)
+
+@rotas.route('/secretaria/<int:secretaria_id>')
+def detalhes_secretaria(secretaria_id):
+    """Página de detalhes de uma secretaria, mostrando suas obras e medições."""
+    secretaria = _secretaria_ou_404(secretaria_id)
+    form_medicao = MedicaoForm() # Cria uma instância do novo formulário
+    # Os gastos de todas as medições saem de uma só consulta por dia (ver periodos.py). As
+    # sobreposições e lacunas são procuradas entre todos os períodos, abertos ou fechados;
+    # nas linhas das medições fechadas, o template usa os totais gravados no fecho
+    medicoes = secretaria.medicoes
+    gastos_diarios = {}
+    if medicoes:
+        gastos_diarios = series.gastos_por_dia(
+            [secretaria.id], min(m.data_inicio for m in medicoes), max(m.data_fim for m in medicoes)
+        )[secretaria.id]
+    atribuicao = periodos.atribuir(medicoes, gastos_diarios)
+    return render_template('detalhes_secretaria.html', 
+                           secretaria=secretaria, 
+                           atribuicao=atribuicao,
+                           form_medicao=form_medicao, # Passa o formulário para o template
+                           active_page='secretarias')
+
+@rotas.route('/secretaria/<int:secretaria_id>/adicionar_medicao', methods=['POST'])
+def adicionar_medicao(secretaria_id):
+    secretaria = _secretaria_ou_404(secretaria_id)
+    form = MedicaoForm()
+    if form.validate_on_submit():
+        nova_medicao = Medicao(
+            nome=form.nome.data,
+            data_inicio=form.data_inicio.data,
+            data_fim=form.data_fim.data,
+            secretaria_id=secretaria.id
+        )
+        db.session.add(nova_medicao)
+        # A nova medição aparece como marcador nas séries da secretaria
+        rollups.marcar_alterada(secretaria.id)
+        db.session.commit()
+        publicar_alteracao(secretaria.id, serie=True)
+        flash('Período de Medição criado! Agora, defina os orçamentos das obras.', 'success')
+        # Redireciona para a nova página de detalhes da medição
+        return redirect(url_for('.detalhes_medicao', medicao_id=nova_medicao.id))
+    else:
+        flash('Erro ao criar a medição.', 'danger')
+    return redirect(url_for('.detalhes_secretaria', secretaria_id=secretaria_id))
+
+ORCAMENTOS_POR_PAGINA = 50
+
+@rotas.route('/medicao/<int:medicao_id>', methods=['GET', 'POST'])
+def detalhes_medicao(medicao_id):
+    medicao = _medicao_ou_404(medicao_id)
+    pagina = request.args.get('pagina', 1, type=int)
+
+    form = DetalhesMedicaoForm()
+
+    if form.validate_on_submit():
+        # Cada linha do formulário já vem com os valores normalizados
+        linhas = {
+            int(obra_form.obra_id.data): (
+                obra_form.os_inicial_secretaria.data or 0.0,
+                obra_form.os_qualitech.data or 0.0,
+                obra_form.fonte_orcamento_selecionada.data
+            ) for obra_form in form.obras
+        }
+
+        # Uma única consulta para os orçamentos que já existem nesta página
+        existentes = {
+            linha.obra_id: linha for linha in db.session.query(
+                OrcamentoMedicaoObra.id, OrcamentoMedicaoObra.obra_id,
+                OrcamentoMedicaoObra.os_inicial_secretaria, OrcamentoMedicaoObra.os_qualitech,
+                OrcamentoMedicaoObra.fonte_orcamento_selecionada
+            ).filter(
+                OrcamentoMedicaoObra.medicao_id == medicao.id,
+                OrcamentoMedicaoObra.obra_id.in_(linhas.keys())
+            )
+        }
+
+        novos, alterados = [], []
+        for obra_id, (os_inicial, os_qualitech, fonte) in linhas.items():
+            valores = {'os_inicial_secretaria': os_inicial, 'os_qualitech': os_qualitech,
+                       'fonte_orcamento_selecionada': fonte}
+            atual = existentes.get(obra_id)
+            if atual is None:
+                novos.append(dict(valores, medicao_id=medicao.id, obra_id=obra_id))
+            elif (atual.os_inicial_secretaria, atual.os_qualitech, atual.fonte_orcamento_selecionada) != (os_inicial, os_qualitech, fonte):
+                # Só as linhas que realmente mudaram são gravadas
+                alterados.append(dict(valores, id=atual.id))
+
+        # INSERT e UPDATE em lote (executemany), em vez de um flush por obra
+        if novos:
+            db.session.execute(insert(OrcamentoMedicaoObra), novos)
+        if alterados:
+            db.session.execute(update(OrcamentoMedicaoObra), alterados)
+
+        if novos or alterados:
+            rollups.recalcular_medicao(medicao.id, medicao.secretaria_id)
+            tardia = fechamentos.registrar_medicao(medicao)
+            db.session.commit()
+            publicar_alteracao(medicao.secretaria_id, serie=True)
+            flash(f'Orçamentos da medição salvos com sucesso! ({len(novos)} novos, {len(alterados)} alterados)', 'success')
+            _avisar_edicao_tardia(tardia)
+        else:
+            flash('Nenhum orçamento foi alterado.', 'info')
+        return redirect(url_for('.detalhes_medicao', medicao_id=medicao_id, pagina=pagina))
+    elif form.is_submitted():
+        flash('Erro ao salvar os orçamentos. Verifique os valores.', 'danger')
+        form = DetalhesMedicaoForm(formdata=None)
+
+     # --- LÓGICA GET MODIFICADA ---
+    # Só as obras da página visível entram no formulário
+    paginacao = Obra.query.filter_by(secretaria_id=medicao.secretaria_id).order_by(Obra.nome, Obra.id).paginate(
+        page=pagina, per_page=ORCAMENTOS_POR_PAGINA, error_out=False
+    )
+    obras_da_pagina = paginacao.items
+    orcamentos_existentes = {
+        orc.obra_id: orc for orc in OrcamentoMedicaoObra.query.filter(
+            OrcamentoMedicaoObra.medicao_id == medicao.id,
+            OrcamentoMedicaoObra.obra_id.in_([obra.id for obra in obras_da_pagina])
+        )
+    }
+    
+    for obra in obras_da_pagina:
+        orcamento_existente = orcamentos_existentes.get(obra.id)
+        dados_obra = {'obra_id': obra.id, 'nome': obra.nome} # Passa o nome da obra
+        
+        if orcamento_existente:
+            dados_obra.update({
+                'os_inicial_secretaria': orcamento_existente.os_inicial_secretaria,
+                'os_qualitech': orcamento_existente.os_qualitech,
+                'fonte_orcamento_selecionada': orcamento_existente.fonte_orcamento_selecionada
+            })
+        
+        form.obras.append_entry(dados_obra)
+
+    # Já não precisamos de passar 'obras_da_secretaria' separadamente
+    return render_template('detalhes_medicao.html', 
+                           medicao=medicao, 
+                           form=form,
+                           paginacao=paginacao,
+                           active_page='secretarias')
+
+# Em app.py
+
+OBRAS_POR_PAGINA_MAXIMO = 200
+
+@rotas.route('/obras')
+def listar_obras():
+    """Lista paginada por chave (`?after=`); `por_pagina` vai até OBRAS_POR_PAGINA_MAXIMO.
+
+    Uma única consulta traz cada obra com o seu total gasto, o saldo da
+    secretaria e o estado, já como colunas, lidos das tabelas de resumo.
+    """
+    # Captura os parâmetros de pesquisa da URL
+    query_search = request.args.get('q', '')
+    secretaria_id_filter = request.args.get('secretaria_id', '')
+    order_by_filter = request.args.get('ordenar_por', '')
+    por_pagina = request.args.get('por_pagina', current_app.config['OBRAS_POR_PAGINA'], type=int)
+    por_pagina = max(1, min(por_pagina, OBRAS_POR_PAGINA_MAXIMO))
+
+    # Sem resumo ainda, os hybrids caem na soma direta (como em Obra.total_gasto)
+    total_gasto = func.coalesce(ResumoObra.total_gasto, Obra.total_gasto)
+    saldo_secretaria = (
+        func.coalesce(ResumoSecretaria.orcamento_consolidado, Secretaria.orcamento_consolidado)
+        - func.coalesce(ResumoSecretaria.total_gasto, Secretaria.orcamento_gasto)
+    )
+    query = db.session.query(
+        Obra.id, Obra.nome, Obra.municipio, Obra.n_contrato, Obra.ordem_servico,
+        Secretaria.nome.label('secretaria_nome'),
+        total_gasto.label('total_gasto'),
+        saldo_secretaria.label('saldo_secretaria'),
+        Andamento.status.label('status'),
+    ).select_from(Obra).join(Secretaria, Obra.secretaria_id == Secretaria.id) \
+        .outerjoin(ResumoObra, ResumoObra.obra_id == Obra.id) \
+        .outerjoin(ResumoSecretaria, ResumoSecretaria.secretaria_id == Secretaria.id) \
+        .outerjoin(Andamento, Andamento.obra_id == Obra.id) \
+        .filter(Secretaria.ativa)
+
+    # 1. Filtro de Pesquisa por Texto (nome, contrato, objeto, município ou endereço), pelo índice de busca
+    encontradas = busca.resultados(query_search)
+    if encontradas is not None:
+        query = query.join(encontradas, encontradas.c.obra_id == Obra.id)
+
+    # 2. Filtro por Secretaria
+    if secretaria_id_filter:
+        query = query.filter(Obra.secretaria_id == int(secretaria_id_filter))
+
+    # 3. Ordenação: a chave termina sempre no id, para a paginação ser estável
+    descendente = False
+    if order_by_filter == 'maior_gasto':
+        chave, descendente = (total_gasto, Obra.id), True
+    elif order_by_filter == 'menor_gasto':
+        chave = (total_gasto, Obra.id)
+    elif encontradas is not None:
+        # Com pesquisa, as mais relevantes primeiro
+        chave = (encontradas.c.relevancia, Obra.id)
+    else:
+        # Ordenação padrão por nome
+        chave = (Obra.nome, Obra.id)
+
+    cursor = request.args.get('after')
+    try:
+        obras_filtradas, seguinte = paginacao.paginar(query, chave, cursor, por_pagina, descendente)
+    except ValueError:
+        abort(400)
+
+    # Busca todas as secretarias para popular o menu de filtro
+    todas_secretarias = Secretaria.query.filter(Secretaria.ativa).order_by(Secretaria.nome).all()
+
+    parametros = {k: v for k, v in request.args.items() if k != 'after'}
+    return render_template('obras.html', 
+                           obras=obras_filtradas, 
+                           todas_secretarias=todas_secretarias,
+                           url_seguinte=url_for('.listar_obras', **parametros, after=seguinte) if seguinte else None,
+                           url_primeira=url_for('.listar_obras', **parametros) if cursor else None,
+                           por_pagina=por_pagina,
+                           active_page='obras')
+
+@rotas.route('/obra/adicionar', methods=['GET', 'POST'])
+def adicionar_obra():
+    form = ObraForm()
+    form.secretaria_id.choices = _escolhas_secretarias()
+    if form.validate_on_submit():
+        nova_obra = Obra()
+        # A função populate_obj agora só preenche os campos existentes no formulário
+        form.populate_obj(nova_obra)
+
+        # Adiciona o andamento inicial
+        novo_andamento = Andamento(obra=nova_obra, data_inicio=datetime.utcnow().date())
+        db.session.add(nova_obra)
+        db.session.add(novo_andamento)
+
+        db.session.commit()
+        flash('Obra cadastrada com sucesso!', 'success')
+        return redirect(url_for('.listar_obras'))
+    return render_template('adicionar_obra.html', form=form, active_page='obras')
+
+@rotas.route('/obra/<int:obra_id>/editar', methods=['GET', 'POST'])
+def editar_obra(obra_id):
+    obra = _obra_ou_404(obra_id)
+    form = ObraForm(obj=obra)
+    form.secretaria_id.choices = _escolhas_secretarias()
+    if form.validate_on_submit():
+        secretaria_anterior = obra.secretaria_id
+        form.populate_obj(obra)
+        movida = obra.secretaria_id != secretaria_anterior
+        tardia = []
+        if movida:
+            # Os gastos da obra mudam de secretaria
+            rollups.recalcular_secretaria(secretaria_anterior)
+            rollups.recalcular_secretaria(obra.secretaria_id)
+            tardia = fechamentos.registrar_obra(obra.id, secretaria_anterior) + \
+                fechamentos.registrar_obra(obra.id, obra.secretaria_id)
+        db.session.commit()
+        if movida:
+            publicar_alteracao(secretaria_anterior, serie=True)
+            publicar_alteracao(obra.secretaria_id, serie=True)
+        flash('Obra atualizada com sucesso!', 'success')
+        _avisar_edicao_tardia(tardia)
+        return redirect(url_for('.listar_obras'))
+    form.secretaria_id.data = obra.secretaria_id # Garante que a secretaria correta está selecionada
+    return render_template('editar_obra.html', form=form, active_page='obras')
+
+@rotas.route('/obra/<int:obra_id>/remover', methods=['POST'])
+def remover_obra(obra_id):
+    obra = _obra_ou_404(obra_id)
+    secretaria_id = obra.secretaria_id
+    # Antes da remoção, enquanto os gastos da obra ainda existem
+    tardia = fechamentos.registrar_obra(obra.id, secretaria_id)
+    db.session.delete(obra)
+    # Os orçamentos da obra saem das medições, por isso refazemos a secretaria inteira
+    rollups.recalcular_secretaria(secretaria_id)
+    db.session.commit()
+    publicar_alteracao(secretaria_id, serie=True)
+    flash('Obra removida com sucesso!', 'success')
+    _avisar_edicao_tardia(tardia)
+    return redirect(url_for('.listar_obras'))
+
+# Em app.py
+
+GASTOS_POR_PAGINA = 50
+GASTOS_POR_PAGINA_MAXIMO = 200
+
+def _pagina_de_gastos(obra_id):
+    """Uma página do histórico de gastos da obra, do mais recente para o mais antigo.
+
+    `acumulado` é o total gasto na obra até essa linha inclusive (por data e id),
+    calculado em SQL com uma função de janela sobre todo o histórico, por isso
+    não muda com os filtros `de`/`ate` (AAAA-MM-DD) e `q` (texto na descrição).
+    A paginação é por chave em (data, id), com o cursor em `after`.
+
+    Devolve (linhas, cursor_seguinte, filtros). ValueError para parâmetros inválidos.
+    """
+    filtros = {'de': request.args.get('de', ''), 'ate': request.args.get('ate', ''), 'q': request.args.get('q', '').strip()}
+    por_pagina = request.args.get('por_pagina', GASTOS_POR_PAGINA, type=int)
+    por_pagina = max(1, min(por_pagina, GASTOS_POR_PAGINA_MAXIMO))
+    try:
+        de = datetime.strptime(filtros['de'], '%Y-%m-%d').date() if filtros['de'] else None
+        ate = datetime.strptime(filtros['ate'], '%Y-%m-%d').date() if filtros['ate'] else None
+    except ValueError:
+        raise ValueError('Datas inválidas: use o formato AAAA-MM-DD.')
+
+    livro = db.session.query(
+        Gasto.id, Gasto.data, Gasto.descricao, Gasto.valor,
+        func.sum(Gasto.valor).over(order_by=(Gasto.data, Gasto.id), rows=(None, 0)).label('acumulado')
+    ).filter(Gasto.obra_id == obra_id).subquery('livro')
+
+    consulta = db.session.query(livro.c.id, livro.c.data, livro.c.descricao, livro.c.valor, livro.c.acumulado)
+    if de:
+        consulta = consulta.filter(livro.c.data >= de)
+    if ate:
+        consulta = consulta.filter(livro.c.data <= ate)
+    if filtros['q']:
+        consulta = consulta.filter(livro.c.descricao.ilike(f"%{filtros['q']}%"))
+
+    linhas, seguinte = paginacao.paginar(
+        consulta, (livro.c.data, livro.c.id), request.args.get('after'), por_pagina, descendente=True
+    )
+    return linhas, seguinte, filtros
+
+@rotas.route('/obra/<int:obra_id>')
+def detalhes_obra(obra_id):
+    obra = _obra_ou_404(obra_id)
+    form_gasto = GastoForm()
+    
+    # Só a página pedida do histórico de gastos, já com o acumulado de cada linha
+    try:
+        gastos_ordenados, seguinte, filtros = _pagina_de_gastos(obra.id)
+    except ValueError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('.detalhes_obra', obra_id=obra.id))
+
+    parametros = {k: v for k, v in request.args.items() if k != 'after'}
+    return render_template(
+        'detalhes_obra.html', 
+        obra=obra, 
+        form_gasto=form_gasto, 
+        gastos=gastos_ordenados,
+        filtros=filtros,
+        cursor_seguinte=seguinte,
+        url_seguinte=url_for('.detalhes_obra', obra_id=obra.id, **parametros, after=seguinte) if seguinte else None,
+        url_primeira=url_for('.detalhes_obra', obra_id=obra.id, **parametros) if request.args.get('after') else None,
+        active_page='obras'
+    )
+
+@rotas.route('/api/obra/<int:obra_id>/gastos')
+def api_gastos_obra(obra_id):
+    """Histórico de gastos paginado, para o scroll infinito da WebApp do Telegram.
+
+    Aceita os mesmos parâmetros da página da obra (`de`, `ate`, `q`, `por_pagina`, `after`)
+    e devolve `seguinte`, o cursor da próxima página (null na última).
+    """
+    obra = _obra_ou_404(obra_id)
+    try:
+        gastos, seguinte, _ = _pagina_de_gastos(obra.id)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    return jsonify({
+        'gastos': [
+            {'id': g.id, 'data': g.data.isoformat(), 'descricao': g.descricao, 'valor': g.valor, 'acumulado': g.acumulado}
+            for g in gastos
+        ],
+        'seguinte': seguinte,
+    })
+
+@rotas.route('/obra/<int:obra_id>/adicionar_gasto', methods=['POST'])
+def adicionar_gasto(obra_id):
+    obra = _obra_ou_404(obra_id)
+    form = GastoForm()
+    
+    if form.validate_on_submit():
+        valor_gasto_novo = form.valor.data
+
+        # Validação opcional: avisa se o gasto vai deixar a secretaria negativa. O saldo é lido
+        # antes da gravação; os avisos só saem depois do commit, para um gasto que existe
+        alerta = None
+        if valor_gasto_novo > obra.secretaria.orcamento_restante:
+            alerta = (
+                f"⚠️ *{obra.secretaria.nome}*: o gasto de {format_currency(valor_gasto_novo)} "
+                f"em *{obra.nome}* deixa o saldo geral negativo "
+                f"({format_currency(obra.secretaria.orcamento_restante - valor_gasto_novo)})."
+            )
+            aviso = f'Atenção! Este gasto deixará o saldo geral da secretaria ({obra.secretaria.nome}) negativo.'
+
+        # Cria o novo objeto de gasto
+        novo_gasto = Gasto(
+            descricao=form.descricao.data,
+            valor=valor_gasto_novo,
+            data=form.data.data,
+            obra_id=obra.id
+        )
+        
+        # Adiciona o novo gasto à "sessão" (uma área de preparação)
+        db.session.add(novo_gasto)
+        rollups.registrar_gasto(obra.id, obra.secretaria_id, valor_gasto_novo)
+        tardia = fechamentos.registrar_gastos(obra.secretaria_id, [form.data.data])
+        
+        # Grava (commit) permanentemente todas as alterações da sessão na base de dados
+        db.session.commit()
+        publicar_alteracao(obra.secretaria_id, form.data.data, valor_gasto_novo)
+        if alerta:
+            flash(aviso, 'warning')
+            enviar_alerta_telegram(alerta)
+        
+        flash('Gasto registrado com sucesso!', 'success')
+        _avisar_edicao_tardia(tardia)
+    else:
+        flash('Erro ao registrar o gasto. Verifique os dados.', 'danger')
+            
+    return redirect(url_for('.detalhes_obra', obra_id=obra_id))
+
+@rotas.route('/gasto/<int:gasto_id>/remover', methods=['POST'])
+def remover_gasto(gasto_id):
+    # Encontra o gasto específico no banco de dados ou retorna erro 404 se não existir.
+    gasto_a_remover = _gasto_ou_404(gasto_id)
+    
+    # Guarda o ID da obra para saber para onde redirecionar no final.
+    obra_id = gasto_a_remover.obra_id
+    
+    # Guarda o que o painel precisa de saber antes de o objeto expirar no commit.
+    secretaria_id, data, valor = gasto_a_remover.obra.secretaria_id, gasto_a_remover.data, gasto_a_remover.valor
+    
+    # Remove o gasto da sessão do banco de dados.
+    db.session.delete(gasto_a_remover)
+    rollups.registrar_gasto(obra_id, secretaria_id, -valor, qtd=-1)
+    tardia = fechamentos.registrar_gastos(secretaria_id, [data])
+    
+    # Confirma a remoção no banco de dados.
+    db.session.commit()
+    publicar_alteracao(secretaria_id, data, -valor)
+    
+    flash('Gasto removido com sucesso!', 'success')
+    _avisar_edicao_tardia(tardia)
+    
+    # Redireciona o utilizador de volta para a página de detalhes da obra.
+    return redirect(url_for('.detalhes_obra', obra_id=obra_id))
+
+def _concluir_importacao(resultado, simular):
+    """Grava (ou desfaz, numa simulação) uma importação e avisa painéis e Telegram uma vez por secretaria."""
+    if simular:
+        db.session.rollback()
+        return
+    db.session.commit()
+    for secretaria_id, dados in resultado.secretarias.items():
+        # Muitos dias mudam de uma vez: o painel pede a série de novo
+        publicar_alteracao(secretaria_id, serie=True)
+        if dados['saldo_depois'] < 0:
+            enviar_alerta_telegram(
+                f"⚠️ *{dados['nome']}*: a importação de {dados['gastos']} gastos "
+                f"({format_currency(dados['valor'])}) deixa o saldo geral negativo "
+                f"({format_currency(dados['saldo_depois'])})."
+            )
+
+@rotas.route('/gastos/importar', methods=['GET', 'POST'])
+def importar_gastos():
+    form = ImportarGastosForm()
+    form.secretaria_id.choices = [(0, 'Todas as secretarias')] + _escolhas_secretarias()
+    resultado = None
+    if form.validate_on_submit():
+        arquivo = form.arquivo.data
+        try:
+            resultado = importacao.importar(
+                arquivo.stream, importacao.formato_do_arquivo(arquivo.filename), form.secretaria_id.data or None
+            )
+        except ValueError as e:
+            db.session.rollback()
+            flash(f'Erro ao ler o ficheiro: {e}', 'danger')
+            return redirect(url_for('.importar_gastos'))
+        _concluir_importacao(resultado, form.simular.data)
+
+        if form.simular.data:
+            flash(f'Simulação: {resultado.importados} gastos seriam importados; {resultado.total_erros} linhas com erro.', 'info')
+        else:
+            flash(f'{resultado.importados} gastos importados ({format_currency(resultado.valor_importado)}); '
+                  f'{resultado.total_erros} linhas com erro.', 'warning' if resultado.total_erros else 'success')
+        for dados in resultado.saldos_negativos.values():
+            flash(f'Atenção! A importação {"deixaria" if form.simular.data else "deixa"} o saldo geral '
+                  f'da secretaria ({dados["nome"]}) negativo.', 'warning')
+        if not form.simular.data:
+            _avisar_edicao_tardia(resultado.medicoes_fechadas)
+    elif form.is_submitted():
+        flash('Erro ao enviar a folha. ' + ' '.join(form.arquivo.errors), 'danger')
+    return render_template('importar_gastos.html', form=form, resultado=resultado, active_page='obras')
+
+# Em app.py
+
+@rotas.route('/medicao/<int:medicao_id>/editar', methods=['GET', 'POST'])
+def editar_medicao(medicao_id):
+    medicao = _medicao_ou_404(medicao_id)
+    form = MedicaoForm(obj=medicao)
+
+    if form.validate_on_submit():
+        # Atualiza apenas os campos que existem no formulário
+        medicao.nome = form.nome.data
+        medicao.data_inicio = form.data_inicio.data
+        medicao.data_fim = form.data_fim.data
+        
+        # A linha que causava o erro foi removida daqui:
+        # medicao.valor_orcado = form.valor_orcado.data
+        
+        rollups.marcar_alterada(medicao.secretaria_id)
+        periodo_mudou = medicao.fechada and (medicao.data_inicio, medicao.data_fim) != (
+            medicao.fechamento.data_inicio, medicao.fechamento.data_fim)
+        tardia = fechamentos.registrar_medicao(medicao) if periodo_mudou else []
+        db.session.commit()
+        publicar_alteracao(medicao.secretaria_id, serie=True)
+        flash('Medição atualizada com sucesso!', 'success')
+        _avisar_edicao_tardia(tardia)
+        return redirect(url_for('.detalhes_secretaria', secretaria_id=medicao.secretaria_id))
+
+    return render_template('editar_medicao.html', form=form, active_page='secretarias')
+
+@rotas.route('/medicao/<int:medicao_id>/remover', methods=['POST'])
+def remover_medicao(medicao_id):
+    medicao = _medicao_ou_404(medicao_id)
+    secretaria_id = medicao.secretaria_id # Guarda o ID para redirecionar
+    
+    db.session.delete(medicao)
+    rollups.recalcular_secretaria(secretaria_id)
+    db.session.commit()
+    publicar_alteracao(secretaria_id, serie=True)
+    
+    flash('Medição removida com sucesso.', 'success')
+    return redirect(url_for('.detalhes_secretaria', secretaria_id=secretaria_id))
+
+# --- Fechamento de medições (ver fechamentos.py) ---
+
+def _acao_de_fechamento(medicao_id, acao, mensagem):
+    medicao = _medicao_ou_404(medicao_id)
+    try:
+        acao(medicao)
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'danger')
+    else:
+        db.session.commit()
+        publicar_alteracao(medicao.secretaria_id, serie=True)
+        flash(mensagem.format(nome=medicao.nome), 'success')
+    return redirect(url_for('.detalhes_secretaria', secretaria_id=medicao.secretaria_id))
+
+@rotas.route('/medicao/<int:medicao_id>/fechar', methods=['POST'])
+def fechar_medicao(medicao_id):
+    return _acao_de_fechamento(medicao_id, fechamentos.fechar,
+                               'Medição "{nome}" fechada: os totais do período ficaram gravados.')
+
+@rotas.route('/medicao/<int:medicao_id>/recalcular', methods=['POST'])
+def recalcular_fechamento(medicao_id):
+    return _acao_de_fechamento(medicao_id, fechamentos.recalcular,
+                               'Os totais gravados da medição "{nome}" foram recalculados.')
+
+@rotas.route('/medicao/<int:medicao_id>/reabrir', methods=['POST'])
+def reabrir_medicao(medicao_id):
+    return _acao_de_fechamento(medicao_id, fechamentos.reabrir,
+                               'Medição "{nome}" reaberta: os totais voltam a ser calculados.')
+
+@rotas.route('/api/orcamento/secretaria/<int:secretaria_id>')
+@_resposta_condicional(_versao_secretaria)
+def api_orcamento_secretaria(secretaria_id):
+    """Retorna os dados do orçamento para o gráfico de uma secretaria."""
+    # O resumo vem no mesmo SELECT da secretaria; não é preciso carregar obras nem gastos
+    secretaria = _secretaria_ou_404(secretaria_id)
+    dados = {
+        'nome': secretaria.nome,
+        'orcamento_consolidado': secretaria.orcamento_consolidado, 
+        'orcamento_gasto': secretaria.orcamento_gasto,
+        'orcamento_restante': secretaria.orcamento_restante
+    }
+    return jsonify(dados)
+
+
+def enviar_alerta_telegram(mensagem):
+    """Envia uma mensagem de alerta para o admin via Telegram.
+
+    A mensagem vai para a fila do despachante (alertas.py) e a função retorna logo;
+    o envio, o agrupamento e as novas tentativas acontecem em segundo plano.
+    """
+    despachante = alertas.obter_despachante()
+    if despachante is None:
+        print("AVISO: Token do Telegram ou Chat ID do admin não configurado no .env")
+        return
+    despachante.enviar(mensagem)
+
+@rotas.route('/relatorio/excel')
+def gerar_excel():
+    # O livro vai para um ficheiro temporário em disco (apagado ao fechar) e é
+    # enviado em blocos, por isso nem o ficheiro nem as linhas ficam em memória
+    arquivo = tempfile.TemporaryFile()
+    relatorios.gerar_excel(arquivo)
+    arquivo.seek(0)
+
+    return send_file(arquivo, as_attachment=True, download_name='relatorio_obras.xlsx', mimetype=relatorios.MIMETYPE_XLSX)
+
+@rotas.route('/relatorio/<tipo>', methods=['POST'])
+def submeter_relatorio(tipo):
+    """Coloca o relatório na fila de segundo plano e devolve o id da tarefa para consulta."""
+    try:
+        tarefa_id = tarefas.submeter(tipo)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 404
+    resposta = jsonify({'id': tarefa_id, 'status': 'pendente',
+                        'url': url_for('.estado_relatorio', tarefa_id=tarefa_id)})
+    return resposta, 202, {'Location': url_for('.estado_relatorio', tarefa_id=tarefa_id)}
+
+@rotas.route('/relatorio/<tarefa_id>')
+def estado_relatorio(tarefa_id):
+    """Estado e progresso de uma tarefa de relatório."""
+    dados = tarefas.estado(tarefa_id)
+    if dados is None:
+        abort(404)
+    if dados['status'] == 'concluida':
+        dados['download'] = url_for('.baixar_relatorio', tarefa_id=tarefa_id)
+    return jsonify(dados)
+
+@rotas.route('/relatorio/<tarefa_id>/download')
+def baixar_relatorio(tarefa_id):
+    encontrado = tarefas.arquivo(tarefa_id)
+    if encontrado is None:
+        abort(404)
+    caminho, mimetype, nome = encontrado
+    return send_file(caminho, as_attachment=True, download_name=nome, mimetype=mimetype)
+
+@rotas.cli.command("limpar-relatorios")
+def limpar_relatorios_command():
+    """Apaga os relatórios gerados que já passaram do período de retenção."""
+    apagados = tarefas.limpar_expirados()
+    print(f"{apagados} ficheiros de relatório apagados.")
+
+# Instância usada pelo `flask run`, pelo servidor WSGI (app:app) e pelos processos de relatórios
+app = create_app()
+
+if __name__ == '__main__':
+    app.run(debug=True)
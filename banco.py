@@ -0,0 +1,110 @@
+"""Configuração da base de dados partilhada pela aplicação web e pelo bot do Telegram.
+
+O URL vem de DATABASE_URL nos dois processos, e um caminho SQLite relativo é
+resolvido dentro de instance/, tal como faz o Flask-SQLAlchemy. O bot usa
+`criar_fabrica` (os modelos de models.py funcionam com uma Session normal; só
+`db.session` e `Modelo.query` precisam de um app_context); a aplicação passa
+`opcoes_engine` ao Flask-SQLAlchemy e chama `configurar_engine` no engine dele.
+
+Em SQLite, cada ligação nova recebe os PRAGMAs de `pragmas_sqlite()`:
+
+- `journal_mode=WAL`: os leitores não bloqueiam o escritor nem o contrário, e a
+  aplicação e o bot podem ler enquanto o outro grava;
+- `synchronous=NORMAL`: com WAL, só o checkpoint faz fsync; um corte de energia
+  pode perder as últimas transações, mas não corrompe a base;
+- `busy_timeout`: um escritor espera pelo outro em vez de falhar logo com
+  "database is locked";
+- `mmap_size` e `cache_size`: leitura por memória mapeada e cache de páginas
+  maior que os 2 MB por omissão;
+- `foreign_keys=ON`: sem ele o SQLite ignora as chaves estrangeiras e o ON
+  DELETE CASCADE (ver models.py).
+
+Os valores podem ser mudados no ambiente (SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_MB,
+SQLITE_MMAP_MB), que os dois processos leem.
+"""
+import os
+import sqlite3
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+DIRETORIO_INSTANCIA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+URL_PADRAO = 'sqlite:///gerenciamento.db'
+
+
+def pragmas_sqlite():
+    """PRAGMAs aplicados a cada ligação SQLite, pela ordem em que são executados."""
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 15000)),
+        'mmap_size': int(os.getenv('SQLITE_MMAP_MB', 256)) * 1024 * 1024,
+        # Negativo: tamanho em KiB, em vez de número de páginas
+        'cache_size': -int(os.getenv('SQLITE_CACHE_MB', 32)) * 1024,
+        'temp_store': 'MEMORY',
+        'foreign_keys': 'ON',
+    }
+
+
+def url_banco(url=None):
+    url = make_url(url or os.getenv('DATABASE_URL') or URL_PADRAO)
+    if url.get_backend_name() == 'sqlite' and url.database and url.database != ':memory:' \
+            and not os.path.isabs(url.database):
+        os.makedirs(DIRETORIO_INSTANCIA, exist_ok=True)
+        url = url.set(database=os.path.join(DIRETORIO_INSTANCIA, url.database))
+    return url
+
+
+def opcoes_engine(url):
+    """Argumentos de create_engine (ou SQLALCHEMY_ENGINE_OPTIONS) adequados ao dialeto de `url`."""
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        if not url.database or url.database == ':memory:':
+            # Uma base em memória só existe na sua ligação: todas as threads usam a mesma
+            return {'poolclass': StaticPool, 'connect_args': {'check_same_thread': False}}
+        return {
+            # O busy_timeout do PRAGMA é o que vale; este é o do driver, em segundos
+            'connect_args': {'timeout': pragmas_sqlite()['busy_timeout'] / 1000, 'check_same_thread': False},
+            # Com WAL há tantos leitores quantas ligações; as escritas continuam uma de cada vez
+            'pool_size': 10,
+            'max_overflow': 10,
+            'pool_timeout': 30,
+        }
+    return {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 30,
+        # O servidor fecha ligações paradas; melhor reciclar antes e testar ao tirar do pool
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+    }
+
+
+def _aplicar_pragmas(conexao_dbapi, registro):
+    if not isinstance(conexao_dbapi, sqlite3.Connection):
+        return
+    cursor = conexao_dbapi.cursor()
+    for nome, valor in pragmas_sqlite().items():
+        cursor.execute(f'PRAGMA {nome}={valor}')
+    cursor.close()
+
+
+def configurar_engine(engine):
+    """Aplica os PRAGMAs de `pragmas_sqlite()` às ligações novas do engine (nada faz noutros dialetos)."""
+    if engine.dialect.name == 'sqlite' and not event.contains(engine, 'connect', _aplicar_pragmas):
+        event.listen(engine, 'connect', _aplicar_pragmas)
+    return engine
+
+
+def criar_engine(url=None, **opcoes):
+    url = url_banco(url)
+    return configurar_engine(create_engine(url, **{**opcoes_engine(url), **opcoes}))
+
+
+def criar_fabrica(url=None, **opcoes):
+    """Devolve um sessionmaker com engine próprio. Cada `with fabrica() as sessao:` abre e fecha uma sessão."""
+    engine = criar_engine(url, **opcoes)
+    # Os resultados são lidos depois do commit (ex.: nomes a mostrar ao utilizador)
+    return sessionmaker(bind=engine, expire_on_commit=False)
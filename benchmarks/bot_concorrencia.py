@@ -0,0 +1,160 @@
+"""Latência do bot do Telegram com N utilizadores em simultâneo.
+
+Simula utilizadores que, ao mesmo tempo, pedem /secretarias e tocam num botão
+de /grafico, chamando diretamente os handlers de bot.py com objetos Update
+falsos (sem rede). Corre duas vezes: com o trabalho feito no próprio event loop
+(como antes) e com o ExecutorBot, e mostra p50/p95/máximo da latência de cada
+pedido e o maior atraso do event loop.
+
+Uso:
+    python benchmarks/bot_concorrencia.py --usuarios 20 --pedidos 5 [--com-cache]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def criar_banco_teste(caminho_db, n_secretarias):
+    """Cria e povoa uma base SQLite temporária; devolve a fábrica de sessões do bot."""
+    import banco
+    from models import db, Secretaria, Obra, Gasto, Medicao, OrcamentoMedicaoObra
+
+    sessoes = banco.criar_fabrica(f'sqlite:///{caminho_db}')
+    with sessoes() as sessao:
+        db.metadata.create_all(sessao.get_bind())
+        hoje = date.today()
+        for i in range(n_secretarias):
+            sec = Secretaria(nome=f'Secretaria {i}')
+            sessao.add(sec)
+            sessao.flush()
+            medicao = Medicao(nome='Medição 1', data_inicio=hoje - timedelta(days=60), data_fim=hoje, secretaria_id=sec.id)
+            sessao.add(medicao)
+            for j in range(10):
+                obra = Obra(nome=f'Obra {i}-{j}', secretaria_id=sec.id)
+                sessao.add(obra)
+                sessao.flush()
+                sessao.add(OrcamentoMedicaoObra(medicao_id=medicao.id, obra_id=obra.id, os_inicial_secretaria=50000))
+                sessao.add_all(
+                    Gasto(descricao='Gasto', valor=random.uniform(100, 5000), obra_id=obra.id,
+                          data=hoje - timedelta(days=random.randint(0, 60)))
+                    for _ in range(50)
+                )
+        sessao.commit()
+    return sessoes
+
+
+async def _responder(*args, **kwargs):
+    # Simula a ida e volta à API do Telegram
+    await asyncio.sleep(0.005)
+
+
+def update_comando():
+    mensagem = SimpleNamespace(reply_text=_responder, reply_html=_responder, reply_photo=_responder)
+    return SimpleNamespace(message=mensagem, effective_message=mensagem, callback_query=None)
+
+
+def update_botao(secretaria_id):
+    query = SimpleNamespace(
+        data=f'grafico_{secretaria_id}', answer=_responder, edit_message_text=_responder,
+        message=SimpleNamespace(reply_photo=_responder)
+    )
+    return SimpleNamespace(callback_query=query, message=None)
+
+
+async def medir_atraso_loop(parar, atrasos):
+    """Acorda a cada 10 ms e regista quanto o loop demorou a devolver o controlo."""
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        await asyncio.sleep(0.01)
+        atrasos.append(time.perf_counter() - inicio - 0.01)
+
+
+async def simular(bot, n_usuarios, n_pedidos, n_secretarias):
+    latencias = {'secretarias': [], 'grafico': []}
+    atrasos = []
+    parar = asyncio.Event()
+
+    async def usuario(indice):
+        # Cada utilizador envia o pedido seguinte assim que recebe a resposta ao anterior;
+        # a latência conta desde o envio, incluindo o tempo à espera do loop
+        enviado = inicio
+        for pedido in range(n_pedidos):
+            if (indice + pedido) % 2:
+                operacao = 'secretarias'
+                await bot.listar_secretarias(update_comando(), None)
+            else:
+                operacao = 'grafico'
+                await bot.enviar_grafico_selecionado(update_botao(random.randint(1, n_secretarias)), None)
+            agora = time.perf_counter()
+            latencias[operacao].append(agora - enviado)
+            enviado = agora
+
+    monitor = asyncio.create_task(medir_atraso_loop(parar, atrasos))
+    inicio = time.perf_counter()
+    await asyncio.gather(*(usuario(i) for i in range(n_usuarios)))
+    duracao = time.perf_counter() - inicio
+    parar.set()
+    await monitor
+    return latencias, atrasos, duracao
+
+
+async def rodada(bot, n_usuarios, n_pedidos, n_secretarias):
+    # Aquece os processos de renderização para não medir o arranque do spawn
+    await simular(bot, bot.executor.processos_grafico, 1, n_secretarias)
+    return await simular(bot, n_usuarios, n_pedidos, n_secretarias)
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--usuarios', type=int, default=20)
+    parser.add_argument('--pedidos', type=int, default=5, help='pedidos por utilizador')
+    parser.add_argument('--secretarias', type=int, default=10)
+    parser.add_argument('--com-cache', action='store_true',
+                        help='usa o cache de gráficos (por omissão cada toque desenha o gráfico)')
+    args = parser.parse_args()
+
+    import bot
+    from executores import ExecutorBot
+    from graficos import CacheGraficos
+
+    if not args.com_cache:
+        bot.obter_cache = lambda: CacheGraficos(max_itens=0)
+
+    with tempfile.TemporaryDirectory() as pasta:
+        sessoes = criar_banco_teste(os.path.join(pasta, 'bench.db'), args.secretarias)
+
+        print(f'{args.usuarios} utilizadores x {args.pedidos} pedidos')
+        print(f'{"modo":<10} {"operação":<12} {"p50 (ms)":>10} {"p95 (ms)":>10} {"máx (ms)":>10}')
+        resumo = []
+        for modo, inline in (('inline', True), ('executor', False)):
+            bot.executor = ExecutorBot(sessoes, inline=inline)
+            latencias, atrasos, duracao = asyncio.run(rodada(bot, args.usuarios, args.pedidos, args.secretarias))
+            bot.executor.encerrar()
+            latencias['todas'] = latencias['secretarias'] + latencias['grafico']
+            for operacao, valores in latencias.items():
+                print(f'{modo:<10} {operacao:<12} {statistics.median(valores) * 1000:>10.1f} '
+                      f'{percentil(valores, 95) * 1000:>10.1f} {max(valores) * 1000:>10.1f}')
+            resumo.append((modo, max(atrasos, default=0), duracao))
+
+        print(f'\n{"modo":<10} {"atraso máx. do loop (ms)":>26} {"total (s)":>10}')
+        for modo, atraso, duracao in resumo:
+            print(f'{modo:<10} {atraso * 1000:>26.1f} {duracao:>10.2f}')
+        print(f'(CPUs disponíveis: {os.cpu_count()})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""Tempos das páginas principais sobre uma base sintética, com comparação contra uma linha de base.
+
+Cada caso é pedido pelo cliente de testes do Flask (sem rede) depois de um
+pedido de aquecimento; guarda-se a mediana e o p95 do tempo e o número de
+consultas SQL do pedido (lido do cabeçalho Server-Timing, ver metricas.py).
+
+A base é uma cópia temporária de --banco (povoada com `flask seed-synthetic`)
+ou é gerada na hora com --escala. Com --base, os resultados são comparados com
+um JSON anterior e o script termina com código 1 se algum caso ficar mais lento
+que a tolerância ou fizer mais consultas; --guardar grava um novo JSON.
+
+Uso:
+    python benchmarks/paginas.py --escala pequena --base benchmarks/paginas_base.json
+    python benchmarks/paginas.py --banco instance/carga.db --repeticoes 10
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+ESCALAS = {
+    'pequena': dict(secretarias=10, obras=1000, gastos=200000, medicoes=120),
+    'media': dict(secretarias=25, obras=2500, gastos=500000, medicoes=300),
+    'producao': dict(secretarias=50, obras=5000, gastos=2000000, medicoes=600),
+}
+_CONSULTAS = re.compile(r'desc="(\d+) consultas"')
+
+
+def preparar_banco(pasta, banco):
+    """Caminho da base a usar: uma cópia de `banco` (o POST de medição grava) ou um ficheiro novo."""
+    destino = os.path.join(pasta, 'benchmark.db')
+    if banco:
+        shutil.copyfile(banco, destino)
+    # app.py cria a aplicação ao ser importado e precisa de um URL
+    os.environ['DATABASE_URL'] = f'sqlite:///{destino}'
+    return destino
+
+
+def criar_app(caminho, escala, tipo_cache):
+    from app import create_app
+    from models import db
+    import migracoes
+    import sinteticos
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{caminho}',
+        'SECRET_KEY': 'benchmark',
+        'WTF_CSRF_ENABLED': False,
+        'METRICAS_ATIVAS': True,
+        'METRICAS_ORCAMENTO_CONSULTAS': 10 ** 9,
+        'METRICAS_LIMITE_REPETICOES': 10 ** 9,
+        'CACHE_TIPO': tipo_cache,
+        'CACHE_ARQUIVO': os.path.join(os.path.dirname(caminho), 'cache.sqlite3'),
+    })
+    app.logger.setLevel(logging.ERROR)
+    with app.app_context():
+        db.create_all()
+        migracoes.aplicar()
+        if escala:
+            sinteticos.gerar(**ESCALAS[escala])
+    return app
+
+
+def escolher_alvos(app):
+    """A maior secretaria, a sua medição mais recente, a obra com mais gastos e as obras da 1.ª página da medição."""
+    from sqlalchemy import func
+    from models import db, Obra, Medicao, Secretaria, OrcamentoMedicaoObra, Gasto
+
+    with app.app_context():
+        secretaria_id = db.session.query(Obra.secretaria_id).group_by(Obra.secretaria_id).order_by(
+            func.count(Obra.id).desc()
+        ).limit(1).scalar()
+        medicao_id = db.session.query(Medicao.id).filter(Medicao.secretaria_id == secretaria_id).order_by(
+            Medicao.data_inicio.desc()
+        ).limit(1).scalar()
+        # A obra com mais gastos: o pior caso do histórico de gastos
+        obra_id = db.session.query(Gasto.obra_id).group_by(Gasto.obra_id).order_by(func.count().desc()).limit(1).scalar()
+        obras = db.session.query(Obra.id).filter(Obra.secretaria_id == secretaria_id).order_by(
+            Obra.nome, Obra.id
+        ).limit(50).all()
+        escala = {
+            'secretarias': db.session.query(func.count(Secretaria.id)).scalar(),
+            'obras': db.session.query(func.count(Obra.id)).scalar(),
+            'gastos': db.session.query(func.count(Gasto.id)).scalar(),
+            'orcamentos': db.session.query(func.count(OrcamentoMedicaoObra.id)).scalar(),
+        }
+    return secretaria_id, medicao_id, obra_id, [linha.id for linha in obras], escala
+
+
+def formulario_medicao(obra_ids, rodada):
+    """Dados do POST de detalhes_medicao; o valor muda a cada rodada para haver sempre gravação."""
+    dados = {}
+    for i, obra_id in enumerate(obra_ids):
+        dados[f'obras-{i}-obra_id'] = str(obra_id)
+        dados[f'obras-{i}-os_inicial_secretaria'] = str(10000 + rodada + i)
+        dados[f'obras-{i}-os_qualitech'] = '0'
+        dados[f'obras-{i}-fonte_orcamento_selecionada'] = 'inicial'
+    return dados
+
+
+def casos(secretaria_id, medicao_id, obra_id, obra_ids):
+    """(nome, função(cliente, rodada) -> resposta, pesado)."""
+    return [
+        ('index', lambda c, r: c.get('/'), False),
+        ('listar_obras[nome]', lambda c, r: c.get('/obras'), False),
+        ('listar_obras[maior_gasto]', lambda c, r: c.get('/obras?ordenar_por=maior_gasto'), False),
+        ('listar_obras[menor_gasto]', lambda c, r: c.get('/obras?ordenar_por=menor_gasto'), False),
+        ('listar_obras[pesquisa]', lambda c, r: c.get('/obras?q=construcao+escola'), False),
+        ('autocompletar_obras', lambda c, r: c.get('/api/obras/autocompletar?q=con'), False),
+        ('detalhes_secretaria', lambda c, r: c.get(f'/secretaria/{secretaria_id}'), False),
+        ('api_gastos_diarios', lambda c, r: c.get(f'/api/gastos_diarios/secretaria/{secretaria_id}'), False),
+        ('detalhes_obra', lambda c, r: c.get(f'/obra/{obra_id}'), False),
+        ('detalhes_medicao[GET]', lambda c, r: c.get(f'/medicao/{medicao_id}'), False),
+        ('detalhes_medicao[POST]', lambda c, r: c.post(f'/medicao/{medicao_id}', data=formulario_medicao(obra_ids, r)), False),
+        ('gerar_excel', lambda c, r: c.get('/relatorio/excel'), True),
+    ]
+
+
+def medir(cliente, funcao, repeticoes):
+    tempos, consultas = [], 0
+    for rodada in range(repeticoes + 1):
+        inicio = time.perf_counter()
+        resposta = funcao(cliente, rodada)
+        _ = resposta.get_data()
+        decorrido = time.perf_counter() - inicio
+        if resposta.status_code not in (200, 302):
+            raise RuntimeError(f'resposta {resposta.status_code}')
+        if rodada == 0:
+            continue  # aquecimento (compilação de templates, caches do SQLite)
+        tempos.append(decorrido * 1000)
+        encontrado = _CONSULTAS.search(resposta.headers.get('Server-Timing', ''))
+        consultas = int(encontrado.group(1)) if encontrado else 0
+    tempos.sort()
+    p95 = tempos[min(len(tempos) - 1, int(round(0.95 * (len(tempos) - 1))))]
+    return {'mediana_ms': round(statistics.median(tempos), 1), 'p95_ms': round(p95, 1), 'consultas': consultas}
+
+
+def comparar(resultados, base, tolerancia):
+    """Mostra a variação face à base; devolve os casos que regrediram."""
+    regressoes = []
+    if base.get('escala') != resultados['escala']:
+        print(f"Aviso: a base foi medida noutra escala ({base.get('escala')}); a comparação é indicativa.")
+    for nome, atual in resultados['casos'].items():
+        anterior = base.get('casos', {}).get(nome)
+        if not anterior:
+            continue
+        variacao = (atual['mediana_ms'] - anterior['mediana_ms']) / anterior['mediana_ms'] * 100
+        pior = variacao > tolerancia or atual['consultas'] > anterior['consultas']
+        if pior:
+            regressoes.append(nome)
+        print(f"  {nome:<28} {anterior['mediana_ms']:>10.1f} -> {atual['mediana_ms']:>10.1f} ms ({variacao:+.0f}%), "
+              f"consultas {anterior['consultas']} -> {atual['consultas']}{'  REGRESSÃO' if pior else ''}")
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    origem = parser.add_mutually_exclusive_group(required=True)
+    origem.add_argument('--banco', help='base SQLite já povoada (é usada uma cópia)')
+    origem.add_argument('--escala', choices=sorted(ESCALAS), help='gera uma base sintética temporária')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--base', help='JSON de uma medição anterior, para comparar')
+    parser.add_argument('--guardar', help='grava os resultados neste JSON')
+    parser.add_argument('--cache', choices=('nenhum', 'memoria', 'sqlite'), default='nenhum',
+                        help='cache de cartões e APIs; sem cache mede-se o trabalho de cada página')
+    parser.add_argument('--tolerancia', type=float, default=25, help='aumento da mediana (%%) aceite antes de acusar regressão')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = preparar_banco(pasta, args.banco)
+        app = criar_app(caminho, args.escala, args.cache)
+        secretaria_id, medicao_id, obra_id, obra_ids, escala = escolher_alvos(app)
+        print('Escala: ' + ', '.join(f'{n} {t}' for t, n in escala.items()))
+
+        resultados = {'escala': escala, 'casos': {}}
+        cliente = app.test_client()
+        for nome, funcao, pesado in casos(secretaria_id, medicao_id, obra_id, obra_ids):
+            # O relatório completo é caro: menos repetições
+            repeticoes = max(1, args.repeticoes // 3) if pesado else args.repeticoes
+            resultado = medir(cliente, funcao, repeticoes)
+            resultados['casos'][nome] = resultado
+            print(f"{nome:<28} mediana {resultado['mediana_ms']:>9.1f} ms  p95 {resultado['p95_ms']:>9.1f} ms  "
+                  f"{resultado['consultas']:>4} consultas")
+
+    regressoes = []
+    if args.base and os.path.exists(args.base):
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+        print(f'\nComparação com {args.base}:')
+        regressoes = comparar(resultados, base, args.tolerancia)
+
+    if args.guardar:
+        with open(args.guardar, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+
+    if regressoes:
+        print(f"\n{len(regressoes)} caso(s) com regressão: {', '.join(regressoes)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Leituras e escritas simultâneas na mesma base SQLite, com e sem a configuração de banco.py.
+
+Simula os workers da aplicação web e o bot a usarem a base ao mesmo tempo:
+processos escritores gravam gastos (INSERT do gasto e UPDATE dos resumos da
+obra e da secretaria, numa transação, como a rota adicionar_gasto) e processos
+leitores pedem os totais das secretarias e a série diária de uma delas (as
+consultas do painel e do bot). Cada modo corre numa cópia da mesma base:
+
+- `padrao`: create_engine sem opções (journal DELETE, espera de 5 s do driver);
+- `ajustado`: banco.criar_engine (WAL, synchronous=NORMAL, busy_timeout, mmap, cache).
+
+Mostra as operações por segundo, o p95 da latência e os erros "database is
+locked" de cada tipo de processo.
+
+Uso:
+    python benchmarks/sqlite_concorrencia.py --escritores 4 --leitores 8 --duracao 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODOS = ('padrao', 'ajustado')
+
+
+def criar_banco_teste(caminho_db, n_secretarias, n_obras, n_gastos):
+    """Base de partida, criada sem os PRAGMAs (fica em journal DELETE, como uma base antiga)."""
+    from sqlalchemy import create_engine, insert
+    from sqlalchemy.orm import Session
+    from models import db, Secretaria, Obra, Gasto, Medicao, OrcamentoMedicaoObra, ResumoObra, ResumoSecretaria
+
+    engine = create_engine(f'sqlite:///{caminho_db}')
+    db.metadata.create_all(engine)
+    hoje = date.today()
+    with Session(engine) as sessao:
+        for i in range(n_secretarias):
+            sessao.add(Secretaria(id=i + 1, nome=f'Secretaria {i}'))
+            sessao.add(ResumoSecretaria(secretaria_id=i + 1))
+            sessao.add(Medicao(id=i + 1, nome='Medição 1', data_inicio=hoje - timedelta(days=365), data_fim=hoje,
+                               secretaria_id=i + 1))
+        sessao.flush()
+        for j in range(n_obras):
+            secretaria_id = j % n_secretarias + 1
+            sessao.add(Obra(id=j + 1, nome=f'Obra {j}', secretaria_id=secretaria_id))
+            sessao.add(ResumoObra(obra_id=j + 1))
+            sessao.add(OrcamentoMedicaoObra(medicao_id=secretaria_id, obra_id=j + 1, os_inicial_secretaria=100000))
+        sessao.flush()
+        sessao.execute(insert(Gasto), [
+            {'descricao': 'Gasto', 'valor': random.uniform(100, 5000), 'obra_id': random.randint(1, n_obras),
+             'data': hoje - timedelta(days=random.randint(0, 365))}
+            for _ in range(n_gastos)
+        ])
+        sessao.commit()
+    engine.dispose()
+
+
+def _engine(modo, caminho_db):
+    from sqlalchemy import create_engine
+    import banco
+
+    url = f'sqlite:///{caminho_db}'
+    return create_engine(url) if modo == 'padrao' else banco.criar_engine(url)
+
+
+def _escrever(sessao, n_obras, n_secretarias):
+    from sqlalchemy import update
+    from models import Gasto, ResumoObra, ResumoSecretaria
+
+    obra_id = random.randint(1, n_obras)
+    valor = random.uniform(100, 5000)
+    sessao.add(Gasto(descricao='Gasto concorrente', valor=valor, obra_id=obra_id, data=date.today()))
+    sessao.execute(update(ResumoObra).where(ResumoObra.obra_id == obra_id).values(
+        total_gasto=ResumoObra.total_gasto + valor, qtd_gastos=ResumoObra.qtd_gastos + 1
+    ))
+    sessao.execute(update(ResumoSecretaria).where(
+        ResumoSecretaria.secretaria_id == (obra_id - 1) % n_secretarias + 1
+    ).values(total_gasto=ResumoSecretaria.total_gasto + valor))
+    sessao.commit()
+
+
+def _ler(sessao, n_secretarias):
+    from sqlalchemy import func
+    from models import Gasto, Obra
+    import rollups
+
+    rollups.totais_secretarias(sessao=sessao)
+    # A soma por dia de series.consulta_gastos_por_dia (que usa db.session, só com a app)
+    hoje = date.today()
+    sessao.query(Gasto.data, func.sum(Gasto.valor)).join(Obra, Gasto.obra_id == Obra.id).filter(
+        Obra.secretaria_id == random.randint(1, n_secretarias), Gasto.data >= hoje - timedelta(days=90)
+    ).group_by(Gasto.data).all()
+    sessao.rollback()
+
+
+def trabalhador(tipo, modo, caminho_db, duracao, n_obras, n_secretarias, inicio, fila):
+    """Corre num processo: repete a operação até `duracao` e devolve (tipo, latências, erros)."""
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.orm import Session
+
+    latencias, erros = [], 0
+    try:
+        engine = _engine(modo, caminho_db)
+        # Todos os processos começam ao mesmo tempo
+        while time.time() < inicio:
+            time.sleep(0.001)
+        fim = inicio + duracao
+        with Session(engine) as sessao:
+            while time.time() < fim:
+                comeco = time.perf_counter()
+                try:
+                    if tipo == 'escrita':
+                        _escrever(sessao, n_obras, n_secretarias)
+                    else:
+                        _ler(sessao, n_secretarias)
+                    latencias.append(time.perf_counter() - comeco)
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    # "database is locked": a operação perdeu-se
+                    sessao.rollback()
+                    erros += 1
+        engine.dispose()
+    finally:
+        # Sempre uma resposta, para o processo principal não ficar à espera
+        fila.put((tipo, latencias, erros))
+
+
+def rodada(modo, caminho_db, args):
+    contexto = multiprocessing.get_context('fork' if hasattr(os, 'fork') else 'spawn')
+    fila = contexto.Queue()
+    inicio = time.time() + 1.0
+    processos = [
+        contexto.Process(target=trabalhador, args=(tipo, modo, caminho_db, args.duracao, args.obras,
+                                                   args.secretarias, inicio, fila))
+        for tipo, quantidade in (('escrita', args.escritores), ('leitura', args.leitores))
+        for _ in range(quantidade)
+    ]
+    for processo in processos:
+        processo.start()
+    resultados = [fila.get() for _ in processos]
+    for processo in processos:
+        processo.join()
+
+    resumo = {}
+    for tipo in ('escrita', 'leitura'):
+        latencias = [valor for t, lista, _ in resultados if t == tipo for valor in lista]
+        erros = sum(e for t, _, e in resultados if t == tipo)
+        latencias.sort()
+        resumo[tipo] = {
+            'ops': len(latencias) / args.duracao,
+            'p50': statistics.median(latencias) * 1000 if latencias else 0.0,
+            'p95': latencias[int(round(0.95 * (len(latencias) - 1)))] * 1000 if latencias else 0.0,
+            'erros': erros,
+        }
+    return resumo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--escritores', type=int, default=4, help='processos que gravam gastos')
+    parser.add_argument('--leitores', type=int, default=8, help='processos que leem os totais e as séries')
+    parser.add_argument('--duracao', type=float, default=10, help='segundos de cada modo')
+    parser.add_argument('--secretarias', type=int, default=10)
+    parser.add_argument('--obras', type=int, default=500)
+    parser.add_argument('--gastos', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        modelo = os.path.join(pasta, 'modelo.db')
+        criar_banco_teste(modelo, args.secretarias, args.obras, args.gastos)
+        print(f'{args.escritores} escritores, {args.leitores} leitores, {args.duracao:.0f} s por modo; '
+              f'{args.secretarias} secretarias, {args.obras} obras, {args.gastos} gastos')
+        print(f'{"modo":<10} {"operação":<9} {"ops/s":>9} {"p50 (ms)":>10} {"p95 (ms)":>10} {"erros":>7}')
+        resultados = {}
+        for modo in MODOS:
+            caminho = os.path.join(pasta, f'{modo}.db')
+            shutil.copyfile(modelo, caminho)
+            resultados[modo] = rodada(modo, caminho, args)
+            for tipo, r in resultados[modo].items():
+                print(f'{modo:<10} {tipo:<9} {r["ops"]:>9.1f} {r["p50"]:>10.1f} {r["p95"]:>10.1f} {r["erros"]:>7}')
+
+    print()
+    for tipo in ('escrita', 'leitura'):
+        antes, depois = resultados['padrao'][tipo]['ops'], resultados['ajustado'][tipo]['ops']
+        ganho = f'{depois / antes:.1f}x' if antes else 'sem operações no modo padrão'
+        print(f'{tipo}: {antes:.1f} -> {depois:.1f} ops/s ({ganho})')
+    print(f'(CPUs disponíveis: {os.cpu_count()})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Tempo de arranque de app.py e bot.py, medido com `python -X importtime`.
+
+Para cada módulo corre várias vezes `python -X importtime -c "import <módulo>"`
+num processo novo e mostra a mediana do tempo de importação, do tempo total do
+processo e os pacotes importados diretamente que mais pesam. Com --guardar os
+resultados vão para um JSON; com --base são comparados com um JSON anterior
+(o do repositório é benchmarks/arranque_base.json).
+
+Uso:
+    python benchmarks/tempo_arranque.py [--repeticoes 5] [--base benchmarks/arranque_base.json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULOS = ('app', 'bot')
+
+
+def _linhas_importtime(saida):
+    """Devolve [(nivel, cumulativo_us, nome)] a partir do stderr do -X importtime."""
+    linhas = []
+    for linha in saida.splitlines():
+        if not linha.startswith('import time:') or 'cumulative' in linha:
+            continue
+        _, cumulativo, nome = linha[len('import time:'):].split('|')
+        recuo = len(nome) - len(nome.lstrip(' '))
+        linhas.append(((recuo - 1) // 2, int(cumulativo), nome.strip()))
+    return linhas
+
+
+def medir(modulo):
+    """Importa `modulo` num processo novo. Devolve (importação_ms, processo_ms, {dependência: ms})."""
+    ambiente = dict(os.environ)
+    # app.py precisa de um URL de base de dados para criar a aplicação
+    ambiente.setdefault('DATABASE_URL', 'sqlite://')
+    inicio = time.perf_counter()
+    resultado = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {modulo}'],
+        cwd=RAIZ, env=ambiente, capture_output=True, text=True, check=True
+    )
+    processo_ms = (time.perf_counter() - inicio) * 1000
+
+    linhas = _linhas_importtime(resultado.stderr)
+    posicao = max(i for i, (nivel, _, nome) in enumerate(linhas) if nome == modulo and nivel == 0)
+    # O importtime lista os filhos antes do pai: as dependências diretas são as de nível 1
+    # entre o módulo anterior de nível 0 e o próprio módulo
+    anterior = max((i for i, (nivel, _, _) in enumerate(linhas[:posicao]) if nivel == 0), default=-1)
+    dependencias = {nome: cumulativo / 1000 for nivel, cumulativo, nome in linhas[anterior + 1:posicao] if nivel == 1}
+    return linhas[posicao][1] / 1000, processo_ms, dependencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='dependências a mostrar por módulo')
+    parser.add_argument('--base', help='JSON de uma medição anterior, para comparar')
+    parser.add_argument('--guardar', help='grava os resultados neste JSON')
+    args = parser.parse_args()
+
+    base = {}
+    if args.base and os.path.exists(args.base):
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+
+    resultados = {}
+    for modulo in MODULOS:
+        medicoes = [medir(modulo) for _ in range(args.repeticoes)]
+        importacao = statistics.median(m[0] for m in medicoes)
+        processo = statistics.median(m[1] for m in medicoes)
+        dependencias = {
+            nome: statistics.median(m[2].get(nome, 0.0) for m in medicoes)
+            for nome in medicoes[-1][2]
+        }
+        resultados[modulo] = {'importacao_ms': round(importacao, 1), 'processo_ms': round(processo, 1)}
+
+        comparacao = ''
+        if modulo in base:
+            anterior = base[modulo]['importacao_ms']
+            comparacao = f'  (base: {anterior:.1f} ms, {(importacao - anterior) / anterior * 100:+.0f}%)'
+        print(f'{modulo}: importação {importacao:.1f} ms, processo {processo:.1f} ms{comparacao}')
+        for nome, ms in sorted(dependencias.items(), key=lambda d: -d[1])[:args.top]:
+            print(f'    {nome:<24} {ms:>8.1f} ms')
+
+    if args.guardar:
+        with open(args.guardar, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
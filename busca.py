@@ -0,0 +1,176 @@
+"""Pesquisa de texto nas obras (nome, contrato, objeto, município e endereço).
+
+Em SQLite usa uma tabela virtual FTS5 (`obra_busca`) de conteúdo externo
+sobre a tabela `obra`, mantida por triggers; o tokenizador `unicode61` com
+`remove_diacritics 2` torna a pesquisa insensível a maiúsculas e acentos
+("construcao" encontra "Construção") e os índices de prefixo tornam rápida a
+pesquisa pelo início das palavras, usada pelo autocompletar.
+
+Em PostgreSQL a mesma pesquisa usa uma coluna `tsvector` (com `unaccent`),
+mantida por trigger e indexada com GIN. Noutras bases cai num ILIKE por termo.
+
+Cada palavra escrita é um prefixo e todas têm de aparecer (em qualquer campo);
+os resultados vêm ordenados por relevância, com o nome e o contrato a pesar
+mais que o objeto ou o endereço.
+"""
+import re
+
+from sqlalchemy import and_, column, event, func, literal, literal_column, or_, select, table, text
+
+from models import db, Obra, Secretaria
+
+CAMPOS = ('nome', 'n_contrato', 'objeto', 'municipio', 'endereco')
+# Pesos do bm25 (SQLite), pela ordem de CAMPOS
+PESOS = (10.0, 8.0, 2.0, 4.0, 1.0)
+# Pesos do PostgreSQL (A > B > C > D), pela ordem de CAMPOS
+PESOS_POSTGRES = ('A', 'A', 'C', 'B', 'D')
+MAXIMO_TERMOS = 8
+# O autocompletar ordena por relevância só as obras mais recentes que correspondem:
+# um prefixo de uma ou duas letras corresponde a quase todas e o bm25 de todas é caro
+CANDIDATOS_AUTOCOMPLETAR = 200
+
+_TERMO = re.compile(r'\w+')
+
+
+def termos(texto):
+    """Termos da pesquisa, um por palavra escrita, como tuplos de tokens.
+
+    A pontuação separa tokens no índice, por isso "00012/2024" dá ('00012', '2024')
+    e é pesquisado como frase: os tokens têm de aparecer seguidos.
+    """
+    encontrados = (tuple(_TERMO.findall(palavra)) for palavra in (texto or '').split())
+    return [termo for termo in encontrados if termo][:MAXIMO_TERMOS]
+
+
+def _dialeto():
+    return db.session.connection().dialect.name
+
+
+# --- Criação e manutenção do índice (migração 3 e create_all) ---
+
+def criar_indice(conexao):
+    """Cria o índice e os triggers para o dialeto da `conexao` e indexa as obras existentes."""
+    dialeto = conexao.dialect.name
+    if dialeto == 'sqlite':
+        _criar_indice_sqlite(conexao)
+    elif dialeto == 'postgresql':
+        _criar_indice_postgres(conexao)
+
+
+@event.listens_for(Obra.__table__, 'after_create')
+def _ao_criar_tabela_obra(tabela, conexao, **kw):
+    # Uma base criada só com create_all() (init-db, testes) fica logo com a pesquisa a funcionar
+    criar_indice(conexao)
+
+
+def _criar_indice_sqlite(conexao):
+    colunas = ', '.join(CAMPOS)
+    novos = ', '.join(f'new.{c}' for c in CAMPOS)
+    antigos = ', '.join(f'old.{c}' for c in CAMPOS)
+    instrucoes = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS obra_busca USING fts5({colunas}, content='obra', content_rowid='id', "
+        f"tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS obra_busca_inserir AFTER INSERT ON obra BEGIN "
+        f"INSERT INTO obra_busca(rowid, {colunas}) VALUES (new.id, {novos}); END",
+        f"CREATE TRIGGER IF NOT EXISTS obra_busca_remover AFTER DELETE ON obra BEGIN "
+        f"INSERT INTO obra_busca(obra_busca, rowid, {colunas}) VALUES ('delete', old.id, {antigos}); END",
+        f"CREATE TRIGGER IF NOT EXISTS obra_busca_atualizar AFTER UPDATE OF {colunas} ON obra BEGIN "
+        f"INSERT INTO obra_busca(obra_busca, rowid, {colunas}) VALUES ('delete', old.id, {antigos}); "
+        f"INSERT INTO obra_busca(rowid, {colunas}) VALUES (new.id, {novos}); END",
+        # O `rank` da tabela passa a ser o bm25 com os pesos de cada campo
+        f"INSERT INTO obra_busca(obra_busca, rank) VALUES ('rank', 'bm25({', '.join(map(str, PESOS))})')",
+    ]
+    for instrucao in instrucoes:
+        conexao.execute(text(instrucao))
+    reconstruir_indice(conexao)
+
+
+def _criar_indice_postgres(conexao):
+    vetor = ' || '.join(
+        f"setweight(to_tsvector('simple', unaccent(coalesce(NEW.{c}, ''))), '{p}')"
+        for c, p in zip(CAMPOS, PESOS_POSTGRES)
+    )
+    instrucoes = [
+        'CREATE EXTENSION IF NOT EXISTS unaccent',
+        'ALTER TABLE obra ADD COLUMN IF NOT EXISTS busca tsvector',
+        f'CREATE OR REPLACE FUNCTION obra_busca_atualizar() RETURNS trigger AS $$ '
+        f'BEGIN NEW.busca := {vetor}; RETURN NEW; END $$ LANGUAGE plpgsql',
+        'DROP TRIGGER IF EXISTS obra_busca_atualizar ON obra',
+        f'CREATE TRIGGER obra_busca_atualizar BEFORE INSERT OR UPDATE OF {", ".join(CAMPOS)} ON obra '
+        f'FOR EACH ROW EXECUTE FUNCTION obra_busca_atualizar()',
+        'CREATE INDEX IF NOT EXISTS ix_obra_busca ON obra USING gin (busca)',
+    ]
+    for instrucao in instrucoes:
+        conexao.execute(text(instrucao))
+    reconstruir_indice(conexao)
+
+
+def reconstruir_indice(conexao):
+    """Volta a indexar todas as obras (depois de importações que contornaram os triggers)."""
+    dialeto = conexao.dialect.name
+    if dialeto == 'sqlite':
+        conexao.execute(text("INSERT INTO obra_busca(obra_busca) VALUES ('rebuild')"))
+    elif dialeto == 'postgresql':
+        # Reescrever o nome dispara o trigger, que recalcula a coluna
+        conexao.execute(text('UPDATE obra SET nome = nome'))
+
+
+# --- Consultas ---
+
+def _expressao_fts(palavras):
+    # Só há letras, dígitos e _ nos tokens; as aspas evitam que "and"/"or"/"not" sejam operadores
+    return ' '.join(f'"{" ".join(tokens)}"*' for tokens in palavras)
+
+
+def _expressao_tsquery(palavras):
+    return ' & '.join(' <-> '.join(tokens[:-1] + (f'{tokens[-1]}:*',)) for tokens in palavras)
+
+
+def resultados(texto, candidatos=None):
+    """Subconsulta (obra_id, relevancia) com as obras que correspondem a `texto`.
+
+    Menor `relevancia` é melhor. Com `candidatos`, fica só com as N obras mais
+    recentes que correspondem. Devolve None se o texto não tiver palavras.
+    """
+    palavras = termos(texto)
+    if not palavras:
+        return None
+    dialeto = _dialeto()
+    if dialeto == 'sqlite':
+        indice = table('obra_busca', column('rowid'), column('rank'))
+        consulta = select(indice.c.rowid.label('obra_id'), indice.c.rank.label('relevancia')).where(
+            literal_column('obra_busca').op('MATCH')(_expressao_fts(palavras))
+        )
+    elif dialeto == 'postgresql':
+        busca = literal_column('obra.busca')
+        pesquisa = func.to_tsquery('simple', func.unaccent(_expressao_tsquery(palavras)))
+        consulta = select(Obra.id.label('obra_id'), (-func.ts_rank(busca, pesquisa)).label('relevancia')).where(
+            busca.op('@@')(pesquisa)
+        )
+    else:
+        campos = [getattr(Obra, c) for c in CAMPOS]
+        consulta = select(Obra.id.label('obra_id'), literal(0).label('relevancia')).where(
+            and_(*(or_(*(c.ilike(f'%{"%".join(tokens)}%') for c in campos)) for tokens in palavras))
+        )
+    if candidatos:
+        consulta = consulta.order_by(literal_column('obra_id').desc()).limit(candidatos)
+    return consulta.subquery('busca')
+
+
+def autocompletar(texto, limite=10):
+    """As `limite` obras mais relevantes para `texto`, como dicionários leves (sem carregar modelos)."""
+    encontradas = resultados(texto, CANDIDATOS_AUTOCOMPLETAR)
+    if encontradas is None:
+        return []
+    linhas = db.session.execute(
+        select(Obra.id, Obra.nome, Obra.n_contrato, Obra.municipio)
+        .join(encontradas, encontradas.c.obra_id == Obra.id)
+        .join(Secretaria, Obra.secretaria_id == Secretaria.id)
+        .where(Secretaria.ativa)
+        .order_by(encontradas.c.relevancia, Obra.nome)
+        .limit(limite)
+    )
+    return [
+        {'id': obra_id, 'nome': nome, 'n_contrato': n_contrato, 'municipio': municipio}
+        for obra_id, nome, n_contrato, municipio in linhas
+    ]
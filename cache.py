@@ -0,0 +1,207 @@
+"""Cache de fragmentos do painel e de respostas das APIs.
+
+Dois backends com a mesma interface (obter / guardar / invalidar):
+
+- `CacheMemoria`: LRU em memória do processo. Sem custo de E/S, mas cada
+  worker tem o seu e só o worker que gravou fica a saber da invalidação.
+- `CacheSQLite`: um ficheiro SQLite local (CACHE_ARQUIVO), partilhado pelos
+  workers do gunicorn da mesma máquina; uma invalidação vale para todos.
+
+Escolhe-se com CACHE_TIPO (memoria | sqlite | nenhum). Cada entrada pertence a
+uma secretaria (ou a nenhuma, `secretaria_id=None`, para dados que dependem de
+todas, como o painel) e é removida quando essa secretaria muda: app.py liga
+`invalidar` ao aviso de rollups.ao_alterar_secretaria. Entradas sem secretaria
+saem em qualquer invalidação. Todas expiram ao fim de CACHE_TTL segundos, o
+que limita o atraso de um worker que não soube de uma invalidação.
+
+Os acertos e falhas são contados por espaço (a parte da chave antes do primeiro
+':') e aparecem em /_metrics.
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from flask import current_app, has_app_context
+
+TIPOS = ('memoria', 'sqlite', 'nenhum')
+
+
+class _Estatisticas:
+
+    def __init__(self):
+        self._trava_estatisticas = threading.Lock()
+        self.acertos = Counter()
+        self.falhas = Counter()
+
+    def _contar(self, chave, acerto):
+        espaco = chave.split(':', 1)[0]
+        with self._trava_estatisticas:
+            (self.acertos if acerto else self.falhas)[espaco] += 1
+
+    def prometheus(self):
+        """Linhas no formato de exposição do Prometheus (ver metricas.py)."""
+        linhas = []
+        with self._trava_estatisticas:
+            for nome, ajuda, valores in (
+                ('obras_cache_acertos_total', 'Leituras servidas pelo cache', self.acertos),
+                ('obras_cache_falhas_total', 'Leituras que não estavam no cache', self.falhas),
+            ):
+                linhas.append(f'# HELP {nome} {ajuda}')
+                linhas.append(f'# TYPE {nome} counter')
+                for espaco in sorted(set(self.acertos) | set(self.falhas)):
+                    linhas.append(f'{nome}{{espaco="{espaco}"}} {valores[espaco]}')
+        return linhas
+
+
+class CacheMemoria(_Estatisticas):
+    """LRU em memória; as entradas guardam o próprio objeto, sem cópia."""
+
+    def __init__(self, max_itens=1024, ttl=60):
+        super().__init__()
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._entradas = OrderedDict()  # chave -> (secretaria_id, expira, valor)
+        self._trava = threading.Lock()
+
+    def obter(self, chave):
+        """Devolve o valor em cache, ou None."""
+        with self._trava:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada[1] < time.monotonic():
+                del self._entradas[chave]
+                entrada = None
+            if entrada is not None:
+                self._entradas.move_to_end(chave)
+        self._contar(chave, entrada is not None)
+        return entrada[2] if entrada is not None else None
+
+    def guardar(self, chave, valor, secretaria_id=None):
+        with self._trava:
+            self._entradas[chave] = (secretaria_id, time.monotonic() + self.ttl, valor)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_itens:
+                self._entradas.popitem(last=False)
+        return valor
+
+    def invalidar(self, secretaria_ids=None):
+        """Remove as entradas das secretarias indicadas e as que não têm secretaria (todas, se None)."""
+        with self._trava:
+            if secretaria_ids is None:
+                self._entradas.clear()
+                return
+            for chave, (secretaria_id, _, _) in list(self._entradas.items()):
+                if secretaria_id is None or secretaria_id in secretaria_ids:
+                    del self._entradas[chave]
+
+
+class CacheSQLite(_Estatisticas):
+    """Cache num ficheiro SQLite partilhado pelos processos da máquina.
+
+    Os valores são guardados com pickle: o ficheiro é local e só a aplicação
+    lá escreve. A limpeza das entradas expiradas e do excesso sobre `max_itens`
+    (as mais antigas primeiro) é feita a cada `LIMPAR_A_CADA` gravações.
+    """
+
+    LIMPAR_A_CADA = 200
+
+    def __init__(self, arquivo, max_itens=10000, ttl=60):
+        super().__init__()
+        self.arquivo = arquivo
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._local = threading.local()
+        self._gravacoes = 0
+        diretorio = os.path.dirname(os.path.abspath(arquivo))
+        os.makedirs(diretorio, exist_ok=True)
+        with self._conexao() as conexao:
+            conexao.execute(
+                'CREATE TABLE IF NOT EXISTS entrada (chave TEXT PRIMARY KEY, secretaria_id INTEGER, '
+                'expira REAL NOT NULL, valor BLOB NOT NULL)'
+            )
+            conexao.execute('CREATE INDEX IF NOT EXISTS ix_entrada_secretaria ON entrada (secretaria_id)')
+            conexao.execute('CREATE INDEX IF NOT EXISTS ix_entrada_expira ON entrada (expira)')
+
+    def _conexao(self):
+        # Uma ligação por thread e por processo (os workers do gunicorn são forks)
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None or self._local.pid != os.getpid():
+            conexao = sqlite3.connect(self.arquivo, timeout=5, isolation_level=None, check_same_thread=False)
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('PRAGMA synchronous=NORMAL')
+            self._local.conexao, self._local.pid = conexao, os.getpid()
+        return conexao
+
+    def obter(self, chave):
+        try:
+            linha = self._conexao().execute(
+                'SELECT valor FROM entrada WHERE chave = ? AND expira > ?', (chave, time.time())
+            ).fetchone()
+            valor = pickle.loads(linha[0]) if linha is not None else None
+        except (sqlite3.Error, pickle.UnpicklingError) as e:
+            # O cache nunca deve derrubar um pedido: na dúvida, é uma falha
+            current_app.logger.warning(f'Erro ao ler o cache: {e}')
+            valor = None
+        self._contar(chave, valor is not None)
+        return valor
+
+    def guardar(self, chave, valor, secretaria_id=None):
+        try:
+            conexao = self._conexao()
+            conexao.execute(
+                'INSERT OR REPLACE INTO entrada (chave, secretaria_id, expira, valor) VALUES (?, ?, ?, ?)',
+                (chave, secretaria_id, time.time() + self.ttl, pickle.dumps(valor, pickle.HIGHEST_PROTOCOL))
+            )
+            self._gravacoes += 1
+            if self._gravacoes % self.LIMPAR_A_CADA == 0:
+                self._limpar(conexao)
+        except sqlite3.Error as e:
+            current_app.logger.warning(f'Erro ao gravar no cache: {e}')
+        return valor
+
+    def invalidar(self, secretaria_ids=None):
+        conexao = self._conexao()
+        if secretaria_ids is None:
+            conexao.execute('DELETE FROM entrada')
+            return
+        ids = list(secretaria_ids)
+        conexao.execute(
+            f'DELETE FROM entrada WHERE secretaria_id IS NULL OR secretaria_id IN ({", ".join("?" * len(ids))})', ids
+        )
+
+    def _limpar(self, conexao):
+        conexao.execute('DELETE FROM entrada WHERE expira <= ?', (time.time(),))
+        conexao.execute(
+            'DELETE FROM entrada WHERE chave IN (SELECT chave FROM entrada ORDER BY expira DESC LIMIT -1 OFFSET ?)',
+            (self.max_itens,)
+        )
+
+
+def criar(config, instance_path):
+    """Cria o backend indicado em CACHE_TIPO, ou None para `nenhum`."""
+    tipo = config.get('CACHE_TIPO', 'memoria')
+    if tipo not in TIPOS:
+        raise ValueError(f'CACHE_TIPO deve ser um de {", ".join(TIPOS)}.')
+    if tipo == 'memoria':
+        return CacheMemoria(max_itens=config.get('CACHE_ITENS', 1024), ttl=config.get('CACHE_TTL', 60))
+    if tipo == 'sqlite':
+        arquivo = config.get('CACHE_ARQUIVO') or os.path.join(instance_path, 'cache.sqlite3')
+        return CacheSQLite(arquivo, max_itens=config.get('CACHE_ITENS', 1024), ttl=config.get('CACHE_TTL', 60))
+    return None
+
+
+def init_app(app):
+    """Cria o cache da aplicação e junta as suas contagens ao /_metrics."""
+    cache = criar(app.config, app.instance_path)
+    app.extensions['cache'] = cache
+    if cache is not None and 'metricas' in app.extensions:
+        app.extensions['metricas'].fontes.append(cache.prometheus)
+
+
+def obter():
+    """O cache da aplicação atual, ou None (sem app, ou CACHE_TIPO=nenhum)."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('cache')
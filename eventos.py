@@ -0,0 +1,118 @@
+"""Canal de eventos do painel, entregue aos navegadores por Server-Sent Events.
+
+As rotas de escrita publicam, depois do commit, um pequeno delta por secretaria
+(totais novos, o total do dia alterado) e o /api/eventos envia-o a cada painel
+aberto, que atualiza os gráficos sem recarregar a página.
+
+Os workers do gunicorn não partilham memória, por isso o canal é uma tabela num
+ficheiro SQLite local (EVENTOS_ARQUIVO): publicar é um INSERT e cada ligação SSE
+lê, a cada EVENTOS_INTERVALO segundos, os eventos com id maior que o último que
+enviou. O id do evento é o `id:` do SSE; ao reconectar, o navegador manda-o em
+Last-Event-ID e recebe o que perdeu, desde que ainda esteja no canal (os eventos
+são apagados ao fim de EVENTOS_RETENCAO segundos).
+
+O canal só existe com EVENTOS_ATIVOS=1. Cada ligação ocupa um worker enquanto
+está aberta, e num worker síncrono (gunicorn `sync`, o servidor do Flask sem
+threads) isso bloqueia as outras rotas; ativar só com uma classe de worker
+com threads, gevent ou assíncrona. Mesmo assim as ligações são curtas, como um
+long-poll: cada uma termina ao fim de EVENTOS_DURACAO segundos ou logo depois de
+entregar eventos, e o `retry:` pede ao navegador que espere EVENTOS_ESPERA
+segundos antes de voltar a ligar.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+# Eventos lidos de cada vez; um lote cheio é seguido logo de outra leitura
+LOTE = 100
+
+
+class CanalSQLite:
+    """Fila de eventos num ficheiro SQLite, partilhada pelos processos da máquina."""
+
+    def __init__(self, arquivo, retencao=600):
+        self.arquivo = arquivo
+        self.retencao = retencao
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(arquivo)), exist_ok=True)
+        conexao = self._conexao()
+        conexao.execute(
+            'CREATE TABLE IF NOT EXISTS evento (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'tipo TEXT NOT NULL, dados TEXT NOT NULL, criado REAL NOT NULL)'
+        )
+        conexao.execute('CREATE INDEX IF NOT EXISTS ix_evento_criado ON evento (criado)')
+
+    def _conexao(self):
+        # Uma ligação por thread e por processo (os workers do gunicorn são forks)
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None or self._local.pid != os.getpid():
+            conexao = sqlite3.connect(self.arquivo, timeout=5, isolation_level=None, check_same_thread=False)
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('PRAGMA synchronous=NORMAL')
+            self._local.conexao, self._local.pid = conexao, os.getpid()
+        return conexao
+
+    def publicar(self, tipo, dados):
+        """Acrescenta um evento e devolve o seu id. Aproveita para apagar os expirados."""
+        agora = time.time()
+        conexao = self._conexao()
+        cursor = conexao.execute(
+            'INSERT INTO evento (tipo, dados, criado) VALUES (?, ?, ?)',
+            (tipo, json.dumps(dados, separators=(',', ':'), ensure_ascii=False), agora)
+        )
+        conexao.execute('DELETE FROM evento WHERE criado < ?', (agora - self.retencao,))
+        return cursor.lastrowid
+
+    def ultimo_id(self):
+        return self._conexao().execute('SELECT COALESCE(MAX(id), 0) FROM evento').fetchone()[0]
+
+    def ler(self, depois_de, limite=LOTE):
+        """Eventos com id maior que `depois_de`, como (id, tipo, dados em JSON)."""
+        return self._conexao().execute(
+            'SELECT id, tipo, dados FROM evento WHERE id > ? ORDER BY id LIMIT ?', (depois_de, limite)
+        ).fetchall()
+
+
+def _formatar(evento_id, tipo, dados):
+    return f'id: {evento_id}\nevent: {tipo}\ndata: {dados}\n\n'
+
+
+def transmitir(canal, depois_de, intervalo=1.0, duracao=5, espera=10):
+    """Gerador do corpo text/event-stream: espera até `duracao` segundos por eventos novos.
+
+    Termina assim que envia um lote, ou ao fim de `duracao` sem eventos, e o
+    EventSource volta a ligar `espera` segundos depois, com o Last-Event-ID.
+    """
+    yield f'retry: {int(espera * 1000)}\n\n'
+    # Um `id:` sem dados só fixa o Last-Event-ID: a próxima ligação retoma daqui
+    # mesmo que esta termine sem eventos
+    yield f'id: {depois_de}\n\n'
+    inicio = time.monotonic()
+    while True:
+        eventos = canal.ler(depois_de)
+        for evento_id, tipo, dados in eventos:
+            yield _formatar(evento_id, tipo, dados)
+            depois_de = evento_id
+        if len(eventos) == LOTE:
+            continue
+        if eventos or time.monotonic() - inicio >= duracao:
+            return
+        time.sleep(intervalo)
+
+
+def init_app(app):
+    if not app.config.get('EVENTOS_ATIVOS'):
+        return
+    arquivo = app.config.get('EVENTOS_ARQUIVO') or os.path.join(app.instance_path, 'eventos.sqlite3')
+    app.extensions['eventos'] = CanalSQLite(arquivo, retencao=app.config.get('EVENTOS_RETENCAO', 600))
+
+
+def obter():
+    """O canal da aplicação atual, ou None fora de uma app ou com os eventos desligados."""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('eventos')
@@ -0,0 +1,78 @@
+"""Execução do trabalho bloqueante do bot fora do event loop.
+
+Os handlers do bot são corrotinas, mas as consultas SQLAlchemy e a renderização
+dos gráficos são síncronas; se corressem no próprio loop, um gráfico lento
+congelava o bot para todos os utilizadores. Os handlers aguardam antes:
+
+- `banco(funcao, ...)`: pool de threads (BOT_THREADS_BANCO). Cada chamada recebe
+  uma sessão própria como primeiro argumento, `funcao(sessao, ...)`, e deve
+  devolver dados simples (tuplas, dicionários), não objetos a carregar depois.
+- `grafico(funcao, ...)`: pool de processos (BOT_PROCESSOS_GRAFICO) para o
+  matplotlib, que assim não disputa o GIL com o loop.
+
+O número de operações em curso ou em espera é limitado a `fator_fila` vezes o
+número de workers, e cada operação tem um tempo máximo (BOT_TIMEOUT_BANCO,
+BOT_TIMEOUT_GRAFICO); ao esgotá-lo é lançado `TimeoutError`.
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+
+
+class ExecutorBot:
+    """Pools limitados para acesso à base de dados e renderização de gráficos."""
+
+    def __init__(self, sessoes, threads_banco=None, processos_grafico=None,
+                 timeout_banco=None, timeout_grafico=None, fator_fila=4, inline=False):
+        self.sessoes = sessoes
+        self.threads_banco = threads_banco or int(os.getenv('BOT_THREADS_BANCO', 4))
+        self.processos_grafico = processos_grafico or int(os.getenv('BOT_PROCESSOS_GRAFICO', 2))
+        self.timeout_banco = timeout_banco or float(os.getenv('BOT_TIMEOUT_BANCO', 10))
+        self.timeout_grafico = timeout_grafico or float(os.getenv('BOT_TIMEOUT_GRAFICO', 30))
+        self.fator_fila = fator_fila
+        # inline=True corre tudo diretamente no loop (o comportamento antigo); serve para comparação
+        self.inline = inline
+        self._pool_banco = None
+        self._pool_grafico = None
+        self._vagas_banco = None
+        self._vagas_grafico = None
+
+    async def banco(self, funcao, *args, **kwargs):
+        """Corre `funcao(sessao, *args, **kwargs)` numa thread, com uma sessão nova de `sessoes`."""
+        if self._pool_banco is None:
+            self._pool_banco = ThreadPoolExecutor(max_workers=self.threads_banco, thread_name_prefix='bot-banco')
+            self._vagas_banco = asyncio.Semaphore(self.threads_banco * self.fator_fila)
+        chamada = functools.partial(self._com_sessao, funcao, *args, **kwargs)
+        return await self._executar(self._pool_banco, self._vagas_banco, chamada, self.timeout_banco)
+
+    async def grafico(self, funcao, *args, **kwargs):
+        """Corre `funcao(*args, **kwargs)` num processo de trabalho; `funcao` tem de ser importável."""
+        if self._pool_grafico is None:
+            # 'spawn' evita herdar o estado do loop e as ligações abertas à base de dados
+            self._pool_grafico = ProcessPoolExecutor(max_workers=self.processos_grafico, mp_context=get_context('spawn'))
+            self._vagas_grafico = asyncio.Semaphore(self.processos_grafico * self.fator_fila)
+        chamada = functools.partial(funcao, *args, **kwargs)
+        return await self._executar(self._pool_grafico, self._vagas_grafico, chamada, self.timeout_grafico)
+
+    def encerrar(self):
+        for pool in (self._pool_banco, self._pool_grafico):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._pool_banco = self._pool_grafico = None
+
+    def _com_sessao(self, funcao, *args, **kwargs):
+        with self.sessoes() as sessao:
+            return funcao(sessao, *args, **kwargs)
+
+    async def _executar(self, pool, vagas, chamada, timeout):
+        if self.inline:
+            return chamada()
+
+        async def na_fila():
+            async with vagas:
+                return await asyncio.get_running_loop().run_in_executor(pool, chamada)
+
+        # O tempo de espera por uma vaga também conta para o limite
+        return await asyncio.wait_for(na_fila(), timeout)
@@ -0,0 +1,200 @@
+"""Fechamento das medições: os totais de um período encerrado ficam gravados.
+
+Fechar uma medição grava num FechamentoMedicao o orçamento total, o gasto no
+período, o resultado e a quantidade de gastos, e num FechamentoObra o orçamento
+efetivo (e a fonte) de cada obra. A partir daí são esses os valores que as
+páginas, os gráficos e os relatórios leem (ver os hybrids de Medicao), e o
+período deixa de ser recalculado a cada acesso.
+
+Uma edição posterior que toca o período fechado (um gasto com data no período,
+os orçamentos ou as datas da medição, uma obra movida ou removida) não muda o
+fechamento: as rotas chamam as funções `registrar_*`, na mesma transação da
+escrita, e o fechamento fica marcado com `alterado_em`. Resta então `recalcular`
+(grava os totais atuais) ou `reabrir` (apaga o fechamento). As escritas que não
+passam pelas rotas são apanhadas por `verificar` (`flask check-closed-medicoes`).
+"""
+from datetime import datetime
+
+from sqlalchemy import and_, exists, func, or_
+from sqlalchemy.orm import contains_eager
+
+from models import db, Gasto, Obra, Medicao, OrcamentoMedicaoObra, FechamentoMedicao, FechamentoObra
+import rollups
+
+# Diferença (em valor) a partir da qual `verificar` considera um total alterado
+TOLERANCIA = 0.005
+
+
+def _orcamentos(medicao):
+    return db.session.query(
+        OrcamentoMedicaoObra.obra_id, Obra.nome, OrcamentoMedicaoObra.fonte_orcamento_selecionada,
+        func.coalesce(OrcamentoMedicaoObra.valor_efetivo, 0.0)
+    ).join(Obra, OrcamentoMedicaoObra.obra_id == Obra.id).filter(
+        OrcamentoMedicaoObra.medicao_id == medicao.id
+    ).all()
+
+
+def _gastos(medicao):
+    """(total, quantidade) dos gastos da secretaria no período da medição."""
+    return db.session.query(func.coalesce(func.sum(Gasto.valor), 0.0), func.count(Gasto.id)).join(
+        Obra, Gasto.obra_id == Obra.id
+    ).filter(
+        Obra.secretaria_id == medicao.secretaria_id,
+        Gasto.data >= medicao.data_inicio,
+        Gasto.data <= medicao.data_fim
+    ).one()
+
+
+def _gravar(fechamento, medicao):
+    orcamentos = _orcamentos(medicao)
+    total_gasto, qtd_gastos = _gastos(medicao)
+    fechamento.fechado_em = datetime.utcnow()
+    fechamento.alterado_em = None
+    fechamento.data_inicio = medicao.data_inicio
+    fechamento.data_fim = medicao.data_fim
+    fechamento.orcamento_total = sum(valor for _, _, _, valor in orcamentos)
+    fechamento.total_gasto = total_gasto
+    fechamento.resultado = fechamento.orcamento_total - total_gasto
+    fechamento.qtd_gastos = qtd_gastos
+    fechamento.obras = [
+        FechamentoObra(obra_id=obra_id, obra_nome=nome, fonte_orcamento=fonte or 'inicial', valor_efetivo=valor)
+        for obra_id, nome, fonte, valor in orcamentos
+    ]
+
+
+def fechar(medicao):
+    """Grava o fechamento da medição com os totais atuais. ValueError se já estiver fechada."""
+    if medicao.fechamento is not None:
+        raise ValueError('A medição já está fechada.')
+    fechamento = FechamentoMedicao(medicao_id=medicao.id)
+    _gravar(fechamento, medicao)
+    medicao.fechamento = fechamento
+    # O orçamento e o gasto mostrados passam a ser os do fechamento. No consolidado da
+    # secretaria nada muda: o orçamento gravado é o mesmo que estava a ser contado
+    rollups.marcar_alterada(medicao.secretaria_id)
+    return fechamento
+
+
+def recalcular(medicao):
+    """Substitui os totais gravados pelos atuais (depois de uma edição tardia, por exemplo)."""
+    if medicao.fechamento is None:
+        raise ValueError('A medição não está fechada.')
+    orcamento_anterior = medicao.fechamento.orcamento_total
+    # As linhas por obra saem antes, para as novas poderem usar as mesmas chaves
+    medicao.fechamento.obras = []
+    db.session.flush()
+    _gravar(medicao.fechamento, medicao)
+    rollups.trocar_orcamento_medicao(medicao.secretaria_id, medicao.fechamento.orcamento_total - orcamento_anterior)
+    rollups.marcar_alterada(medicao.secretaria_id)
+    return medicao.fechamento
+
+
+def reabrir(medicao):
+    """Apaga o fechamento: a medição volta a ser calculada a partir dos gastos e orçamentos."""
+    if medicao.fechamento is None:
+        raise ValueError('A medição não está fechada.')
+    orcamento_gravado = medicao.fechamento.orcamento_total
+    medicao.fechamento = None
+    # O consolidado da secretaria volta a contar o orçamento atual da medição
+    orcamento_atual = sum(valor for _, _, _, valor in _orcamentos(medicao))
+    rollups.trocar_orcamento_medicao(medicao.secretaria_id, orcamento_atual - orcamento_gravado)
+    rollups.marcar_alterada(medicao.secretaria_id)
+
+
+# --- Deteção de edições tardias (chamadas pelas rotas antes do commit) ---
+
+def _fechamentos_da_secretaria(secretaria_id):
+    return FechamentoMedicao.query.join(Medicao, FechamentoMedicao.medicao_id == Medicao.id).options(
+        contains_eager(FechamentoMedicao.medicao)
+    ).filter(Medicao.secretaria_id == secretaria_id)
+
+
+def _marcar(fechamentos):
+    """Preenche `alterado_em` e devolve os nomes das medições (lidos antes do commit)."""
+    agora = datetime.utcnow()
+    for fechamento in fechamentos:
+        if fechamento.alterado_em is None:
+            fechamento.alterado_em = agora
+    return [fechamento.medicao.nome for fechamento in fechamentos]
+
+
+def registrar_gastos(secretaria_id, datas):
+    """Marca os fechamentos da secretaria cujo período contém alguma das `datas`.
+
+    Devolve os nomes das medições atingidas, para a rota poder avisar quem fez a edição.
+    """
+    datas = sorted(set(datas))
+    if not datas:
+        return []
+    candidatos = _fechamentos_da_secretaria(secretaria_id).filter(
+        FechamentoMedicao.data_inicio <= datas[-1], FechamentoMedicao.data_fim >= datas[0]
+    ).all()
+    return _marcar([
+        f for f in candidatos if any(f.data_inicio <= data <= f.data_fim for data in datas)
+    ])
+
+
+def registrar_medicao(medicao):
+    """Marca o fechamento da medição, se houver, depois de mudarem os orçamentos ou as datas."""
+    if medicao.fechamento is None:
+        return []
+    return _marcar([medicao.fechamento])
+
+
+def registrar_obra(obra_id, secretaria_id):
+    """Marca os fechamentos da secretaria que incluem a obra (orçamento ou gastos no período).
+
+    Deve ser chamada enquanto os gastos da obra ainda estão na secretaria: antes
+    de a obra ser removida, e com a secretaria antiga e a nova quando é movida.
+    """
+    tem_gastos = exists().where(
+        Gasto.obra_id == obra_id,
+        Gasto.data >= FechamentoMedicao.data_inicio,
+        Gasto.data <= FechamentoMedicao.data_fim
+    )
+    tem_orcamento = exists().where(
+        FechamentoObra.medicao_id == FechamentoMedicao.medicao_id, FechamentoObra.obra_id == obra_id
+    )
+    return _marcar(_fechamentos_da_secretaria(secretaria_id).filter(or_(tem_gastos, tem_orcamento)).all())
+
+
+def verificar():
+    """Compara cada fechamento com as tabelas de origem e marca os que divergem.
+
+    Apanha as escritas feitas fora das rotas (SQL direto, outras ferramentas).
+    Devolve [(medição, fechamento)] de todos os fechamentos marcados como alterados.
+    """
+    orcamentos = db.session.query(
+        OrcamentoMedicaoObra.medicao_id.label('medicao_id'),
+        func.sum(OrcamentoMedicaoObra.valor_efetivo).label('total')
+    ).group_by(OrcamentoMedicaoObra.medicao_id).subquery()
+    gastos = db.session.query(
+        FechamentoMedicao.medicao_id.label('medicao_id'),
+        func.sum(Gasto.valor).label('total'),
+        func.count(Gasto.id).label('qtd')
+    ).join(Medicao, FechamentoMedicao.medicao_id == Medicao.id).join(
+        Obra, Obra.secretaria_id == Medicao.secretaria_id
+    ).join(Gasto, and_(
+        Gasto.obra_id == Obra.id, Gasto.data >= Medicao.data_inicio, Gasto.data <= Medicao.data_fim
+    )).group_by(FechamentoMedicao.medicao_id).subquery()
+
+    linhas = db.session.query(
+        Medicao, FechamentoMedicao,
+        func.coalesce(orcamentos.c.total, 0.0), func.coalesce(gastos.c.total, 0.0), func.coalesce(gastos.c.qtd, 0)
+    ).join(FechamentoMedicao, FechamentoMedicao.medicao_id == Medicao.id).outerjoin(
+        orcamentos, orcamentos.c.medicao_id == Medicao.id
+    ).outerjoin(gastos, gastos.c.medicao_id == Medicao.id).all()
+
+    alterados = []
+    for medicao, fechamento, orcamento, gasto, qtd in linhas:
+        divergente = (
+            abs(orcamento - fechamento.orcamento_total) > TOLERANCIA
+            or abs(gasto - fechamento.total_gasto) > TOLERANCIA
+            or qtd != fechamento.qtd_gastos
+            or (medicao.data_inicio, medicao.data_fim) != (fechamento.data_inicio, fechamento.data_fim)
+        )
+        if divergente:
+            _marcar([fechamento])
+        if fechamento.alterado_em is not None:
+            alterados.append((medicao, fechamento))
+    return alterados
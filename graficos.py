@@ -0,0 +1,208 @@
+"""Gráficos em imagem enviados pelo bot do Telegram.
+
+Usa a API orientada a objetos do matplotlib (Figure + canvas Agg), sem o
+estado global do pyplot, para poder correr em threads ou processos de trabalho.
+
+Os PNG gerados ficam num cache endereçado pelo conteúdo (ver CacheGraficos):
+a chave é um hash dos valores desenhados, por isso um gráfico nunca é servido
+com números antigos. Não há invalidação pelas escritas: o cache vive no processo
+do bot e as rotas correm no processo web. Em vez disso, guardar o gráfico de uma
+secretaria apaga os anteriores dela, em memória e no disco, e o cache guarda no
+máximo um gráfico por secretaria.
+"""
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+# Muda quando o desenho muda, para não reaproveitar imagens feitas pelo código antigo
+VERSAO_GRAFICO = 1
+
+TEMAS = {
+    'claro': {
+        'fundo': '#F9FAFB',
+        'gasto': '#EF4444',
+        'disponivel': '#22C55E',
+        'titulo': '#1F2937',
+    },
+}
+
+
+def gerar_grafico_orcamento(usado, total, titulo, tema='claro'):
+    """Gera um gráfico de rosca com valores e percentagens e devolve os bytes do PNG."""
+    if total <= 0:
+        return None
+
+    # Importado aqui: só os processos que desenham pagam o arranque do matplotlib
+    from matplotlib.figure import Figure
+    from matplotlib.patches import Circle
+
+    cores = TEMAS[tema]
+
+    restante = total - usado
+    if restante < 0:
+        restante = 0
+        usado = total
+
+    # --- Lógica para os rótulos ---
+    def make_autopct(values):
+        def my_autopct(pct):
+            total_valor = sum(values)
+            val = int(round(pct * total_valor / 100.0))
+            # Formata o texto para incluir o valor em Reais e a percentagem
+            return f'R$ {val:,.2f}\n({pct:.1f}%)'.replace(',', 'X').replace('.', ',').replace('X', '.')
+        return my_autopct
+
+    labels = ['Gasto', 'Disponível']
+    sizes = [usado, restante]
+    colors = [cores['gasto'], cores['disponivel']]
+    explode = (0.05, 0)
+
+    # --- Configurações visuais do gráfico ---
+    fig = Figure(figsize=(8, 6), facecolor=cores['fundo'])
+    ax = fig.subplots()
+    ax.pie(
+        sizes,
+        explode=explode,
+        labels=labels,
+        colors=colors,
+        autopct=make_autopct(sizes), # Usa a nossa função de rótulo personalizada
+        shadow=False,
+        startangle=90,
+        pctdistance=0.8,
+        textprops={'fontsize': 10, 'fontweight': 'bold', 'color': 'white'}
+    )
+
+    ax.add_artist(Circle((0, 0), 0.65, fc=cores['fundo']))
+
+    ax.axis('equal')
+    ax.set_title(titulo, pad=20, fontsize=16, fontweight='bold', color=cores['titulo'])
+    fig.tight_layout()
+
+    buf = BytesIO()
+    fig.savefig(buf, format='png', dpi=150) # Aumenta a resolução
+    return buf.getvalue()
+
+
+class CacheGraficos:
+    """Cache LRU de PNG em memória, com uma camada opcional em disco partilhável entre processos.
+
+    Cada entrada é um dicionário {'png': bytes, 'file_id': str ou None}; o `file_id`
+    é o identificador devolvido pelo Telegram depois do primeiro envio, que permite
+    reenviar a mesma imagem sem voltar a carregar os bytes. No disco, as entradas
+    ficam em <diretorio>/<secretaria_id>/<chave>.png (e .file_id).
+    """
+
+    def __init__(self, max_itens=128, diretorio=None):
+        self.max_itens = max_itens
+        self.diretorio = diretorio
+        self._entradas = OrderedDict()  # chave -> (secretaria_id, entrada)
+        self._trava = threading.Lock()
+
+    @staticmethod
+    def chave(secretaria_id, usado, total, titulo, tema='claro'):
+        conteudo = f'{VERSAO_GRAFICO}|{secretaria_id}|{usado:.2f}|{total:.2f}|{tema}|{titulo}'
+        return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+    def obter(self, secretaria_id, chave):
+        """Devolve a entrada em cache, ou None."""
+        with self._trava:
+            if chave in self._entradas:
+                self._entradas.move_to_end(chave)
+                return self._entradas[chave][1]
+
+        caminho = self._caminho(secretaria_id, chave)
+        if caminho is None or not os.path.exists(caminho + '.png'):
+            return None
+        try:
+            with open(caminho + '.png', 'rb') as f:
+                entrada = {'png': f.read(), 'file_id': None}
+            if os.path.exists(caminho + '.file_id'):
+                with open(caminho + '.file_id', encoding='utf-8') as f:
+                    entrada['file_id'] = f.read().strip() or None
+        except OSError:
+            # Pode ter sido invalidado por outro processo entretanto
+            return None
+        self._guardar_em_memoria(secretaria_id, chave, entrada)
+        return entrada
+
+    def guardar(self, secretaria_id, chave, png):
+        entrada = {'png': png, 'file_id': None}
+        self._guardar_em_memoria(secretaria_id, chave, entrada)
+        caminho = self._caminho(secretaria_id, chave)
+        if caminho is not None:
+            pasta = os.path.dirname(caminho)
+            os.makedirs(pasta, exist_ok=True)
+            self._escrever(caminho + '.png', png)
+            # Como em memória, só fica o gráfico mais recente da secretaria (os .tmp
+            # são escritas em curso de outros processos)
+            for nome in os.listdir(pasta):
+                if not nome.startswith(chave) and not nome.endswith('.tmp'):
+                    try:
+                        os.remove(os.path.join(pasta, nome))
+                    except OSError:
+                        pass
+        return entrada
+
+    def guardar_file_id(self, secretaria_id, chave, file_id):
+        with self._trava:
+            if chave in self._entradas:
+                self._entradas[chave][1]['file_id'] = file_id
+        caminho = self._caminho(secretaria_id, chave)
+        if caminho is not None and os.path.exists(caminho + '.png'):
+            self._escrever(caminho + '.file_id', file_id.encode('utf-8'))
+
+    def invalidar(self, secretaria_ids=None):
+        """Remove as entradas das secretarias indicadas (todas, se None)."""
+        with self._trava:
+            for chave, (secretaria_id, _) in list(self._entradas.items()):
+                if secretaria_ids is None or secretaria_id in secretaria_ids:
+                    del self._entradas[chave]
+        if self.diretorio is None:
+            return
+        if secretaria_ids is None:
+            shutil.rmtree(self.diretorio, ignore_errors=True)
+        else:
+            for secretaria_id in secretaria_ids:
+                shutil.rmtree(os.path.join(self.diretorio, str(secretaria_id)), ignore_errors=True)
+
+    def _guardar_em_memoria(self, secretaria_id, chave, entrada):
+        with self._trava:
+            # Só o gráfico com os valores mais recentes de cada secretaria interessa
+            for outra, (sid, _) in list(self._entradas.items()):
+                if sid == secretaria_id and outra != chave:
+                    del self._entradas[outra]
+            self._entradas[chave] = (secretaria_id, entrada)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_itens:
+                self._entradas.popitem(last=False)
+
+    def _caminho(self, secretaria_id, chave):
+        if self.diretorio is None:
+            return None
+        return os.path.join(self.diretorio, str(secretaria_id), chave)
+
+    @staticmethod
+    def _escrever(caminho, dados):
+        temporario = f'{caminho}.{os.getpid()}.tmp'
+        with open(temporario, 'wb') as f:
+            f.write(dados)
+        os.replace(temporario, caminho)
+
+
+_cache = None
+_trava_global = threading.Lock()
+
+
+def obter_cache():
+    """Devolve o cache partilhado pelo processo (GRAFICOS_CACHE_ITENS, GRAFICOS_CACHE_DIR)."""
+    global _cache
+    with _trava_global:
+        if _cache is None:
+            _cache = CacheGraficos(
+                max_itens=int(os.getenv('GRAFICOS_CACHE_ITENS', 128)),
+                diretorio=os.getenv('GRAFICOS_CACHE_DIR') or None
+            )
+        return _cache
@@ -0,0 +1,315 @@
+"""Importação em massa de gastos a partir das folhas mensais (CSV ou XLSX).
+
+As linhas são lidas em fluxo, com o módulo csv sobre o ficheiro aberto ou com o
+openpyxl em modo read-only, e nunca ficam todas em memória. Cada linha:
+
+- encontra a sua obra pelo nº do contrato ou, na falta dele, pelo nome, num
+  mapa carregado uma única vez no início (sem uma consulta por linha);
+- é validada com as regras do GastoForm, as mesmas do formulário da obra;
+- entra num lote de LINHAS_POR_LOTE gastos, gravado com um único executemany.
+
+No fim, os resumos são atualizados uma vez por obra, com a soma importada, e o
+saldo de cada secretaria afetada é comparado antes e depois, para o aviso de
+saldo negativo. Tudo corre na transação de quem chama, que decide o commit (ou
+o rollback, numa simulação). As linhas com erro são saltadas e ficam no
+relatório com o número da linha no ficheiro.
+"""
+import csv
+import io
+import re
+import unicodedata
+import zipfile
+from datetime import date, datetime
+
+from sqlalchemy import insert
+from werkzeug.datastructures import MultiDict
+
+from forms import GastoForm
+from models import db, Gasto, Obra, Secretaria
+import fechamentos
+import rollups
+
+LINHAS_POR_LOTE = 1000
+# Erros guardados com detalhe; os restantes só são contados
+MAXIMO_ERROS = 1000
+FORMATOS = ('csv', 'xlsx')
+
+# Nomes aceites para cada coluna, já normalizados (ver _normalizar)
+COLUNAS = {
+    'contrato': ('n contrato', 'n do contrato', 'numero do contrato', 'contrato'),
+    'obra': ('obra', 'nome da obra', 'nome'),
+    'descricao': ('descricao', 'descricao do gasto', 'historico'),
+    'valor': ('valor', 'valor r', 'valor do gasto'),
+    'data': ('data', 'data do gasto'),
+}
+FORMATOS_DATA = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y')
+
+_NAO_ALFANUMERICO = re.compile(r'[^0-9a-z]+')
+_AMBIGUA = object()
+
+
+class ResultadoImportacao:
+    """Contagens, erros por linha e totais por secretaria de uma importação."""
+
+    def __init__(self, maximo_erros=MAXIMO_ERROS):
+        self.maximo_erros = maximo_erros
+        self.linhas = 0
+        self.importados = 0
+        self.valor_importado = 0.0
+        self.total_erros = 0
+        self.erros = []  # (linha, mensagem), até maximo_erros (None: todos)
+        # secretaria_id -> {'nome', 'gastos', 'valor', 'saldo_antes', 'saldo_depois'}
+        self.secretarias = {}
+        # Nomes das medições fechadas com gastos importados no seu período (ver fechamentos.py)
+        self.medicoes_fechadas = []
+
+    def erro(self, linha, mensagem):
+        self.total_erros += 1
+        if self.maximo_erros is None or len(self.erros) < self.maximo_erros:
+            self.erros.append((linha, mensagem))
+
+    @property
+    def saldos_negativos(self):
+        """Secretarias que ficaram com saldo negativo depois da importação."""
+        return {sid: dados for sid, dados in self.secretarias.items() if dados['saldo_depois'] < 0}
+
+
+def _normalizar(texto):
+    """Minúsculas, sem acentos e com a pontuação reduzida a espaços: 'Nº do Contrato' -> 'n do contrato'."""
+    if texto is None:
+        return ''
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii')
+    return _NAO_ALFANUMERICO.sub(' ', texto.lower()).strip()
+
+
+def formato_do_arquivo(nome):
+    extensao = nome.rsplit('.', 1)[-1].lower() if '.' in nome else ''
+    if extensao not in FORMATOS:
+        raise ValueError('O ficheiro deve ser .csv ou .xlsx.')
+    return extensao
+
+
+# --- Leitura em fluxo ---
+
+def _mapear_cabecalho(cabecalho):
+    """Índice de cada coluna conhecida no cabeçalho. ValueError se faltar uma obrigatória."""
+    posicoes = {}
+    for indice, nome in enumerate(cabecalho):
+        nome = _normalizar(nome)
+        for coluna, nomes in COLUNAS.items():
+            if nome in nomes and coluna not in posicoes:
+                posicoes[coluna] = indice
+    em_falta = [c for c in ('descricao', 'valor', 'data') if c not in posicoes]
+    if 'contrato' not in posicoes and 'obra' not in posicoes:
+        em_falta.append('contrato ou obra')
+    if em_falta:
+        raise ValueError(f'Colunas em falta no cabeçalho: {", ".join(em_falta)}.')
+    return posicoes
+
+
+def _linhas_csv(arquivo):
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+    # O separador sai do cabeçalho: nas linhas, a vírgula decimal ("1.234,56") confundiria a deteção
+    cabecalho = texto.readline()
+    texto.seek(0)
+    separador = max(';,\t', key=cabecalho.count)
+    yield from csv.reader(texto, delimiter=separador)
+
+
+def _linhas_xlsx(arquivo):
+    # Importado aqui: o openpyxl só é carregado por quem importa folhas
+    import openpyxl
+
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        livro = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError) as e:
+        raise ValueError('Não foi possível ler o ficheiro XLSX.') from e
+    try:
+        yield from livro.worksheets[0].iter_rows(values_only=True)
+    finally:
+        livro.close()
+
+
+def ler_linhas(arquivo, formato):
+    """Gera (número da linha, {coluna: valor}) a partir de um ficheiro binário aberto.
+
+    A primeira linha não vazia é o cabeçalho; as linhas vazias são ignoradas.
+    """
+    linhas = _linhas_csv(arquivo) if formato == 'csv' else _linhas_xlsx(arquivo)
+    posicoes = None
+    for numero, valores in enumerate(linhas, start=1):
+        if not any(v not in (None, '') for v in valores):
+            continue
+        if posicoes is None:
+            posicoes = _mapear_cabecalho(valores)
+            continue
+        yield numero, {
+            coluna: valores[indice] if indice < len(valores) else None for coluna, indice in posicoes.items()
+        }
+    if posicoes is None:
+        raise ValueError('O ficheiro está vazio.')
+
+
+# --- Conversão e validação de cada linha ---
+
+def _texto_valor(valor):
+    """'1.234,56', 'R$ 1234,56', '1234.56' ou um número do Excel -> '1234.56' (ou '' se vazio)."""
+    if valor is None:
+        return ''
+    if isinstance(valor, (int, float)):
+        return repr(float(valor))
+    texto = str(valor).replace('R$', '').replace(' ', '').strip()
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    return texto
+
+
+def _texto_data(valor):
+    """Devolve a data em AAAA-MM-DD, o formato do GastoForm. ValueError se não for uma data."""
+    if isinstance(valor, datetime):
+        return valor.date().isoformat()
+    if isinstance(valor, date):
+        return valor.isoformat()
+    texto = str(valor or '').strip()
+    if not texto:
+        return ''
+    for formato in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, formato).date().isoformat()
+        except ValueError:
+            pass
+    raise ValueError(f'Data inválida: {texto}')
+
+
+def _validar(linha):
+    """Valida a linha com o GastoForm. Devolve (dados, None) ou (None, mensagem de erro)."""
+    try:
+        data = _texto_data(linha['data'])
+    except ValueError as e:
+        return None, str(e)
+    form = GastoForm(
+        formdata=MultiDict({
+            'descricao': str(linha['descricao'] or '').strip(),
+            'valor': _texto_valor(linha['valor']),
+            'data': data,
+        }),
+        meta={'csrf': False}
+    )
+    if not form.validate():
+        return None, '; '.join(
+            f'{form[campo].label.text}: {", ".join(mensagens)}' for campo, mensagens in form.errors.items()
+        )
+    return {'descricao': form.descricao.data, 'valor': form.valor.data, 'data': form.data.data}, None
+
+
+# --- Obras ---
+
+def _mapa_obras(secretaria_id=None):
+    """{contrato normalizado: (obra_id, secretaria_id)} e o mesmo por nome, numa só consulta."""
+    consulta = db.session.query(Obra.id, Obra.secretaria_id, Obra.nome, Obra.n_contrato).join(
+        Secretaria, Obra.secretaria_id == Secretaria.id
+    ).filter(Secretaria.ativa)
+    if secretaria_id:
+        consulta = consulta.filter(Obra.secretaria_id == secretaria_id)
+    por_contrato, por_nome = {}, {}
+    for obra_id, sid, nome, n_contrato in consulta:
+        for mapa, chave in ((por_contrato, _normalizar(n_contrato)), (por_nome, _normalizar(nome))):
+            if chave:
+                # Duas obras com o mesmo contrato (ou nome) não podem ser escolhidas pela folha
+                mapa[chave] = _AMBIGUA if chave in mapa else (obra_id, sid)
+    return por_contrato, por_nome
+
+
+def _encontrar_obra(linha, por_contrato, por_nome):
+    """Devolve ((obra_id, secretaria_id), None) ou (None, mensagem de erro)."""
+    tentativas = (
+        ('contrato', linha.get('contrato'), por_contrato),
+        ('obra', linha.get('obra'), por_nome),
+    )
+    for rotulo, valor, mapa in tentativas:
+        chave = _normalizar(valor)
+        if not chave:
+            continue
+        obra = mapa.get(chave)
+        if obra is _AMBIGUA:
+            return None, f'Há mais de uma obra com {rotulo} "{valor}".'
+        if obra is not None:
+            return obra, None
+    indicado = linha.get('contrato') or linha.get('obra')
+    if not _normalizar(indicado):
+        return None, 'Linha sem contrato nem nome da obra.'
+    return None, f'Obra não encontrada: "{indicado}".'
+
+
+# --- Importação ---
+
+def importar(arquivo, formato, secretaria_id=None, progresso=None, maximo_erros=MAXIMO_ERROS):
+    """Importa os gastos de `arquivo` (binário, aberto) para a sessão atual, sem commit.
+
+    Com `secretaria_id`, as obras só são procuradas nessa secretaria. `progresso(linhas)`
+    é chamado a cada lote gravado; com `maximo_erros=None` todos os erros ficam
+    no resultado (para o relatório completo). Devolve um ResultadoImportacao; um ValueError
+    indica um ficheiro que não pode ser lido (formato, cabeçalho).
+    """
+    resultado = ResultadoImportacao(maximo_erros)
+    por_contrato, por_nome = _mapa_obras(secretaria_id)
+    # obra_id -> [secretaria_id, valor, quantidade]
+    por_obra = {}
+    datas_por_secretaria = {}
+    lote = []
+
+    def gravar_lote():
+        if lote:
+            db.session.execute(insert(Gasto), lote)
+            lote.clear()
+            if progresso:
+                progresso(resultado.linhas)
+
+    for numero, linha in ler_linhas(arquivo, formato):
+        resultado.linhas += 1
+        obra, erro = _encontrar_obra(linha, por_contrato, por_nome)
+        if erro is None:
+            dados, erro = _validar(linha)
+        if erro is not None:
+            resultado.erro(numero, erro)
+            continue
+
+        obra_id, sid = obra
+        if sid not in resultado.secretarias:
+            # Lido antes de qualquer gasto desta secretaria entrar na base
+            secretaria = db.session.get(Secretaria, sid)
+            resultado.secretarias[sid] = {
+                'nome': secretaria.nome, 'gastos': 0, 'valor': 0.0,
+                'saldo_antes': secretaria.orcamento_restante, 'saldo_depois': secretaria.orcamento_restante,
+            }
+        lote.append({**dados, 'obra_id': obra_id})
+        datas_por_secretaria.setdefault(sid, set()).add(dados['data'])
+        soma = por_obra.setdefault(obra_id, [sid, 0.0, 0])
+        soma[1] += dados['valor']
+        soma[2] += 1
+        resultado.importados += 1
+        resultado.valor_importado += dados['valor']
+        if len(lote) >= LINHAS_POR_LOTE:
+            gravar_lote()
+    gravar_lote()
+
+    # Uma atualização de resumo por obra, e o saldo de cada secretaria calculado uma vez
+    for obra_id, (sid, valor, quantidade) in por_obra.items():
+        rollups.registrar_gasto(obra_id, sid, valor, qtd=quantidade)
+        dados = resultado.secretarias[sid]
+        dados['gastos'] += quantidade
+        dados['valor'] += valor
+    for dados in resultado.secretarias.values():
+        dados['saldo_depois'] = dados['saldo_antes'] - dados['valor']
+    for sid, datas in datas_por_secretaria.items():
+        resultado.medicoes_fechadas += fechamentos.registrar_gastos(sid, datas)
+    return resultado
+
+
+def escrever_erros(resultado, destino):
+    """Grava o relatório de erros em CSV (linha;erro) num ficheiro de texto aberto."""
+    escritor = csv.writer(destino, delimiter=';')
+    escritor.writerow(['linha', 'erro'])
+    escritor.writerows(resultado.erros)
@@ -0,0 +1,222 @@
+"""Instrumentação de pedidos: consultas SQL, tempo de banco, de templates e total.
+
+`init_app(app)` liga:
+- os eventos `before/after_cursor_execute` do SQLAlchemy, que contam as
+  consultas e o tempo de banco do pedido em curso;
+- os sinais `before_render_template`/`template_rendered` do Flask, para o
+  tempo de renderização;
+- um `after_request` que junta tudo, acrescenta o cabeçalho `Server-Timing` e
+  acumula os totais por endpoint.
+
+Cada instrução SQL é reduzida a uma impressão digital (literais e listas de
+parâmetros normalizados); uma impressão que se repete METRICAS_LIMITE_REPETICOES
+vezes no mesmo pedido é um provável N+1 e fica registada. Pedidos acima de
+METRICAS_ORCAMENTO_CONSULTAS consultas geram um aviso no log.
+
+Os totais ficam em memória, por processo, e são expostos em /_metrics no
+formato de texto do Prometheus. As impressões digitais revelam a forma das
+consultas, por isso o endpoint só responde com METRICAS_TOKEN definido (e ao
+pedido com esse token); sem token devolve 404.
+Outros módulos podem juntar as suas linhas com `Acumulador.fontes`.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import Counter
+
+from flask import Response, abort, before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_LISTA_PARAMETROS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_NUMEROS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_TEXTOS = re.compile(r"'(?:[^']|'')*'")
+_ESPACOS = re.compile(r'\s+')
+
+
+def impressao_digital(sql):
+    """Normaliza a instrução para que a mesma consulta com outros valores tenha a mesma chave."""
+    sql = _TEXTOS.sub('?', sql)
+    sql = _NUMEROS.sub('?', sql)
+    sql = _LISTA_PARAMETROS.sub('(?...)', sql)
+    return _ESPACOS.sub(' ', sql).strip()
+
+
+def _hash(impressao):
+    return hashlib.sha1(impressao.encode('utf-8')).hexdigest()[:12]
+
+
+class Acumulador:
+    """Totais por endpoint desde o arranque do processo."""
+
+    def __init__(self):
+        self._trava = threading.Lock()
+        self.pedidos = Counter()
+        self.consultas = Counter()
+        self.tempo_banco = Counter()
+        self.tempo_template = Counter()
+        self.tempo_total = Counter()
+        self.acima_orcamento = Counter()
+        # (endpoint, hash) -> pedidos em que a instrução se repetiu; hash -> instrução normalizada
+        self.repetidas = Counter()
+        self.instrucoes = {}
+        # Funções que devolvem linhas extra para o /_metrics (ex.: cache.py)
+        self.fontes = []
+
+    def registar(self, endpoint, consultas, tempo_banco, tempo_template, tempo_total, acima, repetidas):
+        with self._trava:
+            self.pedidos[endpoint] += 1
+            self.consultas[endpoint] += consultas
+            self.tempo_banco[endpoint] += tempo_banco
+            self.tempo_template[endpoint] += tempo_template
+            self.tempo_total[endpoint] += tempo_total
+            self.acima_orcamento[endpoint] += acima
+            for impressao in repetidas:
+                chave = _hash(impressao)
+                self.instrucoes[chave] = impressao
+                self.repetidas[(endpoint, chave)] += 1
+
+    def prometheus(self):
+        """Texto no formato de exposição do Prometheus."""
+        metricas = (
+            ('obras_pedidos_total', 'counter', 'Pedidos atendidos', self.pedidos),
+            ('obras_consultas_sql_total', 'counter', 'Consultas SQL executadas', self.consultas),
+            ('obras_tempo_banco_segundos_total', 'counter', 'Tempo gasto em consultas SQL', self.tempo_banco),
+            ('obras_tempo_template_segundos_total', 'counter', 'Tempo gasto a renderizar templates', self.tempo_template),
+            ('obras_tempo_pedido_segundos_total', 'counter', 'Tempo total dos pedidos', self.tempo_total),
+            ('obras_pedidos_acima_orcamento_total', 'counter', 'Pedidos acima do orçamento de consultas', self.acima_orcamento),
+        )
+        linhas = []
+        with self._trava:
+            for nome, tipo, ajuda, valores in metricas:
+                linhas.append(f'# HELP {nome} {ajuda}')
+                linhas.append(f'# TYPE {nome} {tipo}')
+                for endpoint, valor in sorted(valores.items()):
+                    linhas.append(f'{nome}{{endpoint="{_escapar(endpoint)}"}} {valor:g}')
+
+            nome = 'obras_consultas_repetidas_total'
+            linhas.append(f'# HELP {nome} Pedidos em que a mesma instrução SQL se repetiu (provável N+1)')
+            linhas.append(f'# TYPE {nome} counter')
+            for (endpoint, chave), valor in sorted(self.repetidas.items()):
+                linhas.append(
+                    f'{nome}{{endpoint="{_escapar(endpoint)}",impressao="{chave}",'
+                    f'sql="{_escapar(self.instrucoes[chave][:200])}"}} {valor}'
+                )
+        for fonte in self.fontes:
+            linhas.extend(fonte())
+        return '\n'.join(linhas) + '\n'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# --- Recolha durante o pedido ---
+
+def _ativo():
+    return has_request_context() and '_metricas' in g
+
+
+def _antes_da_consulta(conn, cursor, statement, parameters, context, executemany):
+    # O início fica no contexto da execução, e não na ligação: uma consulta que
+    # falha não deixa nada para trás que a próxima da mesma ligação leia
+    if _ativo() and context is not None:
+        context._metricas_inicio = time.perf_counter()
+
+
+def _depois_da_consulta(conn, cursor, statement, parameters, context, executemany):
+    if not _ativo():
+        return
+    inicio = getattr(context, '_metricas_inicio', None)
+    if inicio is None:
+        return
+    dados = g._metricas
+    dados['banco'] += time.perf_counter() - inicio
+    dados['consultas'] += 1
+    dados['impressoes'][impressao_digital(statement)] += 1
+
+
+def _antes_do_template(sender, template, context, **extra):
+    if _ativo():
+        g._metricas['templates_inicio'].append(time.perf_counter())
+
+
+def _depois_do_template(sender, template, context, **extra):
+    if _ativo() and g._metricas['templates_inicio']:
+        g._metricas['template'] += time.perf_counter() - g._metricas['templates_inicio'].pop()
+
+
+_eventos_ligados = False
+
+
+def init_app(app):
+    """Liga a instrumentação à aplicação e regista o endpoint /_metrics."""
+    global _eventos_ligados
+    app.config.setdefault('METRICAS_ATIVAS', True)
+    app.config.setdefault('METRICAS_ORCAMENTO_CONSULTAS', 30)
+    app.config.setdefault('METRICAS_LIMITE_REPETICOES', 5)
+    app.config.setdefault('METRICAS_TOKEN', None)
+    if not app.config['METRICAS_ATIVAS']:
+        return
+
+    acumulador = Acumulador()
+    app.extensions['metricas'] = acumulador
+
+    if not _eventos_ligados:
+        # Escuta todos os engines; só conta o que acontece dentro de um pedido instrumentado
+        event.listen(Engine, 'before_cursor_execute', _antes_da_consulta)
+        event.listen(Engine, 'after_cursor_execute', _depois_da_consulta)
+        _eventos_ligados = True
+    before_render_template.connect(_antes_do_template, app)
+    template_rendered.connect(_depois_do_template, app)
+
+    @app.before_request
+    def iniciar_medicao():
+        if request.endpoint == 'metricas':
+            return
+        g._metricas = {
+            'inicio': time.perf_counter(), 'consultas': 0, 'banco': 0.0, 'template': 0.0,
+            'templates_inicio': [], 'impressoes': Counter()
+        }
+
+    @app.after_request
+    def concluir_medicao(response):
+        dados = g.pop('_metricas', None)
+        if dados is None:
+            return response
+        total = time.perf_counter() - dados['inicio']
+        endpoint = request.endpoint or 'desconhecido'
+
+        orcamento = app.config['METRICAS_ORCAMENTO_CONSULTAS']
+        acima = dados['consultas'] > orcamento
+        if acima:
+            app.logger.warning(
+                f"{request.method} {request.path} ({endpoint}) fez {dados['consultas']} consultas "
+                f"(orçamento: {orcamento}, {dados['banco'] * 1000:.1f} ms no banco)"
+            )
+        limite = app.config['METRICAS_LIMITE_REPETICOES']
+        repetidas = [sql for sql, vezes in dados['impressoes'].items() if vezes >= limite]
+        for sql in repetidas:
+            app.logger.warning(
+                f"Provável N+1 em {endpoint}: instrução {_hash(sql)} executada "
+                f"{dados['impressoes'][sql]} vezes: {sql[:300]}"
+            )
+
+        acumulador.registar(endpoint, dados['consultas'], dados['banco'], dados['template'], total, acima, repetidas)
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={dados["banco"] * 1000:.1f};desc="{dados["consultas"]} consultas", '
+            f'tpl;dur={dados["template"] * 1000:.1f}, total;dur={total * 1000:.1f}'
+        )
+        return response
+
+    @app.route('/_metrics', endpoint='metricas')
+    def metricas():
+        token = app.config['METRICAS_TOKEN']
+        if not token:
+            abort(404)
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+        return Response(acumulador.prometheus(), mimetype='text/plain; version=0.0.4')
+
@@ -0,0 +1,312 @@
+"""Migrações de esquema da base de dados.
+
+Cada migração é uma função registada com @migracao(numero, descricao) e é
+aplicada uma única vez, pela ordem dos números; as versões já aplicadas ficam
+na tabela `schema_versao`. As migrações são escritas para serem idempotentes,
+pois o `init-db` de uma base nova também as executa depois do create_all().
+
+Migrações que mexem em dados financeiros pedem `reconstroi_resumos=True`; os
+resumos são então refeitos uma única vez, no fim, já com o esquema atualizado.
+As que recriam tabelas com chaves estrangeiras pedem `sem_chaves_estrangeiras=True`:
+em SQLite, as chaves ficam desligadas durante a migração (senão apagar a tabela
+antiga apagaria em cascata os dependentes) e são verificadas antes do commit.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+
+from models import db
+
+MIGRACOES = []
+
+
+def migracao(numero, descricao, reconstroi_resumos=False, sem_chaves_estrangeiras=False):
+    """Regista uma função como a migração `numero`."""
+    def registar(funcao):
+        funcao.reconstroi_resumos = reconstroi_resumos
+        funcao.sem_chaves_estrangeiras = sem_chaves_estrangeiras
+        MIGRACOES.append((numero, descricao, funcao))
+        MIGRACOES.sort(key=lambda m: m[0])
+        return funcao
+    return registar
+
+
+# --- Utilitários usados pelas migrações ---
+
+def _criar_tabela(modelo):
+    modelo.__table__.create(db.session.connection(), checkfirst=True)
+
+
+def _criar_indice(nome, tabela, colunas, unico=False):
+    unique = 'UNIQUE ' if unico else ''
+    db.session.execute(text(f'CREATE {unique}INDEX IF NOT EXISTS {nome} ON {tabela} ({", ".join(colunas)})'))
+
+
+def _colunas(tabela):
+    return {c['name'] for c in inspect(db.session.connection()).get_columns(tabela)}
+
+
+def _adicionar_coluna(tabela, nome, ddl):
+    if nome not in _colunas(tabela):
+        db.session.execute(text(f'ALTER TABLE {tabela} ADD COLUMN {nome} {ddl}'))
+
+
+def _recriar_tabela_sqlite(tabela):
+    """Recria `tabela` com a definição atual do modelo, mantendo os dados (o SQLite não altera restrições).
+
+    Segue o procedimento da documentação do SQLite: cria a tabela nova, copia as
+    linhas, apaga a antiga e renomeia; os índices do modelo são criados de novo.
+    Tem de correr com as chaves estrangeiras desligadas (sem_chaves_estrangeiras).
+    """
+    conexao = db.session.connection()
+    nova = f'{tabela.name}_nova'
+    ddl = str(CreateTable(tabela).compile(dialect=conexao.dialect)).strip()
+    conexao.execute(text(ddl.replace(f'CREATE TABLE {tabela.name} ', f'CREATE TABLE {nova} ', 1)))
+    existentes = _colunas(tabela.name)
+    colunas = ', '.join(c.name for c in tabela.columns if c.name in existentes)
+    conexao.execute(text(f'INSERT INTO {nova} ({colunas}) SELECT {colunas} FROM {tabela.name}'))
+    conexao.execute(text(f'DROP TABLE {tabela.name}'))
+    conexao.execute(text(f'ALTER TABLE {nova} RENAME TO {tabela.name}'))
+    for indice in tabela.indexes:
+        indice.create(conexao, checkfirst=True)
+
+
+def _sem_chaves_estrangeiras(conexao):
+    """Desliga as chaves estrangeiras da ligação SQLite da sessão; devolve a ligação do driver para as religar.
+
+    O PRAGMA não tem efeito dentro de uma transação, por isso tem de vir antes de
+    qualquer escrita da migração; depois do commit volta a ser ligado à mão, pois
+    a ligação regressa ao pool.
+    """
+    bruta = conexao.connection.dbapi_connection
+    bruta.execute('PRAGMA foreign_keys=OFF')
+    if bruta.execute('PRAGMA foreign_keys').fetchone()[0]:
+        raise RuntimeError('Não foi possível desligar as chaves estrangeiras: há uma transação aberta.')
+    return bruta
+
+
+def _verificar_chaves_estrangeiras(conexao):
+    violacoes = conexao.exec_driver_sql('PRAGMA foreign_key_check').all()
+    if violacoes:
+        tabelas = sorted({linha[0] for linha in violacoes})
+        raise RuntimeError(f'{len(violacoes)} linhas com chave estrangeira inválida em: {", ".join(tabelas)}.')
+
+
+# --- Controlo de versões ---
+
+def _garantir_tabela_versao():
+    db.session.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_versao ('
+        'versao INTEGER PRIMARY KEY, descricao VARCHAR(200) NOT NULL, aplicada_em TIMESTAMP NOT NULL)'
+    ))
+
+
+def versoes_aplicadas():
+    _garantir_tabela_versao()
+    return {linha[0] for linha in db.session.execute(text('SELECT versao FROM schema_versao'))}
+
+
+def pendentes():
+    aplicadas = versoes_aplicadas()
+    return [(numero, descricao) for numero, descricao, _ in MIGRACOES if numero not in aplicadas]
+
+
+def aplicar(ate=None):
+    """Aplica as migrações pendentes (até à versão `ate`, se indicada). Cada uma tem o seu commit."""
+    aplicadas = versoes_aplicadas()
+    executadas = []
+    reconstruir = False
+    for numero, descricao, funcao in MIGRACOES:
+        if numero in aplicadas or (ate is not None and numero > ate):
+            continue
+        conexao = db.session.connection()
+        bruta = None
+        if funcao.sem_chaves_estrangeiras and conexao.dialect.name == 'sqlite':
+            bruta = _sem_chaves_estrangeiras(conexao)
+        try:
+            funcao()
+            if bruta is not None:
+                _verificar_chaves_estrangeiras(conexao)
+            db.session.execute(
+                text('INSERT INTO schema_versao (versao, descricao, aplicada_em) VALUES (:v, :d, :a)'),
+                {'v': numero, 'd': descricao, 'a': datetime.utcnow()}
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            if bruta is not None:
+                bruta.execute('PRAGMA foreign_keys=ON')
+        executadas.append((numero, descricao))
+        reconstruir = reconstruir or funcao.reconstroi_resumos
+
+    if reconstruir:
+        import rollups
+        rollups.reconstruir_todos()
+        db.session.commit()
+    return executadas
+
+
+# --- Verificação de índices ---
+
+def indices_em_falta():
+    """Lista (tabela, índice) declarados nos modelos mas ausentes na base de dados."""
+    inspetor = inspect(db.session.connection())
+    em_falta = []
+    for tabela in db.metadata.sorted_tables:
+        if not inspetor.has_table(tabela.name):
+            em_falta.append((tabela.name, '(tabela inexistente)'))
+            continue
+        existentes = {i['name'] for i in inspetor.get_indexes(tabela.name)}
+        em_falta.extend((tabela.name, indice.name) for indice in tabela.indexes if indice.name not in existentes)
+    return em_falta
+
+
+def _consultas_da_aplicacao():
+    """As consultas agregadas usadas pelas páginas, com parâmetros de exemplo."""
+    from datetime import date
+    from sqlalchemy import select
+    from models import Secretaria, Obra, Medicao, OrcamentoMedicaoObra
+    import series
+
+    hoje = date.today()
+    return {
+        'Obra.total_gasto': select(Obra.total_gasto).where(Obra.id == 1),
+        'Secretaria.orcamento_gasto': select(Secretaria.orcamento_gasto).where(Secretaria.id == 1),
+        'Secretaria.orcamento_consolidado': select(Secretaria.orcamento_consolidado).where(Secretaria.id == 1),
+        'Medicao.total_gasto_no_periodo': select(Medicao.total_gasto_no_periodo).where(Medicao.id == 1),
+        'series.gastos_por_dia': series.consulta_gastos_por_dia([1], hoje, hoje).statement,
+        'OrcamentoMedicaoObra por (medicao, obra)': select(OrcamentoMedicaoObra).where(
+            OrcamentoMedicaoObra.medicao_id == 1, OrcamentoMedicaoObra.obra_id == 1
+        ),
+        'Obras de uma secretaria': select(Obra.id).where(Obra.secretaria_id == 1),
+    }
+
+
+def planos_sem_indice():
+    """Corre EXPLAIN QUERY PLAN (SQLite) nas consultas da aplicação.
+
+    Devolve {consulta: [passos]} apenas para as consultas com leitura completa de tabela,
+    ou None noutros dialetos: em PostgreSQL os planos (incluindo os da pesquisa por
+    tsvector) não são analisados.
+    """
+    conexao = db.session.connection()
+    if conexao.dialect.name != 'sqlite':
+        return None
+
+    problemas = {}
+    for nome, consulta in _consultas_da_aplicacao().items():
+        compilada = consulta.compile(dialect=conexao.dialect, compile_kwargs={'render_postcompile': True})
+        parametros = tuple(compilada.params[p] for p in compilada.positiontup)
+        plano = conexao.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compilada), parametros).all()
+        # "SCAN tabela" sem "USING ... INDEX" significa ler a tabela inteira
+        varrimentos = [linha[-1] for linha in plano if linha[-1].startswith('SCAN ') and 'INDEX' not in linha[-1]]
+        if varrimentos:
+            problemas[nome] = varrimentos
+    return problemas
+
+
+# ==============================================================================
+# MIGRAÇÕES
+# ==============================================================================
+
+@migracao(1, 'Tabelas de resumo financeiro (rollups)', reconstroi_resumos=True)
+def _m001_resumos():
+    from models import ResumoObra, ResumoMedicao, ResumoSecretaria
+
+    for modelo in (ResumoObra, ResumoMedicao, ResumoSecretaria):
+        _criar_tabela(modelo)
+
+
+# Os orçamentos duplicados removidos também saem dos resumos
+@migracao(2, 'Índices de Gasto, Obra, Medicao, Andamento e unicidade de medição/obra', reconstroi_resumos=True)
+def _m002_indices():
+    # Antes do índice único, remove duplicados de (medicao_id, obra_id), ficando com o mais recente
+    db.session.execute(text(
+        'DELETE FROM orcamento_medicao_obra WHERE id NOT IN ('
+        'SELECT MAX(id) FROM orcamento_medicao_obra GROUP BY medicao_id, obra_id)'
+    ))
+    _criar_indice('uq_orcamento_medicao_obra', 'orcamento_medicao_obra', ['medicao_id', 'obra_id'], unico=True)
+    _criar_indice('ix_orcamento_medicao_obra_obra_id', 'orcamento_medicao_obra', ['obra_id'])
+    _criar_indice('ix_gasto_obra_data_valor', 'gasto', ['obra_id', 'data', 'valor'])
+    _criar_indice('ix_obra_secretaria_id', 'obra', ['secretaria_id'])
+    _criar_indice('ix_medicao_secretaria_inicio', 'medicao', ['secretaria_id', 'data_inicio'])
+    _criar_indice('ix_andamento_obra_id', 'andamento', ['obra_id'])
+
+
+@migracao(3, 'Índice de pesquisa de texto das obras (FTS5 / tsvector)')
+def _m003_busca_obras():
+    import busca
+
+    busca.criar_indice(db.session.connection())
+
+
+@migracao(4, 'Índice (nome, id) de Obra para a paginação da lista de obras')
+def _m004_indice_nome_obra():
+    _criar_indice('ix_obra_nome_id', 'obra', ['nome', 'id'])
+
+
+@migracao(5, 'Versão dos dados da secretaria (ETag/Last-Modified das APIs)')
+def _m005_versao_secretaria():
+    _adicionar_coluna('secretaria', 'versao', "INTEGER NOT NULL DEFAULT 0")
+    _adicionar_coluna('secretaria', 'atualizado_em', 'TIMESTAMP')
+    db.session.execute(
+        text('UPDATE secretaria SET atualizado_em = :agora WHERE atualizado_em IS NULL'), {'agora': datetime.utcnow()}
+    )
+
+
+# Remover um orçamento órfão muda o total da medição
+@migracao(6, 'Chaves estrangeiras com ON DELETE CASCADE', reconstroi_resumos=True, sem_chaves_estrangeiras=True)
+def _m006_remocao_em_cascata():
+    import busca
+
+    conexao = db.session.connection()
+    inspetor = inspect(conexao)
+    for tabela in db.metadata.sorted_tables:
+        # As tabelas criadas por migrações posteriores já nascem com as chaves em cascata
+        if not tabela.foreign_keys or not inspetor.has_table(tabela.name):
+            continue
+        # Linhas órfãs (ex.: orçamentos de obras removidas antes das chaves serem aplicadas)
+        # não passariam na verificação das chaves novas
+        for chave in tabela.foreign_keys:
+            db.session.execute(text(
+                f'DELETE FROM {tabela.name} WHERE {chave.parent.name} NOT IN '
+                f'(SELECT {chave.column.name} FROM {chave.column.table.name})'
+            ))
+        existentes = inspetor.get_foreign_keys(tabela.name)
+        if existentes and all((fk['options'].get('ondelete') or '').upper() == 'CASCADE' for fk in existentes):
+            continue
+        if conexao.dialect.name == 'sqlite':
+            _recriar_tabela_sqlite(tabela)
+            # Apagar a tabela obra apaga também os triggers da pesquisa
+            if tabela.name == 'obra':
+                busca.criar_indice(conexao)
+        else:
+            for fk in existentes:
+                db.session.execute(text(f'ALTER TABLE {tabela.name} DROP CONSTRAINT {fk["name"]}'))
+            for chave in tabela.foreign_keys:
+                db.session.execute(text(
+                    f'ALTER TABLE {tabela.name} ADD FOREIGN KEY ({chave.parent.name}) '
+                    f'REFERENCES {chave.column.table.name} ({chave.column.name}) ON DELETE CASCADE'
+                ))
+
+
+@migracao(7, 'Arquivo de secretarias (remoção sem apagar os gastos)')
+def _m007_secretarias_arquivadas():
+    _adicionar_coluna('secretaria', 'arquivada_em', 'TIMESTAMP')
+
+
+@migracao(8, 'Fechamento de medições (totais gravados no fecho do período)')
+def _m008_fechamentos():
+    from models import FechamentoMedicao, FechamentoObra
+
+    for modelo in (FechamentoMedicao, FechamentoObra):
+        _criar_tabela(modelo)
+
+
+# Os resumos refeitos passam a somar, nas medições fechadas, o orçamento gravado no fecho
+@migracao(9, 'Consolidado das secretarias com o orçamento das medições fechadas', reconstroi_resumos=True)
+def _m009_consolidado_com_fechamentos():
+    pass
@@ -1,123 +1,289 @@
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from sqlalchemy.orm import joinedload
-
-db = SQLAlchemy()
-
-class Gasto(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    descricao = db.Column(db.String(200), nullable=False)
-    valor = db.Column(db.Float, nullable=False)
-    data = db.Column(db.Date, nullable=False, default=datetime.utcnow)
-    obra_id = db.Column(db.Integer, db.ForeignKey('obra.id'), nullable=False)
-
-class Andamento(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    status = db.Column(db.String(50), nullable=False, default='Não Iniciada')
-    data_inicio = db.Column(db.Date, nullable=True)
-    data_entrega = db.Column(db.Date, nullable=True)
-    ultima_atualizacao = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    obra_id = db.Column(db.Integer, db.ForeignKey('obra.id'), nullable=False)
-
-# --- ESTA É A NOVA CLASSE QUE ESTAVA A FALTAR ---
-class OrcamentoMedicaoObra(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    medicao_id = db.Column(db.Integer, db.ForeignKey('medicao.id'), nullable=False)
-    obra_id = db.Column(db.Integer, db.ForeignKey('obra.id'), nullable=False)
-    
-    os_inicial_secretaria = db.Column(db.Float, default=0.0)
-    os_qualitech = db.Column(db.Float, default=0.0)
-    
-    fonte_orcamento_selecionada = db.Column(db.String(20), default='inicial')
-
-    obra = db.relationship('Obra')
-
-    @property
-    def valor_efetivo(self):
-        if self.fonte_orcamento_selecionada == 'qualitech':
-            return self.os_qualitech
-        return self.os_inicial_secretaria
-
-class Obra(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(200), nullable=False)
-    objeto = db.Column(db.Text, nullable=True)
-    municipio = db.Column(db.String(100), nullable=True)
-    n_contrato = db.Column(db.String(50), nullable=True)
-    contrato_fonte = db.Column(db.String(100), nullable=True)
-    ordem_servico = db.Column(db.String(50), nullable=True)
-    periodo = db.Column(db.String(50), nullable=True)
-    endereco = db.Column(db.String(200), nullable=True)
-    secretaria_id = db.Column(db.Integer, db.ForeignKey('secretaria.id'), nullable=False)
-    andamento = db.relationship('Andamento', backref='obra', uselist=False, cascade="all, delete-orphan")
-    gastos = db.relationship('Gasto', backref='obra', order_by="desc(Gasto.data)", cascade="all, delete-orphan")
-
-    @property
-    def total_gasto(self):
-        return db.session.query(db.func.sum(Gasto.valor)).filter(Gasto.obra_id == self.id).scalar() or 0.0
-
-
-class Medicao(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(150), nullable=False)
-    data_inicio = db.Column(db.Date, nullable=False)
-    data_fim = db.Column(db.Date, nullable=False)
-    secretaria_id = db.Column(db.Integer, db.ForeignKey('secretaria.id'), nullable=False)
-    
-    # MODIFICADO AQUI: 'lazy="dynamic"' foi removido para ser compatível com o 'joinedload'
-    orcamentos_obras = db.relationship('OrcamentoMedicaoObra', backref='medicao', cascade="all, delete-orphan")
-
-    @property
-    def orcamento_total(self):
-        """Soma os orçamentos efetivos de todas as obras nesta medição."""
-        # A lógica agora itera sobre a lista diretamente
-        return sum(orcamento_obra.valor_efetivo for orcamento_obra in self.orcamentos_obras)
-
-    @property
-    def total_gasto_no_periodo(self):
-        """Soma os gastos de todas as obras da secretaria dentro do período."""
-        total = db.session.query(db.func.sum(Gasto.valor)).join(Obra).filter(
-            Obra.secretaria_id == self.secretaria_id,
-            Gasto.data >= self.data_inicio,
-            Gasto.data <= self.data_fim
-        ).scalar()
-        return total or 0.0
-
-    @property
-    def resultado(self):
-        """Calcula o resultado: Orçamento Total da Medição - Gastos no Período."""
-        return self.orcamento_total - self.total_gasto_no_periodo
-
-class Secretaria(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    nome = db.Column(db.String(100), nullable=False, unique=True)
-    obras = db.relationship('Obra', backref='secretaria', lazy=True, cascade="all, delete-orphan")
-    medicoes = db.relationship('Medicao', backref='secretaria', lazy=True, cascade="all, delete-orphan", order_by="desc(Medicao.data_inicio)")
-
-    @property
-    def orcamento_consolidado(self):
-        total = 0
-        for medicao in self.medicoes:
-            total += medicao.orcamento_total
-        return total
-
-    @property
-    def orcamento_gasto(self):
-        total = db.session.query(db.func.sum(Gasto.valor)).join(Obra).filter(Obra.secretaria_id == self.id).scalar()
-        return total or 0.0
-
-    @property
-    def orcamento_restante(self):
-        return self.orcamento_consolidado - self.orcamento_gasto
-
-    @property
-    def resultado_consolidado_percentual(self):
-        """Calcula o percentual de lucro ou prejuízo consolidado (geral)."""
-        # Evita divisão por zero se ainda não houver orçamento
-        if not self.orcamento_consolidado:
-            return 0.0
-        
-        # Fórmula: (Saldo Geral / Orçamento Total) * 100
-        resultado_geral = self.orcamento_restante
-        percentual = (resultado_geral / self.orcamento_consolidado) * 100
-        return percentual
+from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy import case, func, select
+
+db = SQLAlchemy()
+
+# As chaves estrangeiras têm ON DELETE CASCADE: remover uma secretaria ou obra é um
+# DELETE na base, que apaga os dependentes sem os carregar (passive_deletes=True nas
+# relações). Em SQLite isto depende do PRAGMA foreign_keys, que banco.py liga em
+# cada ligação dos engines da aplicação e do bot.
+
+class Gasto(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    descricao = db.Column(db.String(200), nullable=False)
+    valor = db.Column(db.Float, nullable=False)
+    data = db.Column(db.Date, nullable=False, default=datetime.utcnow)
+    obra_id = db.Column(db.Integer, db.ForeignKey('obra.id', ondelete='CASCADE'), nullable=False)
+
+    # Índice de cobertura para as somas por obra e por período
+    __table_args__ = (db.Index('ix_gasto_obra_data_valor', 'obra_id', 'data', 'valor'),)
+
+class Andamento(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(50), nullable=False, default='Não Iniciada')
+    data_inicio = db.Column(db.Date, nullable=True)
+    data_entrega = db.Column(db.Date, nullable=True)
+    ultima_atualizacao = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    obra_id = db.Column(db.Integer, db.ForeignKey('obra.id', ondelete='CASCADE'), nullable=False)
+
+    __table_args__ = (db.Index('ix_andamento_obra_id', 'obra_id'),)
+
+# --- ESTA É A NOVA CLASSE QUE ESTAVA A FALTAR ---
+class OrcamentoMedicaoObra(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    medicao_id = db.Column(db.Integer, db.ForeignKey('medicao.id', ondelete='CASCADE'), nullable=False)
+    obra_id = db.Column(db.Integer, db.ForeignKey('obra.id', ondelete='CASCADE'), nullable=False)
+    
+    os_inicial_secretaria = db.Column(db.Float, default=0.0)
+    os_qualitech = db.Column(db.Float, default=0.0)
+    
+    fonte_orcamento_selecionada = db.Column(db.String(20), default='inicial')
+
+    obra = db.relationship('Obra')
+
+    __table_args__ = (
+        db.Index('uq_orcamento_medicao_obra', 'medicao_id', 'obra_id', unique=True),
+        db.Index('ix_orcamento_medicao_obra_obra_id', 'obra_id'),
+    )
+
+    @hybrid_property
+    def valor_efetivo(self):
+        if self.fonte_orcamento_selecionada == 'qualitech':
+            return self.os_qualitech
+        return self.os_inicial_secretaria
+
+    @valor_efetivo.expression
+    def valor_efetivo(cls):
+        return case(
+            (cls.fonte_orcamento_selecionada == 'qualitech', func.coalesce(cls.os_qualitech, 0.0)),
+            else_=func.coalesce(cls.os_inicial_secretaria, 0.0)
+        )
+
+class Obra(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(200), nullable=False)
+    objeto = db.Column(db.Text, nullable=True)
+    municipio = db.Column(db.String(100), nullable=True)
+    n_contrato = db.Column(db.String(50), nullable=True)
+    contrato_fonte = db.Column(db.String(100), nullable=True)
+    ordem_servico = db.Column(db.String(50), nullable=True)
+    periodo = db.Column(db.String(50), nullable=True)
+    endereco = db.Column(db.String(200), nullable=True)
+    secretaria_id = db.Column(db.Integer, db.ForeignKey('secretaria.id', ondelete='CASCADE'), nullable=False)
+    andamento = db.relationship('Andamento', backref='obra', uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+    gastos = db.relationship('Gasto', backref='obra', order_by="desc(Gasto.data)", cascade="all, delete-orphan", passive_deletes=True)
+    resumo = db.relationship('ResumoObra', uselist=False, lazy='joined', cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        db.Index('ix_obra_secretaria_id', 'secretaria_id'),
+        # Chave da paginação da lista de obras (ordem por nome)
+        db.Index('ix_obra_nome_id', 'nome', 'id'),
+    )
+
+    @hybrid_property
+    def total_gasto(self):
+        # Lê do resumo mantido pelas rotas de escrita; só recalcula se ainda não existir
+        if self.resumo is not None:
+            return self.resumo.total_gasto
+        return db.session.query(db.func.sum(Gasto.valor)).filter(Gasto.obra_id == self.id).scalar() or 0.0
+
+    @total_gasto.expression
+    def total_gasto(cls):
+        return select(func.coalesce(func.sum(Gasto.valor), 0.0)).where(
+            Gasto.obra_id == cls.id
+        ).scalar_subquery()
+
+
+class Medicao(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(150), nullable=False)
+    data_inicio = db.Column(db.Date, nullable=False)
+    data_fim = db.Column(db.Date, nullable=False)
+    secretaria_id = db.Column(db.Integer, db.ForeignKey('secretaria.id', ondelete='CASCADE'), nullable=False)
+    
+    # MODIFICADO AQUI: 'lazy="dynamic"' foi removido para ser compatível com o 'joinedload'
+    orcamentos_obras = db.relationship('OrcamentoMedicaoObra', backref='medicao', cascade="all, delete-orphan", passive_deletes=True)
+    resumo = db.relationship('ResumoMedicao', uselist=False, lazy='joined', cascade="all, delete-orphan", passive_deletes=True)
+    # Preenchido quando a medição é fechada (fechamentos.py): os totais passam a vir daqui
+    fechamento = db.relationship('FechamentoMedicao', backref='medicao', uselist=False, lazy='joined', cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (db.Index('ix_medicao_secretaria_inicio', 'secretaria_id', 'data_inicio'),)
+
+    @property
+    def fechada(self):
+        return self.fechamento is not None
+
+    @hybrid_property
+    def orcamento_total(self):
+        """Soma os orçamentos efetivos de todas as obras nesta medição."""
+        if self.fechamento is not None:
+            return self.fechamento.orcamento_total
+        return self.orcamento_calculado
+
+    @property
+    def orcamento_calculado(self):
+        """Orçamento atual das obras, mesmo numa medição fechada (não usa o fechamento)."""
+        if self.resumo is not None:
+            return self.resumo.orcamento_total
+        # A lógica agora itera sobre a lista diretamente
+        return sum(orcamento_obra.valor_efetivo for orcamento_obra in self.orcamentos_obras)
+
+    # Nas expressões, o fechamento (se houver) também tem prioridade sobre o cálculo
+    @orcamento_total.expression
+    def orcamento_total(cls):
+        return func.coalesce(
+            select(FechamentoMedicao.orcamento_total).where(FechamentoMedicao.medicao_id == cls.id)
+                .correlate_except(FechamentoMedicao).scalar_subquery(),
+            select(func.coalesce(func.sum(OrcamentoMedicaoObra.valor_efetivo), 0.0)).where(
+                OrcamentoMedicaoObra.medicao_id == cls.id
+            ).scalar_subquery()
+        )
+
+    @hybrid_property
+    def total_gasto_no_periodo(self):
+        """Soma os gastos de todas as obras da secretaria dentro do período."""
+        if self.fechamento is not None:
+            return self.fechamento.total_gasto
+        total = db.session.query(db.func.sum(Gasto.valor)).join(Obra).filter(
+            Obra.secretaria_id == self.secretaria_id,
+            Gasto.data >= self.data_inicio,
+            Gasto.data <= self.data_fim
+        ).scalar()
+        return total or 0.0
+
+    @total_gasto_no_periodo.expression
+    def total_gasto_no_periodo(cls):
+        return func.coalesce(
+            select(FechamentoMedicao.total_gasto).where(FechamentoMedicao.medicao_id == cls.id)
+                .correlate_except(FechamentoMedicao).scalar_subquery(),
+            select(func.coalesce(func.sum(Gasto.valor), 0.0)).join(Obra, Gasto.obra_id == Obra.id).where(
+                Obra.secretaria_id == cls.secretaria_id,
+                Gasto.data >= cls.data_inicio,
+                Gasto.data <= cls.data_fim
+            ).scalar_subquery()
+        )
+
+    @hybrid_property
+    def resultado(self):
+        """Calcula o resultado: Orçamento Total da Medição - Gastos no Período."""
+        return self.orcamento_total - self.total_gasto_no_periodo
+
+class Secretaria(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    nome = db.Column(db.String(100), nullable=False, unique=True)
+    obras = db.relationship('Obra', backref='secretaria', lazy=True, cascade="all, delete-orphan", passive_deletes=True)
+    medicoes = db.relationship('Medicao', backref='secretaria', lazy=True, cascade="all, delete-orphan", passive_deletes=True, order_by="desc(Medicao.data_inicio)")
+    resumo = db.relationship('ResumoSecretaria', uselist=False, lazy='joined', cascade="all, delete-orphan", passive_deletes=True)
+    # Versão dos dados mostrados (totais, medições, nome): sobe no commit de cada escrita
+    # que altera a secretaria (ver rollups.marcar_alterada) e serve de ETag às APIs
+    versao = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    atualizado_em = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
+    # Preenchida quando a secretaria é arquivada em vez de apagada (ARQUIVAR_SECRETARIAS):
+    # deixa de aparecer na aplicação, mas as obras e os gastos ficam na base
+    arquivada_em = db.Column(db.DateTime, nullable=True)
+
+    @hybrid_property
+    def ativa(self):
+        return self.arquivada_em is None
+
+    @ativa.expression
+    def ativa(cls):
+        return cls.arquivada_em.is_(None)
+
+    # O consolidado é a soma de Medicao.orcamento_total: nas medições fechadas conta o
+    # orçamento gravado no fecho, e uma edição tardia só entra depois de recalculada.
+    # Já o gasto é o de todos os gastos atuais, pois não se reparte pelas medições
+    # (há dias em duas medições ou em nenhuma): um gasto tardio entra logo nele.
+    @hybrid_property
+    def orcamento_consolidado(self):
+        if self.resumo is not None:
+            return self.resumo.orcamento_consolidado
+        total = 0
+        for medicao in self.medicoes:
+            total += medicao.orcamento_total
+        return total
+
+    @orcamento_consolidado.expression
+    def orcamento_consolidado(cls):
+        return select(func.coalesce(func.sum(Medicao.orcamento_total), 0.0)).where(
+            Medicao.secretaria_id == cls.id
+        ).scalar_subquery()
+
+    @hybrid_property
+    def orcamento_gasto(self):
+        if self.resumo is not None:
+            return self.resumo.total_gasto
+        total = db.session.query(db.func.sum(Gasto.valor)).join(Obra).filter(Obra.secretaria_id == self.id).scalar()
+        return total or 0.0
+
+    @orcamento_gasto.expression
+    def orcamento_gasto(cls):
+        return select(func.coalesce(func.sum(Gasto.valor), 0.0)).join(Obra, Gasto.obra_id == Obra.id).where(
+            Obra.secretaria_id == cls.id
+        ).scalar_subquery()
+
+    @hybrid_property
+    def orcamento_restante(self):
+        return self.orcamento_consolidado - self.orcamento_gasto
+
+    @property
+    def resultado_consolidado_percentual(self):
+        """Calcula o percentual de lucro ou prejuízo consolidado (geral)."""
+        # Evita divisão por zero se ainda não houver orçamento
+        if not self.orcamento_consolidado:
+            return 0.0
+        
+        # Fórmula: (Saldo Geral / Orçamento Total) * 100
+        resultado_geral = self.orcamento_restante
+        percentual = (resultado_geral / self.orcamento_consolidado) * 100
+        return percentual
+
+
+# --- Tabelas de resumo (rollups) ---
+# Guardam os totais já somados para que as páginas não precisem de refazer
+# um SUM(Gasto.valor) a cada acesso. São mantidas pelas funções de rollups.py
+# na mesma transação das escritas, e podem ser refeitas com `flask rebuild-rollups`.
+
+class ResumoObra(db.Model):
+    obra_id = db.Column(db.Integer, db.ForeignKey('obra.id', ondelete='CASCADE'), primary_key=True)
+    total_gasto = db.Column(db.Float, nullable=False, default=0.0)
+    qtd_gastos = db.Column(db.Integer, nullable=False, default=0)
+
+class ResumoMedicao(db.Model):
+    medicao_id = db.Column(db.Integer, db.ForeignKey('medicao.id', ondelete='CASCADE'), primary_key=True)
+    orcamento_total = db.Column(db.Float, nullable=False, default=0.0)
+
+class ResumoSecretaria(db.Model):
+    secretaria_id = db.Column(db.Integer, db.ForeignKey('secretaria.id', ondelete='CASCADE'), primary_key=True)
+    total_gasto = db.Column(db.Float, nullable=False, default=0.0)
+    orcamento_consolidado = db.Column(db.Float, nullable=False, default=0.0)
+
+
+# --- Fechamentos de medição ---
+# Os totais de uma medição fechada, gravados no momento do fecho por fechamentos.py.
+# Ao contrário dos resumos, não acompanham as escritas: uma edição posterior no
+# período só preenche `alterado_em`, até o fechamento ser recalculado ou reaberto.
+
+class FechamentoMedicao(db.Model):
+    medicao_id = db.Column(db.Integer, db.ForeignKey('medicao.id', ondelete='CASCADE'), primary_key=True)
+    fechado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # O período no momento do fecho (as datas da medição ainda podem ser editadas)
+    data_inicio = db.Column(db.Date, nullable=False)
+    data_fim = db.Column(db.Date, nullable=False)
+    orcamento_total = db.Column(db.Float, nullable=False, default=0.0)
+    total_gasto = db.Column(db.Float, nullable=False, default=0.0)
+    resultado = db.Column(db.Float, nullable=False, default=0.0)
+    qtd_gastos = db.Column(db.Integer, nullable=False, default=0)
+    alterado_em = db.Column(db.DateTime, nullable=True)
+    obras = db.relationship('FechamentoObra', order_by='FechamentoObra.obra_nome', cascade="all, delete-orphan", passive_deletes=True)
+
+class FechamentoObra(db.Model):
+    medicao_id = db.Column(db.Integer, db.ForeignKey('fechamento_medicao.medicao_id', ondelete='CASCADE'), primary_key=True)
+    # Sem chave estrangeira para a obra: o fechamento guarda-a mesmo que ela seja removida depois
+    obra_id = db.Column(db.Integer, primary_key=True)
+    obra_nome = db.Column(db.String(200), nullable=False)
+    fonte_orcamento = db.Column(db.String(20), nullable=False)
+    valor_efetivo = db.Column(db.Float, nullable=False, default=0.0)
@@ -0,0 +1,80 @@
+"""Paginação por chave (keyset) para listagens grandes.
+
+Em vez de OFFSET, que obriga a base a ler e descartar todas as linhas das
+páginas anteriores, cada página pede as linhas a seguir à última mostrada:
+`WHERE (nome, id) > (:nome, :id) ORDER BY nome, id LIMIT n`. O custo de uma
+página não depende de quão longe se está na lista e, com um índice na chave,
+é uma leitura de intervalo.
+
+A posição vai para o URL como um cursor opaco (`?after=`), com os valores da
+chave da última linha da página anterior (datas em ISO 8601).
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+
+from sqlalchemy import tuple_
+
+
+def _serializar(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    raise TypeError(f'Valor de chave não serializável: {valor!r}')
+
+
+def _converter(expressao, valor):
+    """Os valores do cursor vêm de JSON; as datas voltam a ser date/datetime para os parâmetros."""
+    try:
+        tipo = expressao.type.python_type
+    except NotImplementedError:
+        return valor
+    if tipo in (date, datetime) and isinstance(valor, str):
+        try:
+            return tipo.fromisoformat(valor)
+        except ValueError as e:
+            raise ValueError('Cursor de paginação inválido.') from e
+    return valor
+
+
+def codificar_cursor(valores):
+    texto = json.dumps(list(valores), separators=(',', ':'), ensure_ascii=False, default=_serializar)
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor, tamanho):
+    """Valores da chave guardados no cursor. ValueError se o cursor for inválido."""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        valores = json.loads(texto)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError('Cursor de paginação inválido.') from e
+    if not isinstance(valores, list) or len(valores) != tamanho:
+        raise ValueError('Cursor de paginação inválido.')
+    return valores
+
+
+def paginar(consulta, chave, cursor=None, por_pagina=50, descendente=False):
+    """Aplica a paginação por chave a uma Query do ORM.
+
+    `chave` são as expressões de ordenação, a última das quais tem de ser única
+    (normalmente o id), todas no mesmo sentido. As expressões são acrescentadas
+    às colunas da consulta como `chave_0`, `chave_1`, ...
+
+    Devolve (linhas, cursor_seguinte); cursor_seguinte é None na última página.
+    """
+    expressoes = list(chave)
+    consulta = consulta.add_columns(*(expressao.label(f'chave_{i}') for i, expressao in enumerate(expressoes)))
+    if cursor:
+        valores = [_converter(e, v) for e, v in zip(expressoes, decodificar_cursor(cursor, len(expressoes)))]
+        linha, anterior = tuple_(*expressoes), tuple_(*valores)
+        consulta = consulta.filter(linha < anterior if descendente else linha > anterior)
+
+    ordem = [expressao.desc() if descendente else expressao.asc() for expressao in expressoes]
+    # Uma linha a mais diz se há página seguinte, sem um COUNT
+    linhas = consulta.order_by(*ordem).limit(por_pagina + 1).all()
+    if len(linhas) <= por_pagina:
+        return linhas, None
+    linhas = linhas[:por_pagina]
+    ultima = linhas[-1]
+    return linhas, codificar_cursor(getattr(ultima, f'chave_{i}') for i in range(len(expressoes)))
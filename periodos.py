@@ -0,0 +1,90 @@
+"""Atribuição dos gastos diários aos períodos das medições de uma secretaria.
+
+As medições de uma secretaria podem sobrepor-se ou deixar dias sem cobertura.
+Em vez de uma soma por medição (o `Medicao.total_gasto_no_periodo`, uma consulta
+por linha), os totais diários da secretaria são lidos uma vez, ordenados por
+data e acumulados em somas de prefixo; o gasto de qualquer período é então a
+diferença de dois acumulados, encontrados por pesquisa binária.
+
+As medições são percorridas uma vez por ordem de início (varrimento): um heap
+com as que ainda estão abertas dá as sobreposições com a medição que começa, e
+o fim mais tardio visto até ali dá os dias sem nenhuma medição (lacunas). Um
+dia numa sobreposição conta para todas as medições que o cobrem; as lacunas
+mostram o gasto que não entra em nenhuma.
+"""
+import heapq
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import timedelta
+from itertools import accumulate
+
+# `primeira` começou antes (ou no mesmo dia) que `segunda`; as datas são inclusivas
+Sobreposicao = namedtuple('Sobreposicao', 'primeira segunda inicio fim gasto')
+Lacuna = namedtuple('Lacuna', 'inicio fim gasto')
+
+_UM_DIA = timedelta(days=1)
+
+
+class SomasPorData:
+    """Somas de prefixo sobre totais diários: o gasto de [inicio, fim] em O(log n)."""
+
+    def __init__(self, gastos_diarios):
+        self.datas = sorted(gastos_diarios)
+        self.acumulados = [0.0, *accumulate(gastos_diarios[d] for d in self.datas)]
+
+    def total(self, inicio, fim):
+        """Soma dos dias entre `inicio` e `fim`, inclusive (0 se fim < inicio)."""
+        if fim < inicio:
+            return 0.0
+        return self.acumulados[bisect_right(self.datas, fim)] - self.acumulados[bisect_left(self.datas, inicio)]
+
+
+class AtribuicaoPeriodos:
+    """Resultado de `atribuir`: gasto por medição, sobreposições e lacunas."""
+
+    def __init__(self, medicoes, gastos, sobreposicoes, lacunas):
+        self.medicoes = medicoes  # por ordem de início
+        self.gastos = gastos  # medicao_id -> gasto no período
+        self.sobreposicoes = sobreposicoes
+        self.lacunas = lacunas
+
+    def resultado(self, medicao):
+        """Orçamento da medição menos o gasto atribuído ao seu período."""
+        return medicao.orcamento_total - self.gastos[medicao.id]
+
+    def sobrepostas(self):
+        """Ids das medições que partilham dias com outra."""
+        return {m.id for s in self.sobreposicoes for m in (s.primeira, s.segunda)}
+
+
+def atribuir(medicoes, gastos_diarios):
+    """Reparte `gastos_diarios` ({data: total}) pelas `medicoes` de uma secretaria.
+
+    As medições só precisam de `id`, `data_inicio`, `data_fim` e `orcamento_total`
+    (modelos ou as linhas de series.medicoes_por_secretaria). Os dias de
+    `gastos_diarios` fora de todas as medições só aparecem nas lacunas entre elas.
+    """
+    somas = SomasPorData(gastos_diarios)
+    ordenadas = sorted(medicoes, key=lambda m: (m.data_inicio, m.data_fim, m.id))
+    gastos = {m.id: somas.total(m.data_inicio, m.data_fim) for m in ordenadas}
+
+    sobreposicoes, lacunas = [], []
+    abertas = []  # heap de (data_fim, posição em `ordenadas`)
+    cobertura_fim = None  # último dia coberto por alguma medição já vista
+    for posicao, medicao in enumerate(ordenadas):
+        while abertas and abertas[0][0] < medicao.data_inicio:
+            heapq.heappop(abertas)
+        for fim_aberta, outra in sorted(abertas, key=lambda a: a[1]):
+            fim = min(fim_aberta, medicao.data_fim)
+            sobreposicoes.append(Sobreposicao(
+                ordenadas[outra], medicao, medicao.data_inicio, fim, somas.total(medicao.data_inicio, fim)
+            ))
+        if cobertura_fim is not None and medicao.data_inicio > cobertura_fim + _UM_DIA:
+            inicio = cobertura_fim + _UM_DIA
+            fim = medicao.data_inicio - _UM_DIA
+            lacunas.append(Lacuna(inicio, fim, somas.total(inicio, fim)))
+        if cobertura_fim is None or medicao.data_fim > cobertura_fim:
+            cobertura_fim = medicao.data_fim
+        heapq.heappush(abertas, (medicao.data_fim, posicao))
+
+    return AtribuicaoPeriodos(ordenadas, gastos, sobreposicoes, lacunas)
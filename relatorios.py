@@ -0,0 +1,97 @@
+"""Geração do relatório Excel (Resumo, Extrato de Obras, Gastos e Medições).
+
+O livro é escrito com o modo write-only do openpyxl, que despeja cada linha
+para disco à medida que é acrescentada, e as linhas vêm de consultas lidas em
+blocos (`yield_per`), por isso a memória usada não cresce com o número de gastos.
+"""
+from models import (db, Secretaria, Obra, Andamento, Gasto, Medicao,
+                    ResumoObra, ResumoMedicao, FechamentoMedicao)
+import rollups
+
+LINHAS_POR_BLOCO = 1000
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def _em_blocos(query):
+    """Lê a consulta com cursor do lado do servidor, LINHAS_POR_BLOCO de cada vez."""
+    return query.execution_options(stream_results=True).yield_per(LINHAS_POR_BLOCO)
+
+
+def _escrever(sheet, linhas, etapa, progresso):
+    total = 0
+    for linha in linhas:
+        sheet.append(list(linha))
+        total += 1
+        if progresso and total % LINHAS_POR_BLOCO == 0:
+            progresso(etapa, total)
+    if progresso:
+        progresso(etapa, total)
+
+
+def gerar_excel(destino, progresso=None):
+    """Escreve o relatório completo em `destino` (caminho ou ficheiro binário).
+
+    `progresso(etapa, linhas)` é chamado a cada bloco de linhas escrito.
+    """
+    # Importado aqui: o openpyxl só é carregado por quem gera relatórios
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+
+    # Aba Resumo
+    sheet_resumo = workbook.create_sheet(title="Resumo")
+    sheet_resumo.append(['Secretaria', 'Orçamento Consolidado', 'Orçamento Gasto', 'Orçamento Restante'])
+    _escrever(sheet_resumo, (
+        (sec.nome, sec.orcamento_consolidado, sec.orcamento_gasto, sec.orcamento_restante)
+        for sec in rollups.totais_secretarias()
+    ), 'Resumo', progresso)
+
+    # Aba Extrato
+    sheet_extrato = workbook.create_sheet(title="Extrato de Obras")
+    sheet_extrato.append(['ID Obra', 'Nome da Obra', 'Secretaria', 'Nº do Contrato', 'Total Gasto',
+                          'Status', 'Data de Início', 'Data de Entrega'])
+    _escrever(sheet_extrato, _em_blocos(
+        db.session.query(
+            Obra.id, Obra.nome, Secretaria.nome, Obra.n_contrato,
+            db.func.coalesce(ResumoObra.total_gasto, Obra.total_gasto),
+            Andamento.status, Andamento.data_inicio, Andamento.data_entrega
+        ).join(Secretaria, Obra.secretaria_id == Secretaria.id)
+        .outerjoin(ResumoObra, ResumoObra.obra_id == Obra.id)
+        .outerjoin(Andamento, Andamento.obra_id == Obra.id)
+        .filter(Secretaria.ativa)
+        .order_by(Obra.id)
+    ), 'Extrato de Obras', progresso)
+
+    # Aba Gastos
+    sheet_gastos = workbook.create_sheet(title="Gastos")
+    sheet_gastos.append(['ID Gasto', 'Data', 'Descrição', 'Valor', 'ID Obra', 'Obra', 'Secretaria'])
+    _escrever(sheet_gastos, _em_blocos(
+        db.session.query(
+            Gasto.id, Gasto.data, Gasto.descricao, Gasto.valor, Obra.id, Obra.nome, Secretaria.nome
+        ).join(Obra, Gasto.obra_id == Obra.id)
+        .join(Secretaria, Obra.secretaria_id == Secretaria.id)
+        .filter(Secretaria.ativa)
+        .order_by(Gasto.data, Gasto.id)
+    ), 'Gastos', progresso)
+
+    # Aba Medições
+    sheet_medicoes = workbook.create_sheet(title="Medições")
+    sheet_medicoes.append(['Secretaria', 'Medição', 'Data de Início', 'Data de Fim',
+                           'Orçamento Total', 'Gasto no Período', 'Resultado', 'Fechada em'])
+    # As medições fechadas usam os totais gravados no fecho (ver fechamentos.py)
+    orcamento_total = db.func.coalesce(
+        FechamentoMedicao.orcamento_total, ResumoMedicao.orcamento_total, Medicao.orcamento_total
+    )
+    total_gasto = db.func.coalesce(FechamentoMedicao.total_gasto, Medicao.total_gasto_no_periodo)
+    _escrever(sheet_medicoes, _em_blocos(
+        db.session.query(
+            Secretaria.nome, Medicao.nome, Medicao.data_inicio, Medicao.data_fim,
+            orcamento_total, total_gasto, orcamento_total - total_gasto, FechamentoMedicao.fechado_em
+        ).join(Secretaria, Medicao.secretaria_id == Secretaria.id)
+        .outerjoin(ResumoMedicao, ResumoMedicao.medicao_id == Medicao.id)
+        .outerjoin(FechamentoMedicao, FechamentoMedicao.medicao_id == Medicao.id)
+        .filter(Secretaria.ativa)
+        .order_by(Secretaria.nome, Medicao.data_inicio)
+    ), 'Medições', progresso)
+
+    workbook.save(destino)
@@ -0,0 +1,304 @@
+"""Manutenção das tabelas de resumo financeiro (ResumoObra, ResumoMedicao, ResumoSecretaria).
+
+As rotas de escrita chamam estas funções antes do commit, de modo que o resumo
+é atualizado na mesma transação que o gasto ou orçamento que o originou.
+
+Funções registadas com @ao_alterar_secretaria são avisadas depois do commit
+de cada transação que alterou os totais de uma ou mais secretarias; antes
+desse commit, a `versao` das secretarias alteradas sobe na mesma transação.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import event, func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from models import (db, Secretaria, Gasto, Obra, Medicao, OrcamentoMedicaoObra,
+                    ResumoObra, ResumoMedicao, ResumoSecretaria, FechamentoMedicao)
+
+logger = logging.getLogger(__name__)
+
+OUVINTES = []
+
+
+def ao_alterar_secretaria(funcao):
+    """Regista `funcao(secretaria_ids)`; `secretaria_ids` é um set, ou None quando mudaram todas."""
+    OUVINTES.append(funcao)
+    return funcao
+
+
+def marcar_alterada(secretaria_id):
+    """Regista que os dados da secretaria mudaram nesta transação (None = todas).
+
+    As funções de resumo abaixo já o fazem; as rotas chamam-na diretamente para
+    escritas que não mexem nos totais mas mudam o que as APIs mostram (nome,
+    datas de uma medição).
+    """
+    db.session.info.setdefault('secretarias_alteradas', set()).add(secretaria_id)
+
+
+@event.listens_for(Session, 'before_commit')
+def _subir_versoes(session):
+    alteradas = session.info.get('secretarias_alteradas')
+    if not alteradas:
+        return
+    consulta = update(Secretaria).values(versao=Secretaria.versao + 1, atualizado_em=datetime.utcnow())
+    if None not in alteradas:
+        consulta = consulta.where(Secretaria.id.in_(alteradas))
+    session.execute(consulta, execution_options={'synchronize_session': False})
+
+
+@event.listens_for(Session, 'after_commit')
+def _avisar_ouvintes(session):
+    alteradas = session.info.pop('secretarias_alteradas', None)
+    if not alteradas:
+        return
+    ids = None if None in alteradas else alteradas
+    for funcao in OUVINTES:
+        try:
+            funcao(ids)
+        except Exception as e:
+            # Um ouvinte com problemas não deve afetar uma gravação que já foi feita
+            logger.error(f"Erro ao avisar alteração de secretarias: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_alteracoes(session):
+    session.info.pop('secretarias_alteradas', None)
+
+
+# --- Somas feitas diretamente nas tabelas de origem ---
+
+def _somar_gastos_obra(obra_id):
+    total, qtd = db.session.query(
+        func.coalesce(func.sum(Gasto.valor), 0.0), func.count(Gasto.id)
+    ).filter(Gasto.obra_id == obra_id).one()
+    return total, qtd
+
+
+def _somar_gastos_secretaria(secretaria_id):
+    return db.session.query(func.coalesce(func.sum(Gasto.valor), 0.0)).join(Obra).filter(
+        Obra.secretaria_id == secretaria_id
+    ).scalar()
+
+
+def _somar_orcamento_medicao(medicao_id):
+    return db.session.query(func.coalesce(func.sum(OrcamentoMedicaoObra.valor_efetivo), 0.0)).filter(
+        OrcamentoMedicaoObra.medicao_id == medicao_id
+    ).scalar()
+
+
+def _somar_orcamento_secretaria(secretaria_id):
+    # Medicao.orcamento_total já usa o orçamento gravado nas medições fechadas
+    return db.session.query(func.coalesce(func.sum(Medicao.orcamento_total), 0.0)).filter(
+        Medicao.secretaria_id == secretaria_id
+    ).scalar()
+
+
+# --- Obtenção (ou criação) das linhas de resumo ---
+
+def _criar_resumo(modelo, **valores):
+    """Insere a linha de resumo com INSERT ... ON CONFLICT DO NOTHING e devolve (resumo, criado).
+
+    Dois workers podem criar o mesmo resumo ao mesmo tempo: o que perde não falha
+    com a chave duplicada, fica com a linha do outro (criado=False) e aplica-lhe a
+    sua variação, como se ela já existisse.
+    """
+    dialeto = postgresql if db.session.connection().dialect.name == 'postgresql' else sqlite
+    resultado = db.session.execute(dialeto.insert(modelo).values(**valores).on_conflict_do_nothing())
+    chave = valores[modelo.__mapper__.primary_key[0].key]
+    return db.session.get(modelo, chave), resultado.rowcount == 1
+
+
+def _resumo_obra(obra_id):
+    """Devolve (resumo, criado). Um resumo novo já nasce com os valores atuais."""
+    resumo = db.session.get(ResumoObra, obra_id)
+    if resumo is not None:
+        return resumo, False
+    total, qtd = _somar_gastos_obra(obra_id)
+    return _criar_resumo(ResumoObra, obra_id=obra_id, total_gasto=total, qtd_gastos=qtd)
+
+
+def _resumo_secretaria(secretaria_id):
+    resumo = db.session.get(ResumoSecretaria, secretaria_id)
+    if resumo is not None:
+        return resumo, False
+    return _criar_resumo(
+        ResumoSecretaria,
+        secretaria_id=secretaria_id,
+        total_gasto=_somar_gastos_secretaria(secretaria_id),
+        orcamento_consolidado=_somar_orcamento_secretaria(secretaria_id)
+    )
+
+
+# --- API usada pelas rotas ---
+
+def registrar_gasto(obra_id, secretaria_id, valor, qtd=1):
+    """Aplica a variação de um gasto incluído (valor positivo) ou removido (valor e qtd negativos).
+
+    Deve ser chamada depois de o gasto ter sido adicionado/removido da sessão.
+    """
+    db.session.flush()
+    marcar_alterada(secretaria_id)
+
+    resumo_obra, criado = _resumo_obra(obra_id)
+    if not criado:
+        # Expressões SQL geram "SET total = total + ?", seguro com vários workers
+        resumo_obra.total_gasto = ResumoObra.total_gasto + valor
+        resumo_obra.qtd_gastos = ResumoObra.qtd_gastos + qtd
+
+    resumo_sec, criado = _resumo_secretaria(secretaria_id)
+    if not criado:
+        resumo_sec.total_gasto = ResumoSecretaria.total_gasto + valor
+
+
+def recalcular_medicao(medicao_id, secretaria_id):
+    """Refaz o orçamento total de uma medição e propaga a diferença para a secretaria.
+
+    Numa medição fechada, o consolidado da secretaria fica com o orçamento gravado no
+    fecho; a diferença só entra quando o fechamento é recalculado ou reaberto.
+    """
+    db.session.flush()
+    marcar_alterada(secretaria_id)
+
+    novo_total = _somar_orcamento_medicao(medicao_id)
+    resumo = db.session.get(ResumoMedicao, medicao_id)
+    if resumo is None:
+        resumo, _ = _criar_resumo(ResumoMedicao, medicao_id=medicao_id, orcamento_total=0.0)
+    diferenca = novo_total - (resumo.orcamento_total or 0.0)
+    resumo.orcamento_total = novo_total
+
+    if db.session.get(FechamentoMedicao, medicao_id) is None:
+        trocar_orcamento_medicao(secretaria_id, diferenca)
+
+
+def trocar_orcamento_medicao(secretaria_id, diferenca):
+    """Soma ao consolidado da secretaria a mudança no orçamento que conta para uma medição.
+
+    Usada por recalcular_medicao e por fechamentos.py, quando o orçamento gravado no
+    fecho passa a contar (ou deixa de contar) no lugar do calculado.
+    """
+    resumo_sec, criado = _resumo_secretaria(secretaria_id)
+    if not criado and diferenca:
+        resumo_sec.orcamento_consolidado = ResumoSecretaria.orcamento_consolidado + diferenca
+
+
+def recalcular_secretaria(secretaria_id):
+    """Refaz todos os resumos de uma secretaria. Usado após remoções em cascata."""
+    db.session.flush()
+    marcar_alterada(secretaria_id)
+
+    totais_medicoes = dict(
+        db.session.query(Medicao.id, func.coalesce(func.sum(OrcamentoMedicaoObra.valor_efetivo), 0.0))
+        .outerjoin(OrcamentoMedicaoObra, OrcamentoMedicaoObra.medicao_id == Medicao.id)
+        .filter(Medicao.secretaria_id == secretaria_id)
+        .group_by(Medicao.id)
+        .all()
+    )
+    # Os resumos existentes vêm todos numa consulta, e não um a um
+    resumos = {
+        resumo.medicao_id: resumo
+        for resumo in ResumoMedicao.query.filter(ResumoMedicao.medicao_id.in_(totais_medicoes.keys()))
+    }
+    for medicao_id, total in totais_medicoes.items():
+        resumo = resumos.get(medicao_id)
+        if resumo is None:
+            resumo, _ = _criar_resumo(ResumoMedicao, medicao_id=medicao_id, orcamento_total=total)
+        resumo.orcamento_total = total
+
+    # Nas medições fechadas conta o orçamento gravado no fecho
+    fechados = dict(
+        db.session.query(FechamentoMedicao.medicao_id, FechamentoMedicao.orcamento_total)
+        .filter(FechamentoMedicao.medicao_id.in_(totais_medicoes.keys()))
+        .all()
+    )
+    resumo_sec, _ = _resumo_secretaria(secretaria_id)
+    resumo_sec.total_gasto = _somar_gastos_secretaria(secretaria_id)
+    resumo_sec.orcamento_consolidado = sum(fechados.get(medicao_id, total) for medicao_id, total in totais_medicoes.items())
+
+
+def reconstruir_todos():
+    """Apaga e recria todos os resumos a partir das tabelas de origem (três GROUP BY)."""
+    marcar_alterada(None)
+    ResumoObra.query.delete()
+    ResumoMedicao.query.delete()
+    ResumoSecretaria.query.delete()
+
+    gastos_por_obra = db.session.query(
+        Obra.id, func.coalesce(func.sum(Gasto.valor), 0.0), func.count(Gasto.id)
+    ).outerjoin(Gasto).group_by(Obra.id).all()
+    db.session.add_all(
+        ResumoObra(obra_id=obra_id, total_gasto=total, qtd_gastos=qtd)
+        for obra_id, total, qtd in gastos_por_obra
+    )
+
+    orcamento_por_medicao = db.session.query(
+        Medicao.id, Medicao.secretaria_id, func.coalesce(func.sum(OrcamentoMedicaoObra.valor_efetivo), 0.0)
+    ).outerjoin(OrcamentoMedicaoObra, OrcamentoMedicaoObra.medicao_id == Medicao.id).group_by(Medicao.id).all()
+    db.session.add_all(
+        ResumoMedicao(medicao_id=medicao_id, orcamento_total=total)
+        for medicao_id, _, total in orcamento_por_medicao
+    )
+
+    # As arquivadas também: ficam com o resumo certo se forem restauradas
+    totais = totais_secretarias(incluir_arquivadas=True)
+    db.session.add_all(
+        ResumoSecretaria(
+            secretaria_id=linha.id,
+            total_gasto=linha.orcamento_gasto,
+            orcamento_consolidado=linha.orcamento_consolidado
+        ) for linha in totais
+    )
+    return len(totais), len(gastos_por_obra), len(orcamento_por_medicao)
+
+
+def totais_secretarias(ids=None, sessao=None, incluir_arquivadas=False):
+    """Calcula, direto das tabelas de origem, os totais de várias secretarias numa só consulta.
+
+    Devolve linhas com id, nome, orcamento_consolidado, orcamento_gasto e orcamento_restante.
+    `sessao` permite usar uma sessão fora do Flask (banco.py); por omissão é db.session.
+    As secretarias arquivadas ficam de fora, salvo com `incluir_arquivadas`.
+    """
+    if sessao is None:
+        sessao = db.session
+    gastos = sessao.query(
+        Obra.secretaria_id.label('secretaria_id'), func.sum(Gasto.valor).label('total')
+    ).join(Gasto, Gasto.obra_id == Obra.id)
+    # Total de cada medição; nas fechadas, o orçamento gravado no fecho
+    por_medicao = sessao.query(
+        Medicao.secretaria_id.label('secretaria_id'),
+        func.coalesce(
+            FechamentoMedicao.orcamento_total, func.sum(OrcamentoMedicaoObra.valor_efetivo)
+        ).label('total')
+    ).outerjoin(OrcamentoMedicaoObra, OrcamentoMedicaoObra.medicao_id == Medicao.id).outerjoin(
+        FechamentoMedicao, FechamentoMedicao.medicao_id == Medicao.id
+    )
+    if ids is not None:
+        # O filtro vai para dentro dos agrupamentos para não somar secretarias descartadas
+        gastos = gastos.filter(Obra.secretaria_id.in_(ids))
+        por_medicao = por_medicao.filter(Medicao.secretaria_id.in_(ids))
+    gastos = gastos.group_by(Obra.secretaria_id).subquery()
+    por_medicao = por_medicao.group_by(
+        Medicao.id, Medicao.secretaria_id, FechamentoMedicao.orcamento_total
+    ).subquery()
+    orcamentos = sessao.query(
+        por_medicao.c.secretaria_id, func.sum(por_medicao.c.total).label('total')
+    ).group_by(por_medicao.c.secretaria_id).subquery()
+
+    consolidado = func.coalesce(orcamentos.c.total, 0.0)
+    gasto = func.coalesce(gastos.c.total, 0.0)
+    query = sessao.query(
+        Secretaria.id,
+        Secretaria.nome,
+        consolidado.label('orcamento_consolidado'),
+        gasto.label('orcamento_gasto'),
+        (consolidado - gasto).label('orcamento_restante')
+    ).outerjoin(gastos, gastos.c.secretaria_id == Secretaria.id).outerjoin(
+        orcamentos, orcamentos.c.secretaria_id == Secretaria.id
+    )
+    if not incluir_arquivadas:
+        query = query.filter(Secretaria.ativa)
+    if ids is not None:
+        query = query.filter(Secretaria.id.in_(ids))
+    return query.order_by(Secretaria.nome).all()
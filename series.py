@@ -0,0 +1,197 @@
+"""Séries diárias (gastos x saldo) usadas nos gráficos de fluxo de caixa do painel.
+
+Tudo é calculado com consultas agrupadas para um conjunto de secretarias de uma
+só vez, sem carregar obras nem gastos como objetos do ORM.
+"""
+from sqlalchemy import func
+
+from models import db, Gasto, Obra, Medicao, FechamentoMedicao
+import periodos
+
+
+def medicoes_por_secretaria(secretaria_ids):
+    """Devolve {secretaria_id: [medições]} com o orçamento total já somado pelo banco.
+
+    Nas medições fechadas, o orçamento e o gasto (`gasto_fechado`) são os gravados no fecho.
+    """
+    linhas = db.session.query(
+        Medicao.id, Medicao.secretaria_id, Medicao.nome, Medicao.data_inicio, Medicao.data_fim,
+        Medicao.orcamento_total.label('orcamento_total'),
+        FechamentoMedicao.total_gasto.label('gasto_fechado')
+    ).outerjoin(FechamentoMedicao, FechamentoMedicao.medicao_id == Medicao.id).filter(
+        Medicao.secretaria_id.in_(secretaria_ids)
+    ).order_by(Medicao.data_inicio.desc()).all()
+
+    resultado = {sid: [] for sid in secretaria_ids}
+    for linha in linhas:
+        resultado[linha.secretaria_id].append(linha)
+    return resultado
+
+
+def consulta_gastos_por_dia(secretaria_ids, inicio, fim):
+    return db.session.query(
+        Obra.secretaria_id, Gasto.data, func.sum(Gasto.valor)
+    ).join(Obra, Gasto.obra_id == Obra.id).filter(
+        Obra.secretaria_id.in_(secretaria_ids),
+        Gasto.data >= inicio,
+        Gasto.data <= fim
+    ).group_by(Obra.secretaria_id, Gasto.data)
+
+
+def gastos_por_dia(secretaria_ids, inicio, fim):
+    """Devolve {secretaria_id: {data: total}} a partir de um GROUP BY por secretaria e dia."""
+    linhas = consulta_gastos_por_dia(secretaria_ids, inicio, fim).all()
+
+    resultado = {sid: {} for sid in secretaria_ids}
+    for secretaria_id, data, total in linhas:
+        resultado[secretaria_id][data] = total
+    return resultado
+
+
+GRANULARIDADES = ('day', 'week', 'month')
+_FORMATO_ROTULO = {'day': '%d/%m', 'week': '%d/%m', 'month': '%m/%Y'}
+
+
+def _serie_vazia():
+    return {'labels': [], 'gastos': [], 'saldos': [], 'teto_orcamento': 0, 'medicoes': [],
+            'sobreposicoes': [], 'lacunas': []}
+
+
+def _chaves_agrupamento(datas, granularidade):
+    """Devolve, para cada dia, a chave do balde (dia, semana iniciada à segunda ou mês)."""
+    if granularidade == 'month':
+        return datas.astype('datetime64[M]').astype('int64')
+    dias = datas.astype('int64')
+    if granularidade == 'week':
+        # 1970-01-01 foi uma quinta-feira: (dias + 3) % 7 dá 0 para segunda-feira
+        return dias - (dias + 3) % 7
+    return dias
+
+
+def montar_serie(medicoes, gastos_diarios, inicio=None, fim=None, granularidade='day'):
+    """Monta o payload do gráfico de linha a partir das medições e dos totais diários.
+
+    Os vetores densos (um elemento por dia) são calculados com NumPy; o saldo é o
+    `cumsum` de orçamentos menos gastos sobre todo o histórico, e só depois a
+    série é recortada em [inicio, fim] e agrupada por semana ou mês, se pedido.
+
+    Os marcadores trazem o gasto atribuído ao período de cada medição e as
+    posições (em dias desde o início da primeira) do seu início e fim; as
+    sobreposições e lacunas entre medições vêm à parte (ver periodos.py). Para
+    estarem certos, `gastos_diarios` deve cobrir todos os períodos, mesmo depois de `fim`.
+    """
+    import numpy as np
+
+    if not medicoes:
+        return _serie_vazia()
+    atribuicao = periodos.atribuir(medicoes, gastos_diarios)
+
+    min_data = min(m.data_inicio for m in medicoes)
+    max_data = max(m.data_fim for m in medicoes)
+    total_dias = (max_data - min_data).days + 1
+
+    gastos = np.zeros(total_dias)
+    if gastos_diarios:
+        posicoes = np.fromiter(((d - min_data).days for d in gastos_diarios), dtype=np.int64, count=len(gastos_diarios))
+        valores = np.fromiter(gastos_diarios.values(), dtype=np.float64, count=len(gastos_diarios))
+        dentro = (posicoes >= 0) & (posicoes < total_dias)
+        np.add.at(gastos, posicoes[dentro], valores[dentro])
+
+    orcamentos = np.zeros(total_dias)
+    np.add.at(
+        orcamentos,
+        np.array([(m.data_inicio - min_data).days for m in medicoes], dtype=np.int64),
+        np.array([m.orcamento_total for m in medicoes], dtype=np.float64)
+    )
+    saldos = np.cumsum(orcamentos - gastos)
+
+    # Recorte do intervalo pedido (o saldo inicial já inclui tudo o que veio antes)
+    primeiro = max((inicio - min_data).days, 0) if inicio else 0
+    ultimo = min((fim - min_data).days, total_dias - 1) if fim else total_dias - 1
+    teto = float(orcamentos.sum())
+    problemas = _problemas_de_periodos(atribuicao)
+    if primeiro > ultimo:
+        serie = _serie_vazia()
+        serie.update(problemas, teto_orcamento=teto)
+        return serie
+
+    datas = np.datetime64(min_data, 'D') + np.arange(primeiro, ultimo + 1)
+    gastos = gastos[primeiro:ultimo + 1]
+    saldos = saldos[primeiro:ultimo + 1]
+
+    chaves = _chaves_agrupamento(datas, granularidade)
+    inicios_balde = np.concatenate(([0], np.flatnonzero(np.diff(chaves)) + 1))
+    fins_balde = np.append(inicios_balde[1:], len(chaves)) - 1
+
+    formato = _FORMATO_ROTULO[granularidade]
+    rotulos = [d.strftime(formato) for d in datas[inicios_balde].astype(object)]
+
+    # Cada medição é marcada no balde que contém a sua data de início
+    marcadores = []
+    sobrepostas = atribuicao.sobrepostas()
+    for medicao in medicoes:
+        if medicao.orcamento_total <= 0:
+            continue
+        posicao = (medicao.data_inicio - min_data).days - primeiro
+        if 0 <= posicao < len(chaves):
+            balde = int(np.searchsorted(inicios_balde, posicao, side='right')) - 1
+            gasto_fechado = getattr(medicao, 'gasto_fechado', None)
+            marcadores.append({
+                'nome': medicao.nome,
+                'data': rotulos[balde],
+                'valor': medicao.orcamento_total,
+                'gasto': atribuicao.gastos[medicao.id] if gasto_fechado is None else gasto_fechado,
+                'fechada': gasto_fechado is not None,
+                'posicao_inicio': (medicao.data_inicio - min_data).days,
+                'posicao_fim': (medicao.data_fim - min_data).days,
+                'sobreposta': medicao.id in sobrepostas,
+            })
+
+    return {
+        'labels': rotulos,
+        'gastos': np.add.reduceat(gastos, inicios_balde).tolist(),
+        # O saldo de cada balde é o do seu último dia
+        'saldos': saldos[fins_balde].tolist(),
+        'teto_orcamento': teto,
+        'medicoes': marcadores,
+        **problemas
+    }
+
+
+def _problemas_de_periodos(atribuicao):
+    """Sobreposições e lacunas entre medições, no formato do payload dos gráficos."""
+    return {
+        'sobreposicoes': [{
+            'medicoes': [s.primeira.nome, s.segunda.nome],
+            'de': s.inicio.strftime('%d/%m/%Y'),
+            'ate': s.fim.strftime('%d/%m/%Y'),
+            'dias': (s.fim - s.inicio).days + 1,
+            'gasto': s.gasto,
+        } for s in atribuicao.sobreposicoes],
+        'lacunas': [{
+            'de': l.inicio.strftime('%d/%m/%Y'),
+            'ate': l.fim.strftime('%d/%m/%Y'),
+            'dias': (l.fim - l.inicio).days + 1,
+            'gasto': l.gasto,
+        } for l in atribuicao.lacunas],
+    }
+
+
+def series_secretarias(secretaria_ids, inicio=None, fim=None, granularidade='day'):
+    """Calcula as séries de várias secretarias com duas consultas no total."""
+    medicoes = medicoes_por_secretaria(secretaria_ids)
+    todas = [m for lista in medicoes.values() for m in lista]
+    if not todas:
+        return {sid: _serie_vazia() for sid in secretaria_ids}
+
+    # Todo o período das medições é lido, mesmo fora de [inicio, fim]: os dias anteriores
+    # entram no saldo acumulado e todos entram no gasto atribuído a cada medição
+    gastos = gastos_por_dia(
+        secretaria_ids,
+        min(m.data_inicio for m in todas),
+        max(m.data_fim for m in todas)
+    )
+    return {
+        sid: montar_serie(medicoes[sid], gastos[sid], inicio, fim, granularidade)
+        for sid in secretaria_ids
+    }
@@ -0,0 +1,174 @@
+"""Gerador de dados sintéticos à escala de produção, para testes de carga e benchmarks.
+
+As distribuições imitam as de uma prefeitura real: poucas secretarias
+concentram a maior parte das obras, poucas obras concentram a maior parte dos
+gastos (pesos log-normais), os valores dos gastos são log-normais e cada
+secretaria tem medições mensais consecutivas. A mesma semente gera sempre os
+mesmos dados.
+
+As linhas são inseridas em lote pelo Core do SQLAlchemy, e no fim os resumos
+são reconstruídos de uma só vez.
+"""
+from datetime import date, timedelta
+
+from sqlalchemy import insert
+
+from models import db, Secretaria, Obra, Andamento, Gasto, Medicao, OrcamentoMedicaoObra
+import rollups
+
+LINHAS_POR_LOTE = 50000
+DIAS_DE_HISTORICO = 3 * 365
+
+AREAS = [
+    'Saúde', 'Educação', 'Obras e Urbanismo', 'Infraestrutura', 'Meio Ambiente', 'Assistência Social',
+    'Cultura', 'Esporte e Lazer', 'Transportes', 'Habitação', 'Agricultura', 'Turismo',
+    'Segurança Pública', 'Administração', 'Planejamento', 'Desenvolvimento Econômico',
+    'Ciência e Tecnologia', 'Recursos Hídricos', 'Juventude', 'Defesa Civil',
+]
+TIPOS_OBRA = [
+    'Construção da Escola', 'Reforma da UBS', 'Pavimentação da Rua', 'Drenagem do Bairro',
+    'Ampliação do Hospital', 'Construção de Creche', 'Recuperação da Ponte', 'Iluminação Pública do Bairro',
+    'Construção da Praça', 'Reforma do Ginásio', 'Saneamento Básico do Bairro', 'Contenção de Encosta',
+]
+LOCAIS = [
+    'São Francisco', 'Cohab', 'Anil', 'Centro', 'Renascença', 'Turu', 'Vila Embratel', 'Cidade Operária',
+    'João Paulo', 'Liberdade', 'Coroadinho', 'Maracanã', 'Araçagi', 'Calhau', 'Itaqui', 'Jardim São Cristóvão',
+]
+MUNICIPIOS = [
+    'São Luís', 'Imperatriz', 'Caxias', 'Timon', 'Codó', 'Paço do Lumiar', 'São José de Ribamar',
+    'Açailândia', 'Bacabal', 'Balsas', 'Santa Inês', 'Pinheiro', 'Chapadinha', 'Barra do Corda',
+]
+DESCRICOES_GASTO = [
+    'Compra de cimento', 'Mão de obra', 'Locação de equipamentos', 'Aço CA-50', 'Areia e brita',
+    'Serviços de terraplanagem', 'Material elétrico', 'Tubos de PVC', 'Pintura', 'Transporte de material',
+    'Medição de serviços', 'Esquadrias', 'Impermeabilização', 'Asfalto (CBUQ)',
+]
+STATUS = ['Não Iniciada', 'Em Andamento', 'Paralisada', 'Concluída']
+
+
+def _em_lotes(conexao, tabela, linhas):
+    for inicio in range(0, len(linhas), LINHAS_POR_LOTE):
+        conexao.execute(insert(tabela), linhas[inicio:inicio + LINHAS_POR_LOTE])
+
+
+def _meses_anteriores(hoje, quantidade):
+    """(início, fim) dos `quantidade` meses completos anteriores ao mês atual, do mais antigo ao mais recente."""
+    periodos = []
+    fim = hoje.replace(day=1) - timedelta(days=1)
+    for _ in range(quantidade):
+        inicio = fim.replace(day=1)
+        periodos.append((inicio, fim))
+        fim = inicio - timedelta(days=1)
+    return periodos[::-1]
+
+
+def gerar(secretarias=50, obras=5000, gastos=2000000, medicoes=600, semente=42, progresso=None):
+    """Povoa uma base vazia. `progresso(etapa, linhas)` é chamado a cada tabela gravada.
+
+    Devolve {tabela: linhas inseridas}.
+    """
+    import numpy as np
+
+    if db.session.query(Secretaria.id).first() is not None or db.session.query(Obra.id).first() is not None:
+        raise ValueError('A base já tem dados; o gerador só povoa uma base vazia.')
+
+    rng = np.random.default_rng(semente)
+    hoje = date.today()
+    conexao = db.session.connection()
+    contagem = {}
+
+    def registar(tabela, linhas):
+        _em_lotes(conexao, tabela, linhas)
+        contagem[tabela.name] = len(linhas)
+        if progresso:
+            progresso(tabela.name, len(linhas))
+
+    # --- Secretarias (ids explícitos: a base está vazia) ---
+    nomes = []
+    for i in range(secretarias):
+        area = AREAS[i % len(AREAS)]
+        nomes.append(f'Secretaria de {area}' + (f' {i // len(AREAS) + 1}' if i >= len(AREAS) else ''))
+    registar(Secretaria.__table__, [{'id': i + 1, 'nome': nome} for i, nome in enumerate(nomes)])
+
+    # --- Obras: poucas secretarias concentram a maioria ---
+    peso_secretarias = rng.lognormal(0, 1, secretarias)
+    secretaria_da_obra = rng.choice(np.arange(1, secretarias + 1), size=obras, p=peso_secretarias / peso_secretarias.sum())
+    tipos = rng.integers(0, len(TIPOS_OBRA), obras)
+    locais = rng.integers(0, len(LOCAIS), obras)
+    municipios = rng.integers(0, len(MUNICIPIOS), obras)
+    inicios_obra = rng.integers(0, DIAS_DE_HISTORICO, obras)
+    linhas_obras, linhas_andamento = [], []
+    for i in range(obras):
+        tipo, local, municipio = TIPOS_OBRA[tipos[i]], LOCAIS[locais[i]], MUNICIPIOS[municipios[i]]
+        ano = (hoje - timedelta(days=int(inicios_obra[i]))).year
+        linhas_obras.append({
+            'id': i + 1,
+            'nome': f'{tipo} {local} ({municipio})',
+            'objeto': f'{tipo} no bairro {local}, incluindo projeto, execução e fiscalização.',
+            'municipio': municipio,
+            'n_contrato': f'{i + 1:05d}/{ano}',
+            'contrato_fonte': 'Recursos próprios' if i % 3 else 'Convênio estadual',
+            'ordem_servico': f'OS-{i + 1:05d}',
+            'periodo': f'{ano}',
+            'endereco': f'Rua {LOCAIS[(locais[i] + 3) % len(LOCAIS)]}, {int(rng.integers(1, 2000))} - {local}',
+            'secretaria_id': int(secretaria_da_obra[i]),
+        })
+        inicio = hoje - timedelta(days=int(inicios_obra[i]))
+        linhas_andamento.append({
+            'obra_id': i + 1,
+            'status': STATUS[int(rng.choice(4, p=[0.15, 0.55, 0.1, 0.2]))],
+            'data_inicio': inicio,
+            'data_entrega': inicio + timedelta(days=int(rng.integers(90, 720))),
+        })
+    registar(Obra.__table__, linhas_obras)
+    registar(Andamento.__table__, linhas_andamento)
+
+    # --- Medições mensais consecutivas, repartidas pelas secretarias ---
+    por_secretaria = np.full(secretarias, medicoes // secretarias)
+    por_secretaria[:medicoes % secretarias] += 1
+    obras_da_secretaria = {sid: np.flatnonzero(secretaria_da_obra == sid) + 1 for sid in range(1, secretarias + 1)}
+    linhas_medicoes, linhas_orcamentos = [], []
+    for sid in range(1, secretarias + 1):
+        for inicio, fim in _meses_anteriores(hoje, int(por_secretaria[sid - 1])):
+            medicao_id = len(linhas_medicoes) + 1
+            linhas_medicoes.append({
+                'id': medicao_id, 'nome': f'Medição {inicio:%m/%Y}',
+                'data_inicio': inicio, 'data_fim': fim, 'secretaria_id': sid,
+            })
+            # Cerca de metade das obras da secretaria é orçada em cada medição
+            candidatas = obras_da_secretaria[sid]
+            orcadas = candidatas[rng.random(len(candidatas)) < 0.5]
+            valores = np.round(rng.lognormal(np.log(50000), 0.8, len(orcadas)), 2)
+            com_qualitech = rng.random(len(orcadas)) < 0.3
+            for obra_id, valor, qualitech in zip(orcadas, valores, com_qualitech):
+                os_qualitech = round(float(valor) * float(rng.uniform(0.8, 1.1)), 2) if qualitech else 0.0
+                linhas_orcamentos.append({
+                    'medicao_id': medicao_id, 'obra_id': int(obra_id),
+                    'os_inicial_secretaria': float(valor), 'os_qualitech': os_qualitech,
+                    'fonte_orcamento_selecionada': 'qualitech' if qualitech and rng.random() < 0.5 else 'inicial',
+                })
+    registar(Medicao.__table__, linhas_medicoes)
+    registar(OrcamentoMedicaoObra.__table__, linhas_orcamentos)
+
+    # --- Gastos: pesos log-normais por obra, valores log-normais, datas nos últimos anos ---
+    peso_obras = rng.lognormal(0, 1.2, obras)
+    peso_obras /= peso_obras.sum()
+    gravados = 0
+    for inicio in range(0, gastos, LINHAS_POR_LOTE):
+        tamanho = min(LINHAS_POR_LOTE, gastos - inicio)
+        obra_ids = rng.choice(np.arange(1, obras + 1), size=tamanho, p=peso_obras)
+        valores = np.round(rng.lognormal(np.log(3000), 1.0, tamanho), 2)
+        datas = (np.datetime64(hoje, 'D') - rng.integers(0, DIAS_DE_HISTORICO, tamanho)).astype(object)
+        descricoes = rng.integers(0, len(DESCRICOES_GASTO), tamanho)
+        conexao.execute(insert(Gasto.__table__), [
+            {'descricao': DESCRICOES_GASTO[d], 'valor': float(v), 'data': dt, 'obra_id': int(o)}
+            for d, v, dt, o in zip(descricoes, valores, datas, obra_ids)
+        ])
+        gravados += tamanho
+        if progresso:
+            progresso('gasto', gravados)
+    contagem['gasto'] = gravados
+
+    rollups.reconstruir_todos()
+    db.session.commit()
+    return contagem
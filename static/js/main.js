@@ -1,311 +1,555 @@
-document.addEventListener('DOMContentLoaded', function() {
-    // Tenta inicializar a Web App do Telegram
-    try {
-        Telegram.WebApp.ready();
-    } catch (e) {
-        console.warn("Telegram WebApp script não encontrado ou erro na inicialização.");
-    }
-
-    // --- RENDERIZAÇÃO DE GRÁFICOS ---
-    
-    // Gráficos de Rosca (Orçamento Geral das Secretarias)
-    const secretariaDoughnutCharts = document.querySelectorAll('.chart-container canvas:not(.obra-chart)');
-    secretariaDoughnutCharts.forEach(canvas => {
-        const secretariaId = canvas.dataset.id;
-        if (secretariaId) {
-            fetch(`/api/orcamento/secretaria/${secretariaId}`)
-                .then(response => response.json())
-                .then(data => renderDoughnutChartSecretaria(canvas, [data.orcamento_gasto, data.orcamento_restante]));
-        }
-    });
-
-    // Gráficos de Linha (Fluxo de Caixa das Secretarias)
-    const lineCharts = document.querySelectorAll('.chart-container-diario canvas');
-    lineCharts.forEach(canvas => {
-        const secretariaId = canvas.dataset.id;
-        if (secretariaId) {
-            fetch(`/api/gastos_diarios/secretaria/${secretariaId}`)
-                .then(response => response.json())
-                .then(data => {
-                    if (data.labels && data.labels.length > 0) {
-                        renderLineChart(canvas, data.labels, data.gastos, data.saldos, data.teto_orcamento, data.medicoes);
-                    }
-                });
-        }
-    });
-
-    // Gráficos de Rosca (Orçamento Individual das Obras)
-    const obraDoughnutCharts = document.querySelectorAll('.obra-chart');
-    obraDoughnutCharts.forEach(canvas => {
-        const obraId = canvas.dataset.id;
-        if (obraId) {
-            fetch(`/api/orcamento/obra/${obraId}`)
-                .then(response => response.json())
-                .then(data => renderDoughnutChartObra(canvas, data.gasto_da_obra, data.saldo_da_secretaria));
-        }
-    });
-
-    // GRÁFICOS EM MINIATURA (TABELA DE OBRAS)
-    const miniCharts = document.querySelectorAll('.mini-chart');
-    miniCharts.forEach(canvas => {
-        const gasto = parseFloat(canvas.dataset.gasto) || 0;
-        const restante = parseFloat(canvas.dataset.restante) || 0;
-
-        let chartData, chartColors;
-
-        if (restante <= 0) {
-            chartData = [gasto];
-            chartColors = [getComputedStyle(document.body).getPropertyValue('--prejuizo-color')];
-        } else {
-            chartData = [gasto, restante];
-            chartColors = [
-                getComputedStyle(document.body).getPropertyValue('--gasto-color'),
-                getComputedStyle(document.body).getPropertyValue('--disponivel-color')
-            ];
-        }
-
-        new Chart(canvas, {
-            type: 'doughnut',
-            data: {
-                datasets: [{
-                    data: chartData,
-                    backgroundColor: chartColors,
-                    borderColor: getComputedStyle(document.body).getPropertyValue('--card-bg-color'), 
-                    borderWidth: 2
-                }]
-            },
-            options: {
-                responsive: true,
-                maintainAspectRatio: true,
-                cutout: '70%',
-                plugins: {
-                    legend: { display: false },
-                    tooltip: { enabled: false }
-                }
-            }
-        });
-    });
-
-    // --- LÓGICA DO BOTÃO DE ALTERNÂNCIA DE TEMA ---
-    const themeToggle = document.getElementById('theme-toggle');
-    
-    const switchTheme = (e) => {
-        if (e.target.checked) {
-            document.documentElement.classList.add('dark-mode');
-            localStorage.setItem('theme', 'dark');
-        } else {
-            document.documentElement.classList.remove('dark-mode');
-            localStorage.setItem('theme', 'light');
-        }
-    };
-
-    if (themeToggle) {
-        themeToggle.addEventListener('change', switchTheme);
-        const currentTheme = localStorage.getItem('theme');
-        if (currentTheme) {
-            if (currentTheme === 'dark') {
-                themeToggle.checked = true;
-            }
-        } else if (window.matchMedia && window.matchMedia('(prefers-color-scheme: dark)').matches) {
-            themeToggle.checked = true;
-        }
-    }
-});
-
-
-// ==============================================================================
-// FUNÇÕES AUXILIARES GLOBAIS
-// ==============================================================================
-
-function formatarMoeda(valor) {
-    return new Intl.NumberFormat('pt-BR', { style: 'currency', currency: 'BRL' }).format(valor);
-}
-
-function renderDoughnutChartSecretaria(canvas, data) {
-    const [gasto, restante] = data;
-    let chartData, chartLabels, chartColors;
-
-    if (restante <= 0) {
-        chartLabels = ['Orçamento Excedido'];
-        chartData = [gasto];
-        chartColors = [getComputedStyle(document.body).getPropertyValue('--prejuizo-color')];
-    } else {
-        chartLabels = ['Gasto Consolidado', 'Saldo Geral'];
-        chartData = [gasto, restante];
-        chartColors = [
-            getComputedStyle(document.body).getPropertyValue('--gasto-color'),
-            getComputedStyle(document.body).getPropertyValue('--disponivel-color')
-        ];
-    }
-
-    new Chart(canvas, {
-        type: 'doughnut',
-        data: {
-            labels: chartLabels,
-            datasets: [{ 
-                data: chartData, 
-                backgroundColor: chartColors,
-                borderColor: getComputedStyle(document.body).getPropertyValue('--bg-color'), 
-                borderWidth: 5, 
-                hoverOffset: 10 
-            }]
-        },
-        options: {
-            responsive: true, maintainAspectRatio: false, cutout: '75%',
-            plugins: { 
-                legend: { display: false }, 
-                tooltip: { callbacks: { label: (context) => `${context.label}: ${formatarMoeda(context.parsed)}` } }
-            }
-        }
-    });
-}
-
-function renderDoughnutChartObra(canvas, gastoObra, saldoSecretaria) {
-    const saldoParaGrafico = Math.max(0, saldoSecretaria);
-    new Chart(canvas, {
-        type: 'doughnut',
-        data: {
-            labels: ['Gasto (desta Obra)', 'Disponível (na Secretaria)'],
-            datasets: [{ 
-                data: [gastoObra, saldoParaGrafico], 
-                backgroundColor: [
-                    getComputedStyle(document.body).getPropertyValue('--gasto-color'),
-                    getComputedStyle(document.body).getPropertyValue('--disponivel-color')
-                ], 
-                borderColor: getComputedStyle(document.body).getPropertyValue('--bg-color'), 
-                borderWidth: 5, 
-                hoverOffset: 10 
-            }]
-        },
-        options: {
-            responsive: true, maintainAspectRatio: false, cutout: '75%',
-            plugins: { 
-                legend: { display: false }, 
-                tooltip: { callbacks: { label: (context) => `${context.label}: ${formatarMoeda(context.parsed)}` } }
-            }
-        }
-    });
-}
-
-function renderLineChart(canvas, labels, gastos, saldos, tetoOrcamento, medicoes) {
-    const saldoFinal = saldos.length > 0 ? saldos[saldos.length - 1] : 0;
-    const saldoColor = saldoFinal >= 0 ? 
-        getComputedStyle(document.body).getPropertyValue('--disponivel-color') : 
-        getComputedStyle(document.body).getPropertyValue('--prejuizo-color');
-
-    const gastoColor = getComputedStyle(document.body).getPropertyValue('--gasto-color').trim();
-    const gastoColorTransparent = gastoColor + '66';
-
-    const coresMarcador = ['#8B5CF6', '#D946EF', '#F59E0B', '#14B8A6', '#EC4899']; // Violeta, Magenta, Âmbar, Turquesa, Rosa-choque
-    const datasDeMedicao = new Set(medicoes.map(m => m.data));
-    
-    const marcadoresData = medicoes.map((medicao, index) => {
-        const dataIndex = labels.indexOf(medicao.data);
-        if (dataIndex === -1) return null;
-        return {
-            x: dataIndex,
-            y: saldos[dataIndex],
-            valor: medicao.valor,
-            nome: medicao.nome,
-            cor: coresMarcador[index % coresMarcador.length]
-        };
-    }).filter(p => p !== null);
-
-    new Chart(canvas, {
-        type: 'bar',
-        data: {
-            labels: labels,
-            datasets: [
-                {
-                    type: 'line',
-                    label: 'Saldo Acumulado',
-                    data: saldos,
-                    borderColor: saldoColor,
-                    borderWidth: 3,
-                    fill: false,
-                    tension: 0.3,
-                    yAxisID: 'y',
-                    pointRadius: (ctx) => datasDeMedicao.has(labels[ctx.dataIndex]) ? 6 : 0,
-                    pointHoverRadius: (ctx) => datasDeMedicao.has(labels[ctx.dataIndex]) ? 8 : 0,
-                    pointBackgroundColor: (ctx) => {
-                        const marcador = marcadoresData.find(m => m.x === ctx.dataIndex);
-                        return marcador ? marcador.cor : 'transparent';
-                    },
-                },
-                {
-                    type: 'bar',
-                    label: 'Gasto Diário',
-                    data: gastos,
-                    backgroundColor: gastoColorTransparent,
-                    borderColor: gastoColor,
-                    borderWidth: 1,
-                    yAxisID: 'y'
-                }
-            ]
-        },
-        options: {
-            responsive: true,
-            maintainAspectRatio: false,
-            plugins: {
-                legend: { display: true, position: 'bottom', labels: { color: getComputedStyle(document.body).getPropertyValue('--text-secondary') } },
-                tooltip: {
-                    mode: 'index',
-                    intersect: false,
-                    callbacks: {
-                        label: (context) => {
-                            if (context.dataset.type === 'line' && context.element.options.radius > 0) {
-                                const marcador = marcadoresData.find(m => m.x === context.dataIndex);
-                                if (marcador) {
-                                    return `Nova Medição (${marcador.nome}): ${formatarMoeda(marcador.valor)}`;
-                                }
-                            }
-                            return `${context.dataset.label}: ${formatarMoeda(context.parsed.y)}`;
-                        }
-                    }
-                }
-            },
-            scales: {
-                x: { 
-                    grid: { display: false }, 
-                    ticks: { color: getComputedStyle(document.body).getPropertyValue('--text-secondary') } 
-                },
-                y: {
-                    beginAtZero: false,
-                    position: 'left',
-                    max: tetoOrcamento > 0 ? tetoOrcamento : undefined,
-                    grid: { color: getComputedStyle(document.body).getPropertyValue('--border-color') },
-                    ticks: {
-                        color: getComputedStyle(document.body).getPropertyValue('--text-secondary'),
-                        callback: (value) => {
-                            if (Math.abs(value) >= 1000000) return `${formatarMoeda(value/1000000)}M`;
-                            if (Math.abs(value) >= 1000) return `${formatarMoeda(value/1000)}k`;
-                            return formatarMoeda(value);
-                        }
-                    }
-                }
-            }
-        }
-    });
-
-    // Constrói a legenda de texto dinamicamente
-    const legendContainer = document.getElementById(`legend-${canvas.dataset.id}`);
-    if (legendContainer) {
-        legendContainer.innerHTML = '';
-        marcadoresData.forEach(marcador => {
-            const item = document.createElement('div');
-            item.className = 'legend-item';
-            
-            const dot = document.createElement('span');
-            dot.className = 'legend-color-dot';
-            dot.style.backgroundColor = marcador.cor;
-            
-            const text = document.createElement('span');
-            text.className = 'legend-text';
-            text.innerHTML = `${marcador.nome}: <strong>${formatarMoeda(marcador.valor)}</strong>`;
-            
-            item.appendChild(dot);
-            item.appendChild(text);
-            legendContainer.appendChild(item);
-        });
-    }
-}
\ No newline at end of file
+document.addEventListener('DOMContentLoaded', function() {
+    // Tenta inicializar a Web App do Telegram
+    try {
+        Telegram.WebApp.ready();
+    } catch (e) {
+        console.warn("Telegram WebApp script não encontrado ou erro na inicialização.");
+    }
+
+    // --- RENDERIZAÇÃO DE GRÁFICOS ---
+    
+    // Gráficos das Secretarias (Rosca + Fluxo de Caixa)
+    // Um único pedido ao /api/painel traz os dados de todos os cartões da página
+    const secretariaDoughnutCharts = document.querySelectorAll('.chart-container canvas:not(.obra-chart)');
+    const lineCharts = document.querySelectorAll('.chart-container-diario canvas');
+    const idsSecretarias = new Set();
+    secretariaDoughnutCharts.forEach(canvas => { if (canvas.dataset.id) idsSecretarias.add(canvas.dataset.id); });
+    lineCharts.forEach(canvas => { if (canvas.dataset.id) idsSecretarias.add(canvas.dataset.id); });
+
+    const carregarPainel = (ids) => fetch(`/api/painel?ids=${ids.join(',')}`)
+        .then(response => response.json())
+        .then(payload => {
+            const porId = {};
+            payload.secretarias.forEach(sec => { porId[sec.id] = sec; });
+
+            secretariaDoughnutCharts.forEach(canvas => {
+                const data = porId[canvas.dataset.id];
+                if (data) {
+                    // Ao recarregar uma secretaria, o gráfico antigo dá lugar ao novo
+                    Chart.getChart(canvas)?.destroy();
+                    renderDoughnutChartSecretaria(canvas, [data.orcamento_gasto, data.orcamento_restante]);
+                }
+            });
+
+            lineCharts.forEach(canvas => {
+                const sec = porId[canvas.dataset.id];
+                const data = sec ? sec.serie : null;
+                if (data && data.labels && data.labels.length > 0) {
+                    Chart.getChart(canvas)?.destroy();
+                    renderLineChart(canvas, data.labels, data.gastos, data.saldos, data.teto_orcamento, data.medicoes, data);
+                }
+            });
+        });
+
+    if (idsSecretarias.size > 0) {
+        carregarPainel(Array.from(idsSecretarias));
+
+        // --- ATUALIZAÇÕES EM TEMPO REAL ---
+        // Cada gasto ou medição gravada chega como um pequeno delta por SSE (ver eventos.py);
+        // os gráficos existentes são corrigidos no lugar, sem recarregar a página.
+        // Só com EVENTOS_ATIVOS ligado no servidor, que marca o <body> com data-eventos
+        if (window.EventSource && document.body.dataset.eventos === '1') {
+            const fonteEventos = new EventSource('/api/eventos');
+            fonteEventos.addEventListener('secretaria', (evento) => {
+                const delta = JSON.parse(evento.data);
+                if (!idsSecretarias.has(String(delta.secretaria_id))) return;
+
+                atualizarTotaisCartao(delta);
+                if (delta.serie) {
+                    // Medições alteradas mudam o saldo de todos os dias: pede-se de novo a série
+                    carregarPainel([delta.secretaria_id]);
+                } else if (delta.dia) {
+                    aplicarDiaNaSerie(delta.secretaria_id, delta.dia);
+                }
+            });
+        }
+    }
+
+    // Gráficos de Rosca (Orçamento Individual das Obras)
+    const obraDoughnutCharts = document.querySelectorAll('.obra-chart');
+    obraDoughnutCharts.forEach(canvas => {
+        const obraId = canvas.dataset.id;
+        if (obraId) {
+            fetch(`/api/orcamento/obra/${obraId}`)
+                .then(response => response.json())
+                .then(data => renderDoughnutChartObra(canvas, data.gasto_da_obra, data.saldo_da_secretaria));
+        }
+    });
+
+    // GRÁFICOS EM MINIATURA (TABELA DE OBRAS)
+    const miniCharts = document.querySelectorAll('.mini-chart');
+    miniCharts.forEach(canvas => {
+        const gasto = parseFloat(canvas.dataset.gasto) || 0;
+        const restante = parseFloat(canvas.dataset.restante) || 0;
+
+        let chartData, chartColors;
+
+        if (restante <= 0) {
+            chartData = [gasto];
+            chartColors = [getComputedStyle(document.body).getPropertyValue('--prejuizo-color')];
+        } else {
+            chartData = [gasto, restante];
+            chartColors = [
+                getComputedStyle(document.body).getPropertyValue('--gasto-color'),
+                getComputedStyle(document.body).getPropertyValue('--disponivel-color')
+            ];
+        }
+
+        new Chart(canvas, {
+            type: 'doughnut',
+            data: {
+                datasets: [{
+                    data: chartData,
+                    backgroundColor: chartColors,
+                    borderColor: getComputedStyle(document.body).getPropertyValue('--card-bg-color'), 
+                    borderWidth: 2
+                }]
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: true,
+                cutout: '70%',
+                plugins: {
+                    legend: { display: false },
+                    tooltip: { enabled: false }
+                }
+            }
+        });
+    });
+
+    // --- AUTOCOMPLETAR DA PESQUISA DE OBRAS ---
+    // Sugestões num <datalist>; espera o utilizador parar de escrever e ignora respostas atrasadas
+    const campoPesquisa = document.querySelector('input[data-autocompletar]');
+    const listaSugestoes = campoPesquisa ? document.getElementById(campoPesquisa.getAttribute('list')) : null;
+    if (campoPesquisa && listaSugestoes) {
+        let espera = null;
+        let ultimoPedido = 0;
+        campoPesquisa.addEventListener('input', () => {
+            clearTimeout(espera);
+            const texto = campoPesquisa.value.trim();
+            if (!texto) {
+                listaSugestoes.innerHTML = '';
+                return;
+            }
+            espera = setTimeout(() => {
+                const pedido = ++ultimoPedido;
+                fetch(`${campoPesquisa.dataset.autocompletar}?q=${encodeURIComponent(texto)}`)
+                    .then(response => response.json())
+                    .then(obras => {
+                        if (pedido !== ultimoPedido) return;
+                        listaSugestoes.innerHTML = '';
+                        obras.forEach(obra => {
+                            const opcao = document.createElement('option');
+                            opcao.value = obra.nome;
+                            opcao.label = [obra.n_contrato, obra.municipio].filter(Boolean).join(' · ');
+                            listaSugestoes.appendChild(opcao);
+                        });
+                    });
+            }, 150);
+        });
+    }
+
+    // --- HISTÓRICO DE GASTOS COM SCROLL INFINITO ---
+    // A página traz a primeira página do histórico; as seguintes vêm de /api/obra/<id>/gastos
+    // quando o fim da lista fica visível. Sem JavaScript fica o link "Mais antigos".
+    const listaGastos = document.querySelector('.gastos-list[data-api]');
+    if (listaGastos && listaGastos.dataset.seguinte && 'IntersectionObserver' in window) {
+        let cursor = listaGastos.dataset.seguinte;
+        let aCarregar = false;
+        const linkSeguinte = document.querySelector('.gastos-seguinte');
+        if (linkSeguinte) linkSeguinte.style.display = 'none';
+
+        const sentinela = document.createElement('div');
+        listaGastos.appendChild(sentinela);
+
+        const criarItem = (gasto) => {
+            const item = document.createElement('div');
+            item.className = 'gasto-item';
+            const [ano, mes, dia] = gasto.data.split('-');
+            const acaoRemover = listaGastos.dataset.urlRemover.replace('/0/', `/${gasto.id}/`);
+            item.innerHTML = `
+                <div class="gasto-info">
+                    <span class="gasto-data">${dia}/${mes}/${ano}</span>
+                    <span class="gasto-desc"></span>
+                </div>
+                <div class="gasto-actions">
+                    <span class="gasto-valor">${formatarMoeda(gasto.valor)}</span>
+                    <span class="gasto-acumulado" title="Total gasto na obra até este lançamento">${formatarMoeda(gasto.acumulado)}</span>
+                    <form action="${acaoRemover}" method="POST" onsubmit="return confirm('Tem a certeza que deseja remover este gasto?');">
+                        <button type="submit" class="btn-remover" title="Remover Gasto">&times;</button>
+                    </form>
+                </div>`;
+            // A descrição é texto do utilizador: nunca como HTML
+            item.querySelector('.gasto-desc').textContent = gasto.descricao;
+            return item;
+        };
+
+        const observador = new IntersectionObserver((entradas) => {
+            if (!entradas.some(e => e.isIntersecting) || aCarregar || !cursor) return;
+            aCarregar = true;
+            const separador = listaGastos.dataset.api.includes('?') ? '&' : '?';
+            fetch(`${listaGastos.dataset.api}${separador}after=${encodeURIComponent(cursor)}`)
+                .then(response => response.json())
+                .then(pagina => {
+                    pagina.gastos.forEach(gasto => listaGastos.insertBefore(criarItem(gasto), sentinela));
+                    cursor = pagina.seguinte;
+                    if (!cursor) observador.disconnect();
+                })
+                .finally(() => { aCarregar = false; });
+        }, { root: listaGastos, rootMargin: '200px' });
+        observador.observe(sentinela);
+    }
+
+    // --- LÓGICA DO BOTÃO DE ALTERNÂNCIA DE TEMA ---
+    const themeToggle = document.getElementById('theme-toggle');
+    
+    const switchTheme = (e) => {
+        if (e.target.checked) {
+            document.documentElement.classList.add('dark-mode');
+            localStorage.setItem('theme', 'dark');
+        } else {
+            document.documentElement.classList.remove('dark-mode');
+            localStorage.setItem('theme', 'light');
+        }
+    };
+
+    if (themeToggle) {
+        themeToggle.addEventListener('change', switchTheme);
+        const currentTheme = localStorage.getItem('theme');
+        if (currentTheme) {
+            if (currentTheme === 'dark') {
+                themeToggle.checked = true;
+            }
+        } else if (window.matchMedia && window.matchMedia('(prefers-color-scheme: dark)').matches) {
+            themeToggle.checked = true;
+        }
+    }
+});
+
+
+// ==============================================================================
+// FUNÇÕES AUXILIARES GLOBAIS
+// ==============================================================================
+
+function formatarMoeda(valor) {
+    return new Intl.NumberFormat('pt-BR', { style: 'currency', currency: 'BRL' }).format(valor);
+}
+
+function dadosRoscaSecretaria(gasto, restante) {
+    if (restante <= 0) {
+        return {
+            chartLabels: ['Orçamento Excedido'],
+            chartData: [gasto],
+            chartColors: [getComputedStyle(document.body).getPropertyValue('--prejuizo-color')]
+        };
+    }
+    return {
+        chartLabels: ['Gasto Consolidado', 'Saldo Geral'],
+        chartData: [gasto, restante],
+        chartColors: [
+            getComputedStyle(document.body).getPropertyValue('--gasto-color'),
+            getComputedStyle(document.body).getPropertyValue('--disponivel-color')
+        ]
+    };
+}
+
+function corDoSaldo(saldo) {
+    return saldo >= 0 ?
+        getComputedStyle(document.body).getPropertyValue('--disponivel-color') :
+        getComputedStyle(document.body).getPropertyValue('--prejuizo-color');
+}
+
+function renderDoughnutChartSecretaria(canvas, data) {
+    const [gasto, restante] = data;
+    const { chartLabels, chartData, chartColors } = dadosRoscaSecretaria(gasto, restante);
+
+    new Chart(canvas, {
+        type: 'doughnut',
+        data: {
+            labels: chartLabels,
+            datasets: [{ 
+                data: chartData, 
+                backgroundColor: chartColors,
+                borderColor: getComputedStyle(document.body).getPropertyValue('--bg-color'), 
+                borderWidth: 5, 
+                hoverOffset: 10 
+            }]
+        },
+        options: {
+            responsive: true, maintainAspectRatio: false, cutout: '75%',
+            plugins: { 
+                legend: { display: false }, 
+                tooltip: { callbacks: { label: (context) => `${context.label}: ${formatarMoeda(context.parsed)}` } }
+            }
+        }
+    });
+}
+
+function renderDoughnutChartObra(canvas, gastoObra, saldoSecretaria) {
+    const saldoParaGrafico = Math.max(0, saldoSecretaria);
+    new Chart(canvas, {
+        type: 'doughnut',
+        data: {
+            labels: ['Gasto (desta Obra)', 'Disponível (na Secretaria)'],
+            datasets: [{ 
+                data: [gastoObra, saldoParaGrafico], 
+                backgroundColor: [
+                    getComputedStyle(document.body).getPropertyValue('--gasto-color'),
+                    getComputedStyle(document.body).getPropertyValue('--disponivel-color')
+                ], 
+                borderColor: getComputedStyle(document.body).getPropertyValue('--bg-color'), 
+                borderWidth: 5, 
+                hoverOffset: 10 
+            }]
+        },
+        options: {
+            responsive: true, maintainAspectRatio: false, cutout: '75%',
+            plugins: { 
+                legend: { display: false }, 
+                tooltip: { callbacks: { label: (context) => `${context.label}: ${formatarMoeda(context.parsed)}` } }
+            }
+        }
+    });
+}
+
+// Marcadores de cada gráfico de fluxo de caixa, por id da secretaria: o gasto atribuído
+// a cada medição muda com os deltas de /api/eventos (ver aplicarDiaNaSerie)
+const marcadoresPorGrafico = new Map();
+
+function renderLineChart(canvas, labels, gastos, saldos, tetoOrcamento, medicoes, problemas = {}) {
+    const saldoFinal = saldos.length > 0 ? saldos[saldos.length - 1] : 0;
+    const saldoColor = corDoSaldo(saldoFinal);
+
+    const gastoColor = getComputedStyle(document.body).getPropertyValue('--gasto-color').trim();
+    const gastoColorTransparent = gastoColor + '66';
+
+    const coresMarcador = ['#8B5CF6', '#D946EF', '#F59E0B', '#14B8A6', '#EC4899']; // Violeta, Magenta, Âmbar, Turquesa, Rosa-choque
+    const datasDeMedicao = new Set(medicoes.map(m => m.data));
+    
+    const marcadoresData = medicoes.map((medicao, index) => {
+        const dataIndex = labels.indexOf(medicao.data);
+        if (dataIndex === -1) return null;
+        return {
+            x: dataIndex,
+            y: saldos[dataIndex],
+            valor: medicao.valor,
+            nome: medicao.nome,
+            gasto: medicao.gasto || 0,
+            posicaoInicio: medicao.posicao_inicio,
+            posicaoFim: medicao.posicao_fim,
+            sobreposta: medicao.sobreposta,
+            fechada: medicao.fechada,
+            cor: coresMarcador[index % coresMarcador.length]
+        };
+    }).filter(p => p !== null);
+    marcadoresPorGrafico.set(canvas.dataset.id, {
+        marcadores: marcadoresData,
+        sobreposicoes: problemas.sobreposicoes || [],
+        lacunas: problemas.lacunas || []
+    });
+
+    new Chart(canvas, {
+        type: 'bar',
+        data: {
+            labels: labels,
+            datasets: [
+                {
+                    type: 'line',
+                    label: 'Saldo Acumulado',
+                    data: saldos,
+                    borderColor: saldoColor,
+                    borderWidth: 3,
+                    fill: false,
+                    tension: 0.3,
+                    yAxisID: 'y',
+                    pointRadius: (ctx) => datasDeMedicao.has(labels[ctx.dataIndex]) ? 6 : 0,
+                    pointHoverRadius: (ctx) => datasDeMedicao.has(labels[ctx.dataIndex]) ? 8 : 0,
+                    pointBackgroundColor: (ctx) => {
+                        const marcador = marcadoresData.find(m => m.x === ctx.dataIndex);
+                        return marcador ? marcador.cor : 'transparent';
+                    },
+                },
+                {
+                    type: 'bar',
+                    label: 'Gasto Diário',
+                    data: gastos,
+                    backgroundColor: gastoColorTransparent,
+                    borderColor: gastoColor,
+                    borderWidth: 1,
+                    yAxisID: 'y'
+                }
+            ]
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {
+                legend: { display: true, position: 'bottom', labels: { color: getComputedStyle(document.body).getPropertyValue('--text-secondary') } },
+                tooltip: {
+                    mode: 'index',
+                    intersect: false,
+                    callbacks: {
+                        label: (context) => {
+                            if (context.dataset.type === 'line' && context.element.options.radius > 0) {
+                                const marcador = marcadoresData.find(m => m.x === context.dataIndex);
+                                if (marcador) {
+                                    const aviso = marcador.sobreposta ? ' (período sobreposto)' : '';
+                                    return `Nova Medição (${marcador.nome}): ${formatarMoeda(marcador.valor)}, ` +
+                                        `gasto ${formatarMoeda(marcador.gasto)}${aviso}`;
+                                }
+                            }
+                            return `${context.dataset.label}: ${formatarMoeda(context.parsed.y)}`;
+                        }
+                    }
+                }
+            },
+            scales: {
+                x: { 
+                    grid: { display: false }, 
+                    ticks: { color: getComputedStyle(document.body).getPropertyValue('--text-secondary') } 
+                },
+                y: {
+                    beginAtZero: false,
+                    position: 'left',
+                    max: tetoOrcamento > 0 ? tetoOrcamento : undefined,
+                    grid: { color: getComputedStyle(document.body).getPropertyValue('--border-color') },
+                    ticks: {
+                        color: getComputedStyle(document.body).getPropertyValue('--text-secondary'),
+                        callback: (value) => {
+                            if (Math.abs(value) >= 1000000) return `${formatarMoeda(value/1000000)}M`;
+                            if (Math.abs(value) >= 1000) return `${formatarMoeda(value/1000)}k`;
+                            return formatarMoeda(value);
+                        }
+                    }
+                }
+            }
+        }
+    });
+
+    renderLegendaMedicoes(canvas.dataset.id);
+}
+
+// Constrói a legenda de texto dinamicamente: orçamento e gasto de cada medição,
+// seguidos dos dias em que as medições se sobrepõem ou não há nenhuma
+function renderLegendaMedicoes(secretariaId) {
+    const legendContainer = document.getElementById(`legend-${secretariaId}`);
+    const dados = marcadoresPorGrafico.get(String(secretariaId));
+    if (!legendContainer || !dados) return;
+    legendContainer.innerHTML = '';
+    dados.marcadores.forEach(marcador => {
+        const item = document.createElement('div');
+        item.className = 'legend-item';
+
+        const dot = document.createElement('span');
+        dot.className = 'legend-color-dot';
+        dot.style.backgroundColor = marcador.cor;
+
+        const text = document.createElement('span');
+        text.className = 'legend-text';
+        const aviso = (marcador.fechada ? ' (fechada)' : '') + (marcador.sobreposta ? ' (sobreposta)' : '');
+        text.innerHTML = `${marcador.nome}${aviso}: <strong>${formatarMoeda(marcador.valor)}</strong>` +
+            ` / gasto <strong>${formatarMoeda(marcador.gasto)}</strong>`;
+
+        item.appendChild(dot);
+        item.appendChild(text);
+        legendContainer.appendChild(item);
+    });
+
+    const avisos = [
+        ...dados.sobreposicoes.map(s => `${s.medicoes.join(' e ')} sobrepõem-se de ${s.de} a ${s.ate}: ` +
+            `${formatarMoeda(s.gasto)} contados nas duas`),
+        ...dados.lacunas.map(l => `Sem medição de ${l.de} a ${l.ate}: ${formatarMoeda(l.gasto)} fora das medições`)
+    ];
+    avisos.forEach(aviso => {
+        const item = document.createElement('div');
+        item.className = 'legend-item';
+        const text = document.createElement('span');
+        text.className = 'legend-text text-gasto';
+        text.textContent = aviso;
+        item.appendChild(text);
+        legendContainer.appendChild(item);
+    });
+}
+
+
+// ==============================================================================
+// ATUALIZAÇÕES DO PAINEL (deltas recebidos de /api/eventos)
+// ==============================================================================
+
+function atualizarTotaisCartao(delta) {
+    const cartao = document.querySelector(`.card[data-secretaria="${delta.secretaria_id}"]`);
+    if (!cartao) return;
+    const positivo = delta.orcamento_restante >= 0;
+
+    ['orcamento_consolidado', 'orcamento_gasto', 'orcamento_restante'].forEach(campo => {
+        const valor = cartao.querySelector(`[data-campo="${campo}"]`);
+        if (valor) valor.textContent = formatarMoeda(delta[campo]);
+    });
+    const saldo = cartao.querySelector('[data-campo="orcamento_restante"]');
+    if (saldo) {
+        saldo.classList.toggle('text-disponivel', positivo);
+        saldo.classList.toggle('text-prejuizo', !positivo);
+    }
+
+    // Mesmas contas do template (cartao_secretaria.html)
+    const barra = cartao.querySelector('.percentage-bar');
+    if (barra) {
+        const largura = delta.orcamento_consolidado > 0 ?
+            Math.min(100, Math.abs(delta.orcamento_gasto / delta.orcamento_consolidado * 100)) : 0;
+        barra.style.width = `${largura}%`;
+        barra.classList.toggle('profit', positivo);
+        barra.classList.toggle('loss', !positivo);
+    }
+    const rotulo = cartao.querySelector('.percentage-label');
+    if (rotulo) {
+        const percentual = delta.orcamento_consolidado ?
+            Math.abs(delta.orcamento_restante / delta.orcamento_consolidado * 100) : 0;
+        const texto = document.createElement('span');
+        texto.textContent = positivo ?
+            `Lucro Geral de ${percentual.toFixed(1)}% (${formatarMoeda(delta.orcamento_restante)})` :
+            `Prejuízo Geral de ${percentual.toFixed(1)}% (${formatarMoeda(-delta.orcamento_restante)})`;
+        rotulo.replaceChildren(texto);
+        rotulo.classList.toggle('text-disponivel', positivo);
+        rotulo.classList.toggle('text-prejuizo', !positivo);
+    }
+
+    const rosca = document.getElementById(`chart-secretaria-${delta.secretaria_id}`);
+    const grafico = rosca ? Chart.getChart(rosca) : null;
+    if (grafico) {
+        const { chartLabels, chartData, chartColors } = dadosRoscaSecretaria(delta.orcamento_gasto, delta.orcamento_restante);
+        grafico.data.labels = chartLabels;
+        grafico.data.datasets[0].data = chartData;
+        grafico.data.datasets[0].backgroundColor = chartColors;
+        grafico.update();
+    }
+}
+
+function aplicarDiaNaSerie(secretariaId, dia) {
+    // `dia.posicao` conta os dias desde o início da primeira medição, como a série diária do /api/painel
+    const canvas = document.getElementById(`chart-diario-${secretariaId}`);
+    const grafico = canvas ? Chart.getChart(canvas) : null;
+    if (!grafico) return;
+    const saldos = grafico.data.datasets[0].data;
+    const gastos = grafico.data.datasets[1].data;
+    if (dia.posicao < 0 || dia.posicao >= gastos.length) return;
+
+    gastos[dia.posicao] = dia.gasto;
+    // O saldo é acumulado: o gasto incluído (ou removido) desloca todos os dias seguintes
+    for (let i = dia.posicao; i < saldos.length; i++) {
+        saldos[i] -= dia.variacao;
+    }
+    grafico.data.datasets[0].borderColor = corDoSaldo(saldos[saldos.length - 1]);
+    grafico.update();
+
+    // O gasto do dia entra em todas as medições abertas cujo período o contém;
+    // as fechadas mantêm o gasto gravado no fecho
+    const dados = marcadoresPorGrafico.get(String(secretariaId));
+    if (dados) {
+        dados.marcadores.forEach(marcador => {
+            if (!marcador.fechada && marcador.posicaoInicio <= dia.posicao && dia.posicao <= marcador.posicaoFim) {
+                marcador.gasto += dia.variacao;
+            }
+        });
+        renderLegendaMedicoes(secretariaId);
+    }
+}
@@ -0,0 +1,136 @@
+"""Fila local de relatórios gerados em segundo plano.
+
+Os relatórios correm num ProcessPoolExecutor (limitado por RELATORIOS_MAX_PROCESSOS),
+fora da thread do pedido. O estado de cada tarefa é um pequeno JSON ao lado do
+ficheiro gerado, em RELATORIOS_DIR, para que qualquer worker web o possa consultar
+sem disputar a base de dados com a exportação. Os ficheiros expiram após
+RELATORIOS_RETENCAO_HORAS.
+"""
+import json
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+from flask import current_app
+
+# tipo -> (extensão, mimetype, nome do ficheiro descarregado)
+TIPOS = {
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'relatorio_obras.xlsx'),
+}
+
+_ID_VALIDO = re.compile(r'^[0-9a-f]{32}$')
+_executor = None
+
+
+def _diretorio():
+    diretorio = current_app.config.get('RELATORIOS_DIR') or os.path.join(current_app.instance_path, 'relatorios')
+    os.makedirs(diretorio, exist_ok=True)
+    return diretorio
+
+
+def _obter_executor():
+    global _executor
+    if _executor is None:
+        # 'spawn' evita herdar ligações abertas à base de dados do processo web
+        _executor = ProcessPoolExecutor(
+            max_workers=current_app.config.get('RELATORIOS_MAX_PROCESSOS', 2),
+            mp_context=get_context('spawn')
+        )
+    return _executor
+
+
+def _caminho_estado(diretorio, tarefa_id):
+    return os.path.join(diretorio, f'{tarefa_id}.json')
+
+
+def _gravar_estado(diretorio, tarefa_id, **dados):
+    """Atualiza o JSON de estado de forma atómica (escreve num temporário e renomeia)."""
+    caminho = _caminho_estado(diretorio, tarefa_id)
+    estado_atual = {}
+    if os.path.exists(caminho):
+        with open(caminho, encoding='utf-8') as f:
+            estado_atual = json.load(f)
+    estado_atual.update(dados)
+    temporario = caminho + '.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(estado_atual, f, ensure_ascii=False)
+    os.replace(temporario, caminho)
+
+
+def _agora():
+    return datetime.utcnow().isoformat(timespec='seconds')
+
+
+def _executar(tarefa_id, tipo, diretorio):
+    """Corre no processo filho: gera o relatório e vai registando o progresso."""
+    from app import app
+    import relatorios
+
+    extensao = TIPOS[tipo][0]
+    destino = os.path.join(diretorio, f'{tarefa_id}.{extensao}')
+    _gravar_estado(diretorio, tarefa_id, status='executando', iniciada_em=_agora())
+
+    def progresso(etapa, linhas):
+        _gravar_estado(diretorio, tarefa_id, etapa=etapa, linhas=linhas)
+
+    try:
+        with app.app_context():
+            relatorios.gerar_excel(destino + '.parcial', progresso)
+        os.replace(destino + '.parcial', destino)
+        _gravar_estado(diretorio, tarefa_id, status='concluida', concluida_em=_agora())
+    except Exception as e:
+        if os.path.exists(destino + '.parcial'):
+            os.remove(destino + '.parcial')
+        _gravar_estado(diretorio, tarefa_id, status='erro', erro=str(e), concluida_em=_agora())
+
+
+# --- API usada pelas rotas ---
+
+def submeter(tipo):
+    """Coloca um relatório na fila e devolve o id da tarefa."""
+    if tipo not in TIPOS:
+        raise ValueError(f'Tipo de relatório desconhecido: {tipo}')
+    limpar_expirados()
+
+    diretorio = _diretorio()
+    tarefa_id = uuid.uuid4().hex
+    _gravar_estado(diretorio, tarefa_id, id=tarefa_id, tipo=tipo, status='pendente', criada_em=_agora())
+    _obter_executor().submit(_executar, tarefa_id, tipo, diretorio)
+    return tarefa_id
+
+
+def estado(tarefa_id):
+    """Devolve o dicionário de estado da tarefa, ou None se não existir."""
+    if not _ID_VALIDO.match(tarefa_id):
+        return None
+    caminho = _caminho_estado(_diretorio(), tarefa_id)
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def arquivo(tarefa_id):
+    """Devolve (caminho, mimetype, nome) do relatório concluído, ou None."""
+    dados = estado(tarefa_id)
+    if not dados or dados.get('status') != 'concluida':
+        return None
+    extensao, mimetype, nome = TIPOS[dados['tipo']]
+    return os.path.join(_diretorio(), f'{tarefa_id}.{extensao}'), mimetype, nome
+
+
+def limpar_expirados():
+    """Apaga estados e ficheiros mais antigos que o período de retenção. Devolve quantos apagou."""
+    diretorio = _diretorio()
+    limite = time.time() - current_app.config.get('RELATORIOS_RETENCAO_HORAS', 24) * 3600
+    apagados = 0
+    for nome in os.listdir(diretorio):
+        caminho = os.path.join(diretorio, nome)
+        if os.path.isfile(caminho) and os.path.getmtime(caminho) < limite:
+            os.remove(caminho)
+            apagados += 1
+    return apagados